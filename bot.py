@@ -13,9 +13,11 @@ logging.getLogger("pyrogram").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 class Bot(Client):
-    def __init__(self):
-        super().__init__(
-            name="SerenaBot",
+    # "all" - commands and jobs, "frontend" - commands only, "worker" - jobs only
+    role = Config.WORKER_MODE
+    
+    def __init__(self, name="SerenaBot", **overrides):
+        options = dict(
             api_id=Config.API_ID,
             api_hash=Config.API_HASH,
             bot_token=Config.BOT_TOKEN,
@@ -26,17 +28,41 @@ class Bot(Client):
             max_concurrent_transmissions=5,
             workdir="."
         )
+        options.update(overrides)
+        super().__init__(name=name, **options)
         self.db = None
         
     async def start(self):
         await super().start()
         
+        from utils.http_client import http_client
+        await http_client.start()
+        
         from database.database import Database
         self.db = Database(Config.MONGO_URI)
+        await self.db.ensure_indexes()
+        
+        # Partials of links a stored job still needs are kept for resuming
+        from utils.scratch import scratch, scratch_key
+        scratch.purge_stale({scratch_key(url) for url in await self.db.jobs.open_urls()})
+        
+        if self.role != "worker":
+            from utils.broadcast import resume_broadcasts
+            await resume_broadcasts(self)
+            
+            from utils.stats import stats_loop
+            asyncio.ensure_future(stats_loop(self))
+        
+        if self.role != "frontend":
+            from plugins.download import job_loop
+            asyncio.ensure_future(job_loop(self))
         
         me = await self.get_me()
         self.username = me.username
-        logger.info(f"✅ {me.first_name} Started!")
+        logger.info(f"✅ {me.first_name} Started! ({self.role})")
+        
+        if self.role == "worker":
+            return
         
         try:
             await self.send_message(
@@ -49,7 +75,33 @@ class Bot(Client):
         except Exception as e:
             logger.error(f"Log error: {e}")
     
+    async def save_file(self, path, file_id=None, file_part=0, progress=None, progress_args=()):
+        from utils.stream_upload import StreamSource, upload_stream
+        from utils.metrics import UPLOADS, UPLOAD_SECONDS
+        
+        mode = "stream" if isinstance(path, StreamSource) else "file"
+        try:
+            with UPLOAD_SECONDS.time(mode=mode):
+                if mode == "stream":
+                    result = await upload_stream(self, path, file_id, file_part, progress, progress_args)
+                else:
+                    result = await super().save_file(path, file_id, file_part, progress, progress_args)
+        except BaseException:
+            UPLOADS.inc(mode=mode, result="failed")
+            raise
+        UPLOADS.inc(mode=mode, result="ok")
+        return result
+    
     async def stop(self, *args):
+        if self.db:
+            try:
+                await self.db.jobs.release_owner()
+            except Exception as e:
+                logger.error(f"Job release error: {e}")
+        
+        from utils.http_client import http_client
+        await http_client.close()
+        
         await super().stop()
         logger.info("🛑 Bot Stopped!")
 
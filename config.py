@@ -9,6 +9,11 @@ class Config:
     
     # Database
     MONGO_URI = environ.get("MONGO_URI", "")
+    DB_CACHE_TTL = 60  # Seconds a cached lock/premium/settings read stays valid
+    DB_CACHE_SIZE = 10000
+    STATS_RECONCILE_INTERVAL = 3600  # Seconds between full recounts of the stats counters
+    STATS_KEEP_DAYS = 30  # Daily stats buckets kept in the stats document
+    FILE_CACHE_TTL = 30 * 24 * 3600  # Uploaded file_ids are reused for 30 days
     
     # Media
     START_PIC = environ.get("START_PIC", "https://telegra.ph/file/your-image.jpg")
@@ -29,12 +34,60 @@ class Config:
     
     # Download Settings - Optimized for Render
     CHUNK_SIZE = 2 * 1024 * 1024  # 2MB chunks
-    MAX_CONCURRENT_DOWNLOADS = 3
+    DOWNLOAD_CONNECTIONS = 8  # Parallel ranged connections per file
+    MIN_SPLIT_SIZE = 8 * 1024 * 1024  # Smaller files use a single stream
+    RANGE_RETRIES = 3
+    HLS_CONCURRENCY = 16  # Parallel .ts segment fetches per playlist
+    HLS_SEGMENT_RETRIES = 3
+    MAX_CONCURRENT_DOWNLOADS = 3  # Across all users
+    MAX_DOWNLOADS_PER_USER = 1
     DOWNLOAD_TIMEOUT = 10800  # 3 hours
+    DOWNLOAD_RETRIES = 2  # Extra attempts, resumed from the partial-state journal
+    FFMPEG_STALL_TIMEOUT = 120  # Kill ffmpeg after this long without progress
+    FFMPEG_RETRIES = 2
+    FFMPEG_MAX_PROCESSES = int(environ.get("FFMPEG_MAX_PROCESSES", os.cpu_count() or 1))
+    FFMPEG_MAX_FETCHES = int(environ.get("FFMPEG_MAX_FETCHES", 8))  # M3U8 fetches, network-bound
+    FFMPEG_STDERR_LINES = 50
+    STREAM_UPLOAD = environ.get("STREAM_UPLOAD", "True").lower() == "true"  # Direct links skip the disk
+    STREAM_MIN_SIZE = 10 * 1024 * 1024  # Smaller files aren't worth streaming
+    PROBE_TIMEOUT = 60  # ffprobe / thumbnail frame extraction
+    PROBE_MAX_PROCESSES = 2  # ffprobe runs at once, apart from the ffmpeg pools
+    LINK_PROBE_TTL = 300  # A link's size/playlist probe is reused by later steps this long
+    PROBE_CACHE_SIZE = 256  # Probed files remembered by content hash
+    
+    # Batch pipeline - files downloaded ahead while the previous one uploads
+    PREFETCH_FILES = 2
+    PREFETCH_MAX_BYTES = 3 * 1024 * 1024 * 1024  # 3GB waiting for upload
+    JOB_LEASE = 120  # Seconds a claimed batch item stays ours without a renewal
+    JOB_POLL = 10  # Queue poll / re-check interval while another process holds an item
+    
+    # Scale-out - "all" runs jobs in the bot process, "frontend" only queues them for worker.py
+    WORKER_MODE = environ.get("WORKER_MODE", "all")
+    WORKER_JOBS = int(environ.get("WORKER_JOBS", 2))  # Jobs one process runs at once
+    WORKER_NAME = environ.get("WORKER_NAME", "")  # Session name of worker.py, picked automatically if empty
+    
+    # Scratch disk - shared by every process on the machine, dirs in use are locked
+    SCRATCH_ROOT = environ.get("SCRATCH_ROOT", "downloads/jobs")
+    SCRATCH_MIN_FREE_DISK = 1024 * 1024 * 1024  # Keep 1GB free
+    SCRATCH_DEFAULT_RESERVE = 500 * 1024 * 1024  # When the size can't be known up front
+    SCRATCH_PARTIAL_TTL = 24 * 3600  # Failed downloads stay resumable this long
+    
+    # Shared HTTP pool
+    HTTP_POOL_LIMIT = 100
+    HTTP_LIMIT_PER_HOST = 32  # Must cover DOWNLOAD_CONNECTIONS / HLS_CONCURRENCY
+    HTTP_DNS_TTL = 300
+    HTTP_KEEPALIVE = 30
     
     # Upload Settings
     UPLOAD_TIMEOUT = 7200  # 2 hours
+    TG_SPLIT_SIZE = int(environ.get("TG_SPLIT_SIZE", 1950 * 1024 * 1024))  # Bigger files go out in parts
     
     # Flood Control
     FLOOD_SLEEP = 3
     ETA_UPDATE_INTERVAL = 5
+    
+    # Broadcast - Telegram allows bots about 30 messages/second overall
+    BROADCAST_RATE = 25  # Messages per second across all workers
+    BROADCAST_WORKERS = 20
+    BROADCAST_CHECKPOINT = 5  # Seconds between progress saves / status edits
+    BROADCAST_PAGE = 1000  # User ids fetched per query - a cursor would time out during long FloodWaits
@@ -1,97 +1,289 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, monitoring
 from datetime import datetime, timedelta
+from collections import OrderedDict
+from config import Config
+from database.indexes import ensure_indexes, explain_report
+from database.jobs import JobStore
+from utils.metrics import DB_SECONDS, DB_FAILURES
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+_MISSING = object()
+
+class TTLCache:
+    """Small LRU cache whose entries expire after `ttl` seconds"""
+    
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self.data[key]
+            self.misses += 1
+            return _MISSING
+        
+        self.data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+    
+    def set(self, key, value):
+        self.data[key] = (value, time.monotonic() + self.ttl)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+    
+    def invalidate(self, key):
+        self.data.pop(key, None)
+    
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total * 100) if total else 0,
+            "size": len(self.data)
+        }
+
+class CommandMetrics(monitoring.CommandListener):
+    """Latency of every MongoDB command, labelled by command name"""
+    
+    def started(self, event):
+        pass
+    
+    def succeeded(self, event):
+        DB_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name)
+    
+    def failed(self, event):
+        DB_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name)
+        DB_FAILURES.inc(command=event.command_name)
+
+# downloads_today as it stands now - 0 once the stored count is from a previous day
+_TODAY = {"$dateTrunc": {"date": "$$NOW", "unit": "day"}}
+_DOWNLOADS_TODAY = {
+    "$cond": [
+        {"$lt": [{"$ifNull": ["$last_reset", datetime(1970, 1, 1)]}, _TODAY]},
+        0,
+        {"$ifNull": ["$downloads_today", 0]}
+    ]
+}
+
+def _count_download_pipeline():
+    """Update pipeline adding one download, rolling the daily count over server-side"""
+    return [{"$set": {
+        "downloads_today": {"$add": [_DOWNLOADS_TODAY, 1]},
+        "total_downloads": {"$add": [{"$ifNull": ["$total_downloads", 0]}, 1]},
+        "last_reset": "$$NOW"
+    }}]
+
+def _day_key(day=None):
+    """Name of a daily bucket in the stats document - days are UTC, like $$NOW in the quota pipeline"""
+    return (day or datetime.utcnow()).strftime("%Y-%m-%d")
+
+def _today_start():
+    return datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
 class Database:
-    def __init__(self, uri):
-        self.client = AsyncIOMotorClient(uri)
-        self.db = self.client['serena_bot']
+    def __init__(self, uri, name="serena_bot"):
+        self.client = AsyncIOMotorClient(uri, event_listeners=[CommandMetrics()])
+        self.db = self.client[name]
         self.users = self.db['users']
         self.settings = self.db['settings']
         self.stats = self.db['stats']
+        self.file_cache = self.db['file_cache']
+        self.broadcasts = self.db['broadcasts']
+        self.jobs = JobStore(self.db)
+        # Hot reads (lock flag, premium, settings) - invalidated by our own writes
+        self.cache = TTLCache(Config.DB_CACHE_SIZE, Config.DB_CACHE_TTL)
         
+    async def ping(self):
+        """True when the server answers"""
+        await self.client.admin.command("ping")
+        return True
+    
+    async def ensure_indexes(self):
+        """Create the declared indexes - the atomic upserts below rely on unique user_id"""
+        return await ensure_indexes(self.db)
+    
+    async def explain_report(self):
+        """Query plans of the hot queries, flagging collection scans"""
+        return await explain_report(self.db)
+    
     async def add_user(self, user_id, username=None):
         """Add new user to database"""
-        user = await self.users.find_one({"user_id": user_id})
-        if not user:
-            await self.users.insert_one({
-                "user_id": user_id,
-                "username": username,
-                "is_premium": False,
-                "downloads_today": 0,
-                "total_downloads": 0,
-                "joined_date": datetime.now(),
-                "last_used": datetime.now()
-            })
+        now = datetime.utcnow()
+        before = await self.users.find_one_and_update(
+            {"user_id": user_id},
+            {
+                "$set": {"last_used": now},
+                # Talking to us again means they unblocked the bot
+                "$unset": {"is_dead": "", "dead_reason": "", "dead_since": ""},
+                "$setOnInsert": {
+                    "username": username,
+                    "is_premium": False,
+                    "downloads_today": 0,
+                    "total_downloads": 0,
+                    "joined_date": now
+                }
+            },
+            projection={"last_used": 1, "is_dead": 1, "is_premium": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        
+        today = _day_key(now)
+        inc = {}
+        if before is None:
             logger.info(f"New user added: {user_id}")
-        else:
-            await self.users.update_one(
-                {"user_id": user_id},
-                {"$set": {"last_used": datetime.now()}}
-            )
+            inc["total_users"] = 1
+            inc[f"daily.{today}.new_users"] = 1
+        elif before.get("is_dead"):
+            inc["total_users"] = 1
+            inc["dead_users"] = -1
+            if before.get("is_premium"):
+                inc["premium_users"] = 1
+        
+        last_used = before.get("last_used") if before else None
+        if not last_used or last_used < _today_start():
+            inc[f"daily.{today}.active"] = 1
+        await self._bump_stats(inc)
     
     async def is_premium(self, user_id):
         """Check if user is premium"""
-        user = await self.users.find_one({"user_id": user_id})
-        return user.get("is_premium", False) if user else False
+        cached = self.cache.get(("premium", user_id))
+        if cached is not _MISSING:
+            return cached
+        
+        user = await self.users.find_one({"user_id": user_id}, {"is_premium": 1})
+        premium = user.get("is_premium", False) if user else False
+        self.cache.set(("premium", user_id), premium)
+        return premium
     
     async def add_premium(self, user_id):
         """Add premium to user"""
-        await self.users.update_one(
+        before = await self.users.find_one_and_update(
             {"user_id": user_id},
             {"$set": {"is_premium": True}},
-            upsert=True
+            projection={"is_premium": 1, "is_dead": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
         )
+        self.cache.invalidate(("premium", user_id))
+        
+        # Dead users aren't counted, add_user counts them back when they return
+        if before is None:
+            await self._bump_stats({"premium_users": 1, "total_users": 1})
+        elif not before.get("is_premium") and not before.get("is_dead"):
+            await self._bump_stats({"premium_users": 1})
     
     async def remove_premium(self, user_id):
         """Remove premium from user"""
-        await self.users.update_one(
+        before = await self.users.find_one_and_update(
             {"user_id": user_id},
-            {"$set": {"is_premium": False}}
+            {"$set": {"is_premium": False}},
+            projection={"is_premium": 1, "is_dead": 1},
+            return_document=ReturnDocument.BEFORE
         )
+        self.cache.invalidate(("premium", user_id))
+        
+        if before and before.get("is_premium") and not before.get("is_dead"):
+            await self._bump_stats({"premium_users": -1})
     
     async def get_downloads_today(self, user_id):
         """Get user's downloads today"""
-        user = await self.users.find_one({"user_id": user_id})
+        user = await self.users.find_one(
+            {"user_id": user_id},
+            {"downloads_today": 1, "last_reset": 1}
+        )
         if not user:
             return 0
         
-        # Reset if new day
-        last_reset = user.get("last_reset", datetime.now() - timedelta(days=1))
-        if datetime.now().date() > last_reset.date():
-            await self.users.update_one(
-                {"user_id": user_id},
-                {"$set": {"downloads_today": 0, "last_reset": datetime.now()}}
-            )
+        # A count from a previous day doesn't apply any more
+        last_reset = user.get("last_reset")
+        if not last_reset or datetime.utcnow().date() > last_reset.date():
             return 0
         
         return user.get("downloads_today", 0)
     
+    async def consume_download(self, user_id, limit):
+        """Atomically check the daily quota and count one download.
+        
+        Returns (allowed, downloads_today). The day rollover is computed by
+        MongoDB, so concurrent messages can't both slip under the limit.
+        Never upserts - without a unique user_id index that would add a new
+        user document on every call over the limit.
+        """
+        for _ in range(2):
+            user = await self.users.find_one_and_update(
+                {"user_id": user_id, "$expr": {"$lt": [_DOWNLOADS_TODAY, limit]}},
+                _count_download_pipeline(),
+                projection={"downloads_today": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            if user:
+                await self._bump_stats({f"daily.{_day_key()}.downloads": 1})
+                return True, user.get("downloads_today", 1)
+            
+            # Either the quota is used up or we haven't seen the user yet
+            if await self.users.count_documents({"user_id": user_id}, limit=1):
+                break
+            await self.add_user(user_id)
+        
+        return False, await self.get_downloads_today(user_id)
+    
+    async def refund_download(self, user_id):
+        """Give back a download taken by consume_download that didn't finish"""
+        # A charge from before midnight was already rolled over, nothing to give back today
+        result = await self.users.update_one(
+            {
+                "user_id": user_id,
+                "downloads_today": {"$gt": 0},
+                "$expr": {"$gte": ["$last_reset", _TODAY]}
+            },
+            {"$inc": {"downloads_today": -1, "total_downloads": -1}}
+        )
+        if result.modified_count:
+            await self._bump_stats({f"daily.{_day_key()}.downloads": -1})
+    
     async def increment_downloads(self, user_id):
         """Increment user's download count"""
         await self.users.update_one(
             {"user_id": user_id},
-            {
-                "$inc": {"downloads_today": 1, "total_downloads": 1},
-                "$set": {"last_reset": datetime.now()}
-            }
+            _count_download_pipeline()
         )
+        await self._bump_stats({f"daily.{_day_key()}.downloads": 1})
+    
+    async def count_transfer(self, nbytes):
+        """Add delivered bytes to today's bucket"""
+        await self._bump_stats({f"daily.{_day_key()}.bytes": nbytes})
     
     async def get_user_settings(self, user_id):
         """Get user settings"""
-        settings = await self.settings.find_one({"user_id": user_id})
-        if not settings:
-            default = {
-                "user_id": user_id,
+        cached = self.cache.get(("settings", user_id))
+        if cached is not _MISSING:
+            return dict(cached)
+        
+        settings = await self.settings.find_one_and_update(
+            {"user_id": user_id},
+            {"$setOnInsert": {
                 "channel_id": None,
                 "credit": "Serena",
                 "thumbnail_mode": "random"
-            }
-            await self.settings.insert_one(default)
-            return default
-        return settings
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        
+        self.cache.set(("settings", user_id), settings)
+        return dict(settings)
     
     async def update_settings(self, user_id, key, value):
         """Update user settings"""
@@ -100,6 +292,7 @@ class Database:
             {"$set": {key: value}},
             upsert=True
         )
+        self.cache.invalidate(("settings", user_id))
     
     async def reset_settings(self, user_id):
         """Reset user settings"""
@@ -112,24 +305,75 @@ class Database:
             }},
             upsert=True
         )
+        self.cache.invalidate(("settings", user_id))
+    
+    async def _bump_stats(self, inc):
+        """Apply counter deltas to the stats document - dotted keys reach the daily buckets"""
+        if not inc:
+            return
+        try:
+            await self.stats.update_one({"key": "bot_stats"}, {"$inc": inc}, upsert=True)
+        except Exception as e:
+            logger.error(f"Stats update failed: {e}")
     
     async def get_bot_stats(self):
-        """Get bot statistics"""
-        total_users = await self.users.count_documents({})
-        premium_users = await self.users.count_documents({"is_premium": True})
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        active_today = await self.users.count_documents({"last_used": {"$gte": today}})
+        """Get bot statistics - one read of the incrementally kept counters"""
+        doc = await self.stats.find_one({"key": "bot_stats"})
+        if not doc or "reconciled_at" not in doc:
+            await self.reconcile_stats()
+            doc = await self.stats.find_one({"key": "bot_stats"})
+        
+        daily = doc.get("daily", {})
+        today = daily.get(_day_key(), {})
+        week = [daily.get(_day_key(datetime.utcnow() - timedelta(days=i)), {}) for i in range(7)]
         
         return {
+            "total_users": doc.get("total_users", 0),
+            "premium_users": doc.get("premium_users", 0),
+            "dead_users": doc.get("dead_users", 0),
+            "active_today": today.get("active", 0),
+            "new_today": today.get("new_users", 0),
+            "downloads_today": today.get("downloads", 0),
+            "bytes_today": today.get("bytes", 0),
+            "downloads_week": sum(day.get("downloads", 0) for day in week),
+            "bytes_week": sum(day.get("bytes", 0) for day in week),
+            "reconciled_at": doc.get("reconciled_at")
+        }
+    
+    async def reconcile_stats(self):
+        """Recount the user counters from the users collection and drop old daily buckets"""
+        # Users who blocked the bot or deleted their account don't count
+        dead_users = await self.users.count_documents({"is_dead": True})
+        total_users = await self.users.count_documents({}) - dead_users
+        premium_users = await self.users.count_documents({"is_premium": True, "is_dead": {"$ne": True}})
+        active_today = await self.users.count_documents({"last_used": {"$gte": _today_start()}})
+        
+        update = {"$set": {
             "total_users": total_users,
             "premium_users": premium_users,
-            "active_today": active_today
-        }
+            "dead_users": dead_users,
+            f"daily.{_day_key()}.active": active_today,
+            "reconciled_at": datetime.utcnow()
+        }}
+        
+        doc = await self.stats.find_one({"key": "bot_stats"}, {"daily": 1})
+        cutoff = _day_key(datetime.utcnow() - timedelta(days=Config.STATS_KEEP_DAYS))
+        stale = {f"daily.{day}": "" for day in (doc or {}).get("daily", {}) if day < cutoff}
+        if stale:
+            update["$unset"] = stale
+        
+        await self.stats.update_one({"key": "bot_stats"}, update, upsert=True)
     
     async def is_bot_locked(self):
         """Check if bot is locked"""
+        cached = self.cache.get(("bot_locked",))
+        if cached is not _MISSING:
+            return cached
+        
         status = await self.stats.find_one({"key": "bot_status"})
-        return status.get("locked", False) if status else False
+        locked = status.get("locked", False) if status else False
+        self.cache.set(("bot_locked",), locked)
+        return locked
     
     async def lock_bot(self):
         """Lock the bot"""
@@ -138,6 +382,7 @@ class Database:
             {"$set": {"locked": True}},
             upsert=True
         )
+        self.cache.invalidate(("bot_locked",))
     
     async def unlock_bot(self):
         """Unlock the bot"""
@@ -145,4 +390,132 @@ class Database:
             {"key": "bot_status"},
             {"$set": {"locked": False}},
             upsert=True
-  )
+        )
+        self.cache.invalidate(("bot_locked",))
+    
+    async def get_cached_file(self, url_key=None, content_hash=None):
+        """Telegram file uploaded earlier for this link (or identical content)"""
+        if url_key:
+            cached = await self.file_cache.find_one({"url_key": url_key})
+            if cached:
+                return cached
+        if content_hash:
+            return await self.file_cache.find_one({"content_hash": content_hash})
+        return None
+    
+    async def cache_file(self, url_key, file_id, media_type, file_size, file_name=None, content_hash=None):
+        """Remember an uploaded file - created_at drives the TTL index"""
+        fields = {
+            "file_id": file_id,
+            "media_type": media_type,
+            "file_size": file_size,
+            "file_name": file_name
+        }
+        if content_hash:
+            fields["content_hash"] = content_hash
+        
+        # Re-sending a cached file must not restart its TTL, or popular entries never expire
+        await self.file_cache.update_one(
+            {"url_key": url_key},
+            {"$set": fields, "$setOnInsert": {"created_at": datetime.utcnow()}},
+            upsert=True
+        )
+    
+    async def drop_cached_file(self, file_id):
+        """Forget a file_id Telegram no longer accepts"""
+        await self.file_cache.delete_many({"file_id": file_id})
+    
+    async def user_id_page(self, after=None, limit=1000):
+        """Next `limit` reachable user ids in ascending order after `after` - no cursor kept open"""
+        query = {"is_dead": {"$ne": True}}
+        if after is not None:
+            query["user_id"] = {"$gt": after}
+        cursor = self.users.find(query, {"user_id": 1, "_id": 0}).sort("user_id", 1).limit(limit)
+        return [user["user_id"] async for user in cursor]
+    
+    async def count_users(self, after=None):
+        query = {"is_dead": {"$ne": True}}
+        if after is not None:
+            query["user_id"] = {"$gt": after}
+        return await self.users.count_documents(query)
+    
+    async def mark_dead_users(self, entries):
+        """Flag users who blocked the bot or deleted their account, entries are (user_id, reason)"""
+        now = datetime.utcnow()
+        
+        async def mark(premium):
+            result = await self.users.bulk_write([
+                UpdateOne(
+                    {"user_id": user_id, "is_dead": {"$ne": True}, "is_premium": premium},
+                    {"$set": {"is_dead": True, "dead_reason": reason, "dead_since": now}}
+                )
+                for user_id, reason in entries
+            ], ordered=False)
+            return result.modified_count
+        
+        # Premium users first, so the premium counter drops by exactly the ones marked
+        premium = await mark(True)
+        dead = premium + await mark({"$ne": True})
+        
+        if dead:
+            inc = {"dead_users": dead, "total_users": -dead}
+            if premium:
+                inc["premium_users"] = -premium
+            await self._bump_stats(inc)
+    
+    async def dead_users_report(self):
+        """Dead user counts by reason"""
+        pipeline = [
+            {"$match": {"is_dead": True}},
+            {"$group": {"_id": "$dead_reason", "count": {"$sum": 1}}}
+        ]
+        return {
+            row["_id"] or "unknown": row["count"]
+            async for row in self.users.aggregate(pipeline)
+        }
+    
+    async def purge_dead_users(self):
+        """Delete dead users and their settings, returns how many were removed"""
+        user_ids = await self.users.distinct("user_id", {"is_dead": True})
+        if not user_ids:
+            return 0
+        
+        result = await self.users.delete_many({"is_dead": True})
+        await self.settings.delete_many({"user_id": {"$in": user_ids}})
+        for user_id in user_ids:
+            self.cache.invalidate(("settings", user_id))
+            self.cache.invalidate(("premium", user_id))
+        await self._bump_stats({"dead_users": -result.deleted_count})
+        return result.deleted_count
+    
+    async def create_broadcast(self, from_chat_id, message_id, status_chat_id, status_message_id, total):
+        """Checkpoint document for a new broadcast"""
+        now = datetime.utcnow()
+        doc = {
+            "from_chat_id": from_chat_id,
+            "message_id": message_id,
+            "status_chat_id": status_chat_id,
+            "status_message_id": status_message_id,
+            "status": "running",
+            "last_user_id": None,
+            "total": total,
+            "success": 0,
+            "failed": 0,
+            "started_at": now,
+            "updated_at": now
+        }
+        result = await self.broadcasts.insert_one(doc)
+        doc["_id"] = result.inserted_id
+        return doc
+    
+    async def update_broadcast(self, broadcast_id, fields):
+        fields = dict(fields, updated_at=datetime.utcnow())
+        await self.broadcasts.update_one({"_id": broadcast_id}, {"$set": fields})
+    
+    async def get_running_broadcasts(self):
+        return await self.broadcasts.find({"status": "running"}).to_list(length=100)
+    
+    def cache_stats(self):
+        """Hit/miss counters of the read cache"""
+        return self.cache.stats()
+
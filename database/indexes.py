@@ -0,0 +1,101 @@
+from datetime import datetime
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# (collection, keys, options) - every query the bot runs should be covered here
+INDEXES = [
+    ("users", [("user_id", 1)], {"unique": True}),
+    ("users", [("last_used", 1)], {}),
+    ("users", [("is_premium", 1)], {}),
+    # Broadcast cursor: walks user_id order and filters is_dead from the index keys
+    ("users", [("user_id", 1), ("is_dead", 1)], {}),
+    ("users", [("is_dead", 1)], {"sparse": True}),
+    ("settings", [("user_id", 1)], {"unique": True}),
+    ("stats", [("key", 1)], {"unique": True}),
+    ("file_cache", [("url_key", 1)], {"unique": True}),
+    ("file_cache", [("content_hash", 1)], {"sparse": True}),
+    ("file_cache", [("created_at", 1)], {"expireAfterSeconds": Config.FILE_CACHE_TTL}),
+    ("broadcasts", [("status", 1)], {}),
+    # Workers claim the oldest running job
+    ("jobs", [("status", 1), ("created_at", 1)], {}),
+    ("jobs", [("user_id", 1), ("status", 1)], {}),
+]
+
+
+def _today():
+    return datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# (label, explain command) for the hot queries the bot issues
+def query_plans():
+    return [
+        ("users by user_id", {"find": "users", "filter": {"user_id": 0}}),
+        ("settings by user_id", {"find": "settings", "filter": {"user_id": 0}}),
+        ("stats by key", {"find": "stats", "filter": {"key": "bot_status"}}),
+        ("bot stats", {"find": "stats", "filter": {"key": "bot_stats"}}),
+        ("count premium", {"count": "users", "query": {"is_premium": True, "is_dead": {"$ne": True}}}),
+        ("count active today", {"count": "users", "query": {"last_used": {"$gte": _today()}}}),
+        ("file_cache by url", {"find": "file_cache", "filter": {"url_key": ""}}),
+        ("file_cache by hash", {"find": "file_cache", "filter": {"content_hash": ""}}),
+        ("broadcast user cursor", {
+            "find": "users",
+            "filter": {"user_id": {"$gt": 0}, "is_dead": {"$ne": True}},
+            "sort": {"user_id": 1}
+        }),
+        ("count dead users", {"count": "users", "query": {"is_dead": True}}),
+        ("running broadcasts", {"find": "broadcasts", "filter": {"status": "running"}}),
+        ("claimable jobs", {
+            "find": "jobs",
+            "filter": {"status": "running", "$or": [{"worker": None}, {"worker_lease_until": {"$lt": _today()}}]},
+            "sort": {"created_at": 1}
+        }),
+        ("user's running job", {"find": "jobs", "filter": {"user_id": 0, "status": "running"}}),
+    ]
+
+
+async def ensure_indexes(db):
+    """Create every declared index - safe to run on each start"""
+    created = []
+    for collection, keys, options in INDEXES:
+        try:
+            name = await db[collection].create_index(keys, **options)
+            created.append(f"{collection}.{name}")
+        except Exception as e:
+            logger.error(f"Index {collection}.{keys} failed: {e}")
+    logger.info(f"Indexes ready: {', '.join(created)}")
+    return created
+
+
+def plan_stages(plan):
+    """All stage names of an explain winningPlan, outermost first"""
+    stages = []
+    while plan:
+        stages.append(plan.get("stage"))
+        if "inputStage" in plan:
+            plan = plan["inputStage"]
+        elif plan.get("inputStages"):
+            for child in plan["inputStages"]:
+                stages.extend(plan_stages(child))
+            break
+        else:
+            break
+    return stages
+
+
+async def explain_report(db):
+    """Explain each hot query and return [(label, stages, is_collscan)]"""
+    report = []
+    for label, command in query_plans():
+        try:
+            result = await db.command({"explain": command, "verbosity": "queryPlanner"})
+            planner = result.get("queryPlanner", {})
+            # Newer servers nest the plan under queryPlan
+            winning = planner.get("winningPlan", {})
+            winning = winning.get("queryPlan", winning)
+            stages = [s for s in plan_stages(winning) if s]
+            report.append((label, stages, "COLLSCAN" in stages))
+        except Exception as e:
+            report.append((label, [f"error: {e}"], False))
+    return report
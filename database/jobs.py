@@ -0,0 +1,210 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from config import Config
+
+# Identifies this process as the holder of item leases
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+ITEM_STATES = ("pending", "downloading", "uploaded", "failed")
+
+
+class JobStore:
+    """
+    Batch jobs persisted in MongoDB: one document per TXT batch with the state
+    of every item. A process works a job while it holds the job's lease, and
+    each item under its own lease, so a batch interrupted by a restart - or a
+    worker that died - continues from the first item that isn't finished.
+    """
+
+    def __init__(self, db):
+        self.jobs = db['jobs']
+
+    async def create(self, fields, files, worker=None):
+        """New job - `worker` claims it right away, otherwise it waits for a worker to take it"""
+        now = datetime.utcnow()
+        doc = dict(
+            fields,
+            status="running",
+            worker=worker,
+            worker_lease_until=now + timedelta(seconds=Config.JOB_LEASE) if worker else None,
+            heartbeat_at=now,
+            items=[
+                {
+                    "idx": idx,
+                    "title": f['title'],
+                    "url": f['url'],
+                    "state": "pending",
+                    "attempts": 0,
+                    "owner": None,
+                    "claim": None,
+                    "lease_until": None,
+                    "message_id": None,
+                    "file_id": None
+                }
+                for idx, f in enumerate(files, 1)
+            ],
+            created_at=now,
+            updated_at=now
+        )
+        result = await self.jobs.insert_one(doc)
+        doc["_id"] = result.inserted_id
+        return doc
+
+    async def get(self, job_id):
+        return await self.jobs.find_one({"_id": job_id})
+
+    async def claim_job(self, owner=WORKER_ID, busy_users=()):
+        """Take the oldest job nobody holds a live lease on - skipping users we're already serving"""
+        now = datetime.utcnow()
+        return await self.jobs.find_one_and_update(
+            {
+                "status": "running",
+                "user_id": {"$nin": list(busy_users)},
+                "$or": [{"worker": None}, {"worker_lease_until": {"$lt": now}}]
+            },
+            {"$set": {
+                "worker": owner,
+                "worker_lease_until": now + timedelta(seconds=Config.JOB_LEASE),
+                "heartbeat_at": now
+            }},
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def open_urls(self):
+        """Links of items that still have to be downloaded"""
+        return await self.jobs.distinct(
+            "items.url",
+            {"status": "running", "items.state": {"$in": ["pending", "downloading"]}}
+        )
+
+    async def running_for(self, user_id):
+        return await self.jobs.find_one({"user_id": user_id, "status": "running"}, {"items": 0})
+
+    async def claim(self, job_id, owner=WORKER_ID):
+        """Lease the first item still to do, None when nothing is claimable right now"""
+        now = datetime.utcnow()
+        claim = ObjectId()
+        doc = await self.jobs.find_one_and_update(
+            {
+                "_id": job_id,
+                "status": "running",
+                "items": {"$elemMatch": {"$or": [
+                    {"state": "pending"},
+                    # Its holder died without finishing it
+                    {"state": "downloading", "lease_until": {"$lt": now}}
+                ]}}
+            },
+            {
+                "$set": {
+                    "items.$.state": "downloading",
+                    "items.$.owner": owner,
+                    "items.$.claim": claim,
+                    "items.$.lease_until": now + timedelta(seconds=Config.JOB_LEASE),
+                    "updated_at": now
+                },
+                "$inc": {"items.$.attempts": 1}
+            },
+            projection={"items": {"$elemMatch": {"claim": claim}}},
+            return_document=ReturnDocument.AFTER
+        )
+        return doc["items"][0] if doc and doc.get("items") else None
+
+    async def leased_elsewhere(self, job_id, owner=WORKER_ID):
+        """Whether another process holds a live lease on one of the job's items"""
+        return await self.jobs.find_one(
+            {
+                "_id": job_id,
+                "status": "running",
+                "items": {"$elemMatch": {
+                    "state": "downloading",
+                    "owner": {"$ne": owner},
+                    "lease_until": {"$gte": datetime.utcnow()}
+                }}
+            },
+            {"_id": 1}
+        ) is not None
+
+    async def heartbeat(self, job_id, owner=WORKER_ID):
+        """Extend our job lease and item leases - the job's status, None once it isn't ours"""
+        now = datetime.utcnow()
+        until = now + timedelta(seconds=Config.JOB_LEASE)
+        doc = await self.jobs.find_one_and_update(
+            {"_id": job_id, "worker": owner},
+            {"$set": {
+                "worker_lease_until": until,
+                "heartbeat_at": now,
+                "items.$[mine].lease_until": until
+            }},
+            array_filters=[{"mine.owner": owner, "mine.state": "downloading"}],
+            projection={"status": 1}
+        )
+        return doc["status"] if doc else None
+
+    async def finish(self, job_id, item, state, message_id=None, file_id=None, error=None):
+        """Record an item's outcome - ignored if the lease was lost to someone else"""
+        fields = {
+            "items.$.state": state,
+            "items.$.lease_until": None,
+            "updated_at": datetime.utcnow()
+        }
+        if message_id:
+            fields["items.$.message_id"] = message_id
+        if file_id:
+            fields["items.$.file_id"] = file_id
+        if error:
+            fields["items.$.error"] = error[:200]
+
+        result = await self.jobs.update_one(
+            {"_id": job_id, "items": {"$elemMatch": {"idx": item["idx"], "claim": item["claim"]}}},
+            {"$set": fields}
+        )
+        return result.modified_count == 1
+
+    async def release(self, job_id, item):
+        """Hand a claimed item back untouched, e.g. when stopping mid-download"""
+        await self.jobs.update_one(
+            {"_id": job_id, "items": {"$elemMatch": {"idx": item["idx"], "claim": item["claim"]}}},
+            {"$set": {"items.$.state": "pending", "items.$.lease_until": None, "items.$.owner": None}}
+        )
+
+    async def release_owner(self, owner=WORKER_ID):
+        """Hand back everything `owner` holds - a clean shutdown doesn't make others wait out the lease"""
+        await self.jobs.update_many(
+            {"worker": owner},
+            {"$set": {"worker": None, "worker_lease_until": None}}
+        )
+        await self.jobs.update_many(
+            {"status": "running", "items": {"$elemMatch": {"owner": owner, "state": "downloading"}}},
+            {"$set": {
+                "items.$[mine].state": "pending",
+                "items.$[mine].owner": None,
+                "items.$[mine].lease_until": None
+            }},
+            array_filters=[{"mine.owner": owner, "mine.state": "downloading"}]
+        )
+
+    async def set_status(self, job_id, status, **fields):
+        await self.jobs.update_one(
+            {"_id": job_id},
+            {"$set": dict(fields, status=status, updated_at=datetime.utcnow())}
+        )
+
+    async def cancel_user(self, user_id):
+        result = await self.jobs.update_many(
+            {"user_id": user_id, "status": "running"},
+            {"$set": {"status": "cancelled", "updated_at": datetime.utcnow()}}
+        )
+        return result.modified_count
+
+
+def item_counts(job):
+    """state -> number of items"""
+    counts = dict.fromkeys(ITEM_STATES, 0)
+    for item in job.get("items", []):
+        counts[item["state"]] += 1
+    return counts
@@ -1,6 +1,8 @@
-from flask import Flask
+import asyncio
+from flask import Flask, Response
 from threading import Thread
-from bot import start_bot
+from bot import bot, start_bot
+from utils.metrics import render
 
 app = Flask(__name__)
 
@@ -8,9 +10,34 @@ app = Flask(__name__)
 def home():
     return "✅ Serena Lec Bot is Running!"
 
+def mongo_alive():
+    # The Mongo client belongs to the bot's event loop, ask it from there
+    if not bot.db:
+        return False
+    future = asyncio.run_coroutine_threadsafe(bot.db.ping(), bot.loop)
+    try:
+        return future.result(timeout=5)
+    except Exception:
+        future.cancel()
+        return False
+
 @app.route('/health')
 def health():
-    return {"status": "healthy", "bot": "Serena Lec"}
+    telegram = bool(bot.is_connected)
+    mongo = mongo_alive()
+    healthy = telegram and mongo
+
+    body = {
+        "status": "healthy" if healthy else "unhealthy",
+        "bot": "Serena Lec",
+        "telegram": telegram,
+        "mongo": mongo
+    }
+    return body, 200 if healthy else 503
+
+@app.route('/metrics')
+def metrics():
+    return Response(render(), mimetype="text/plain; version=0.0.4")
 
 def run():
     app.run(host='0.0.0.0', port=8080)
@@ -2,8 +2,9 @@ from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 from config import Config
 import time
-import psutil
-import asyncio
+from utils.broadcast import start_broadcast, cancel_broadcasts
+from utils.stats import system_stats
+from utils.progress import humanbytes
 
 def is_owner(user_id):
     return user_id in Config.OWNERS
@@ -90,22 +91,29 @@ async def remove_premium_command(client: Client, message: Message):
 async def stats_command(client: Client, message: Message):
     stats = await client.db.get_bot_stats()
     is_locked = await client.db.is_bot_locked()
+    cache = client.db.cache_stats()
     
     # System stats
-    cpu = psutil.cpu_percent()
-    ram = psutil.virtual_memory().percent
-    disk = psutil.disk_usage('/').percent
+    system = await system_stats()
     
     text = f"📊 **Bot Statistics**\n\n"
     text += f"**Bot Status:**\n"
     text += f"🔐 Lock: {'🔒 Locked' if is_locked else '🔓 Unlocked'}\n"
-    text += f"⚡ CPU: {cpu}%\n"
-    text += f"💾 RAM: {ram}%\n"
-    text += f"💿 Disk: {disk}%\n\n"
+    text += f"⚡ CPU: {system['cpu']}%\n"
+    text += f"💾 RAM: {system['ram']}%\n"
+    text += f"💿 Disk: {system['disk']}%\n\n"
     text += f"**User Statistics:**\n"
     text += f"👥 Total Users: {stats['total_users']}\n"
     text += f"💎 Premium Users: {stats['premium_users']}\n"
-    text += f"🟢 Active Today: {stats['active_today']}\n\n"
+    text += f"🟢 Active Today: {stats['active_today']}\n"
+    text += f"🆕 New Today: {stats['new_today']}\n"
+    text += f"🪦 Blocked/Deleted: {stats['dead_users']}\n\n"
+    text += f"**Downloads:**\n"
+    text += f"📥 Today: {stats['downloads_today']} ({humanbytes(stats['bytes_today'])})\n"
+    text += f"📆 Last 7 Days: {stats['downloads_week']} ({humanbytes(stats['bytes_week'])})\n\n"
+    text += f"**DB Cache:**\n"
+    text += f"🎯 Hits: {cache['hits']} | Misses: {cache['misses']}\n"
+    text += f"📈 Hit Rate: {cache['hit_rate']:.1f}% ({cache['size']} keys)\n\n"
     text += f"📅 **Time:** {time.strftime('%Y-%m-%d %H:%M:%S')}"
     
     buttons = [
@@ -115,28 +123,67 @@ async def stats_command(client: Client, message: Message):
     
     await message.reply_text(text, reply_markup=InlineKeyboardMarkup(buttons))
 
+@Client.on_message(filters.command("dbreport") & filters.user(Config.OWNERS))
+async def dbreport_command(client: Client, message: Message):
+    msg = await message.reply_text("🔍 **Checking indexes...**")
+    
+    created = await client.db.ensure_indexes()
+    report = await client.db.explain_report()
+    
+    text = f"🗂️ **Index Report**\n\n"
+    text += f"**Indexes:** {len(created)}\n"
+    for name in created:
+        text += f"• `{name}`\n"
+    
+    text += f"\n**Query Plans:**\n"
+    for label, stages, is_collscan in report:
+        icon = "🔴" if is_collscan else "🟢"
+        text += f"{icon} {label}: `{' > '.join(stages)}`\n"
+    
+    scans = sum(1 for _, _, is_collscan in report if is_collscan)
+    if scans:
+        text += f"\n⚠️ **{scans} COLLSCAN found!**"
+    else:
+        text += f"\n✅ No collection scans"
+    
+    await msg.edit_text(text)
+
 @Client.on_message(filters.command("broadcast") & filters.user(Config.OWNERS))
 async def broadcast_command(client: Client, message: Message):
+    if len(message.command) > 1 and message.command[1].lower() == "cancel":
+        stopped = cancel_broadcasts()
+        await message.reply_text(f"🛑 **Stopping {stopped} broadcast(s)...**" if stopped else "❌ **No running broadcast!**")
+        return
+    
     if message.reply_to_message:
         msg = await message.reply_text("📢 **Broadcasting...**")
-        users = await client.db.users.find({}).to_list(length=None)
-        
-        success = 0
-        failed = 0
-        
-        for user in users:
-            try:
-                await message.reply_to_message.copy(user['user_id'])
-                success += 1
-            except:
-                failed += 1
-            
-            await asyncio.sleep(0.1)
-        
+        broadcast = await start_broadcast(client, message, msg)
         await msg.edit_text(
-            f"✅ **Broadcast Complete!**\n\n"
-            f"✅ Success: {success}\n"
-            f"❌ Failed: {failed}"
+            f"📢 **Broadcast started!**\n\n"
+            f"👥 Users: {broadcast.total}\n"
+            f"⚡ Rate: {Config.BROADCAST_RATE} msg/s\n\n"
+            f"💡 `/broadcast cancel` to stop"
         )
     else:
         await message.reply_text("Reply to a message to broadcast!")
+
+@Client.on_message(filters.command("deadusers") & filters.user(Config.OWNERS))
+async def deadusers_command(client: Client, message: Message):
+    if len(message.command) > 1 and message.command[1].lower() == "purge":
+        msg = await message.reply_text("🧹 **Purging dead users...**")
+        removed = await client.db.purge_dead_users()
+        await msg.edit_text(f"✅ **Removed {removed} dead user(s)!**")
+        return
+    
+    report = await client.db.dead_users_report()
+    if not report:
+        await message.reply_text("✅ **No dead users!**")
+        return
+    
+    text = f"🪦 **Dead Users**\n\n"
+    for reason, count in sorted(report.items(), key=lambda item: -item[1]):
+        text += f"• {reason.title()}: {count}\n"
+    text += f"\n👥 Total: {sum(report.values())}\n\n"
+    text += f"💡 `/deadusers purge` to delete them"
+    
+    await message.reply_text(text)
@@ -1,8 +1,17 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-from utils.progress import progress_for_pyrogram
-from utils.helpers import clean_filename, generate_thumbnail
-from utils.universal_downloader import download_any_file
+from utils.progress import reporter_for, format_time
+from utils.helpers import clean_filename, generate_thumbnail, is_cancelled, CancelToken
+from utils.stream_upload import open_stream, StreamSeekRequired
+from utils.scheduler import scheduler, lane_for, JobCancelled, LANE_NAMES
+from utils.ffmpeg_runner import ffmpeg_runner
+from utils.singleflight import singleflight
+from utils.file_cache import lookup_cached, lookup_by_content, send_cached, remember_upload, uploaded_media
+from utils.stats import record_transfer
+from utils.media_probe import probe_media, video_attributes, frame_thumbnail
+from utils.splitter import upload_limit, planned_parts, split_file, part_caption
+from utils.universal_downloader import probe_link
+from database.jobs import item_counts, WORKER_ID
 from config import Config
 import asyncio
 import os
@@ -13,14 +22,27 @@ import re
 
 # Store active tasks
 active_tasks = {}
+# user_id -> cancel tokens of running direct links, a user can have several
+single_tasks = {}
 
 @Client.on_message(filters.command("cancel") & filters.private)
 async def cancel_task(client: Client, message: Message):
     """Cancel ongoing download task"""
     user_id = message.from_user.id
     
-    if user_id in active_tasks:
-        active_tasks[user_id]['cancelled'] = True
+    dropped = scheduler.cancel_user(user_id)
+    # Also stops a stored batch that isn't running in this process yet
+    stopped_jobs = await client.db.jobs.cancel_user(user_id)
+    
+    singles = single_tasks.get(user_id, set())
+    for token in singles:
+        token.cancel()
+        ffmpeg_runner.cancel_user(token)
+    
+    if user_id in active_tasks or singles or dropped or stopped_jobs:
+        if user_id in active_tasks:
+            active_tasks[user_id]['cancelled'] = True
+            ffmpeg_runner.cancel_user(user_id)
         await message.reply_text(
             "🛑 **Cancelling...**\n\n"
             "⏳ Stopping downloads...\n"
@@ -29,6 +51,34 @@ async def cancel_task(client: Client, message: Message):
     else:
         await message.reply_text("❌ **No active task!**")
 
+@Client.on_message(filters.command("queue") & filters.private)
+async def queue_command(client: Client, message: Message):
+    """Show queue position and estimated start"""
+    user_id = message.from_user.id
+    running, waiting = scheduler.user_view(user_id)
+    
+    text = f"📋 **Download Queue**\n\n"
+    text += f"⚡ Active: {len(scheduler.running)}/{scheduler.max_concurrent}\n"
+    text += f"⏳ Waiting: {scheduler.waiting_count}\n\n"
+    
+    if not running and not waiting:
+        text += "✅ You have nothing queued."
+    
+    for ticket in running:
+        elapsed = format_time(int(time.time() - ticket.started_at))
+        text += f"📥 `{ticket.label[:40]}`\n   Running for {elapsed}\n"
+    
+    for ticket, position, eta in waiting[:10]:
+        text += (
+            f"🕐 `{ticket.label[:40]}`\n"
+            f"   #{position} ({LANE_NAMES[ticket.lane]}) - starts in ~{format_time(int(eta))}\n"
+        )
+    
+    if len(waiting) > 10:
+        text += f"\n➕ {len(waiting) - 10} more..."
+    
+    await message.reply_text(text)
+
 @Client.on_message(filters.document & filters.private)
 async def handle_txt_file(client: Client, message: Message):
     """Handle TXT file uploads"""
@@ -37,11 +87,12 @@ async def handle_txt_file(client: Client, message: Message):
     if await client.db.is_bot_locked() and user_id not in Config.OWNERS:
         return
     
-    if user_id in active_tasks and not active_tasks[user_id].get('cancelled'):
-        await message.reply_text("⚠️ **Task running!** Use /cancel first")
+    if not message.document.file_name.endswith('.txt'):
         return
     
-    if not message.document.file_name.endswith('.txt'):
+    running = user_id in active_tasks and not active_tasks[user_id].get('cancelled')
+    if running or await client.db.jobs.running_for(user_id):
+        await message.reply_text("⚠️ **Task running!** Use /cancel first")
         return
     
     await process_txt_file(client, message)
@@ -117,156 +168,447 @@ async def process_txt_file(client: Client, message: Message):
         
         await asyncio.sleep(2)
         
-        settings = await client.db.get_user_settings(user_id)
-        credit = settings.get('credit', 'Serena')
-        channel_id = settings.get('channel_id')
-        thumbnail_mode = settings.get('thumbnail_mode', 'random')
+        fields = await job_fields(client, message, status, is_premium)
         
-        if channel_id:
-            try:
-                await client.get_chat(channel_id)
-                target_chat = channel_id
-                reply_to = None
-            except:
-                target_chat = message.chat.id
-                reply_to = message.id
-        else:
-            target_chat = message.chat.id
-            reply_to = message.id
+        if Config.WORKER_MODE == "frontend":
+            # A worker process picks it up from the shared queue
+            await client.db.jobs.create(fields, files)
+            await status.edit_text(
+                f"🕐 **Queued {len(files)} files**\n\n"
+                f"⏳ Starts as soon as a worker is free...\n\n"
+                f"💡 /cancel to stop"
+            )
+            return
         
-        is_topic = False
-        topic_id = None
-        if target_chat == message.chat.id and hasattr(message, 'message_thread_id'):
-            is_topic = True
-            topic_id = message.message_thread_id
+        job = await client.db.jobs.create(fields, files, worker=WORKER_ID)
+        await run_batch(client, job, status)
         
+    except Exception as e:
+        await message.reply_text(f"❌ Error: `{str(e)}`")
+    
+    finally:
+        if user_id in active_tasks:
+            del active_tasks[user_id]
+
+async def job_fields(client: Client, message: Message, status, is_premium, to_channel=True):
+    """Everything a job needs stored with it - any worker can run it, also after a restart"""
+    user_id = message.from_user.id
+    settings = await client.db.get_user_settings(user_id)
+    credit = settings.get('credit', 'Serena')
+    channel_id = settings.get('channel_id') if to_channel else None
+    thumbnail_mode = settings.get('thumbnail_mode', 'random')
+    
+    if channel_id:
+        try:
+            await client.get_chat(channel_id)
+            target_chat = channel_id
+            reply_to = None
+        except:
+            target_chat = message.chat.id
+            reply_to = message.id
+    else:
+        target_chat = message.chat.id
+        reply_to = message.id
+    
+    is_topic = False
+    topic_id = None
+    if target_chat == message.chat.id and hasattr(message, 'message_thread_id'):
+        is_topic = True
+        topic_id = message.message_thread_id
+    
+    return {
+        "user_id": user_id,
+        "is_premium": is_premium,
+        "chat_id": message.chat.id,
+        "message_id": message.id,
+        "mention": message.from_user.mention,
+        "status_chat_id": status.chat.id,
+        "status_message_id": status.id,
+        "target_chat": target_chat,
+        "reply_to": reply_to,
+        "is_topic": is_topic,
+        "topic_id": topic_id,
+        "credit": credit,
+        "thumbnail_mode": thumbnail_mode
+    }
+
+async def keep_alive(jobs, job_id, user_id):
+    """Heartbeat our job and item leases - stops the batch once it's cancelled or taken over"""
+    while True:
+        await asyncio.sleep(Config.JOB_LEASE / 3)
+        try:
+            state = await jobs.heartbeat(job_id)
+        except Exception as e:
+            print(f"Heartbeat error: {e}")
+            continue
+        
+        if state != 'running' and user_id in active_tasks:
+            # None - our lease ran out and another worker owns the job now
+            active_tasks[user_id]['lost'] = state is None
+            active_tasks[user_id]['cancelled'] = True
+            scheduler.cancel_user(user_id)
+            ffmpeg_runner.cancel_user(user_id)
+            return
+
+async def run_batch(client: Client, job, status):
+    """Download and upload a batch job's items - an interrupted job continues where it stopped"""
+    user_id = job['user_id']
+    jobs = client.db.jobs
+    files = job['items']
+    target_chat = job['target_chat']
+    reply_to = job['reply_to']
+    is_topic = job['is_topic']
+    topic_id = job['topic_id']
+    credit = job['credit']
+    thumbnail_mode = job['thumbnail_mode']
+    
+    heartbeat = asyncio.ensure_future(keep_alive(jobs, job['_id'], user_id))
+    
+    try:
         try:
             await status.pin()
         except:
             pass
         
         active_tasks[user_id]['status'] = 'downloading'
+        lane = lane_for(user_id, job['is_premium'])
+        limit = upload_limit(client)
         
-        success = 0
-        failed = 0
-        failed_files = []
+        # Items finished before a restart count too
+        done = item_counts(job)
+        counts = {'success': done['uploaded'], 'failed': done['failed']}
+        failed_files = [i['title'] for i in files if i['state'] == 'failed']
         
-        for idx, file_data in enumerate(files, 1):
-            if active_tasks[user_id]['cancelled']:
-                await status.edit_text(
-                    f"🛑 **Cancelled!**\n\n"
-                    f"✅ Success: {success}\n"
-                    f"❌ Failed: {failed}"
-                )
-                break
-            
+        async def mark(item, state, sent=None, error=None):
+            found = uploaded_media(sent) if sent else None
             try:
-                await status.edit_text(
-                    f"📥 **Downloading**\n\n"
-                    f"📊 {idx}/{len(files)}\n"
-                    f"📝 `{file_data['title'][:50]}...`\n\n"
-                    f"✅ Success: {success}\n"
-                    f"❌ Failed: {failed}\n\n"
-                    f"💡 /cancel to stop"
-                )
-                
-                file_path = await download_any_file(
-                    file_data['url'],
-                    file_data['title'],
-                    status,
-                    user_id
+                await jobs.finish(
+                    job['_id'], item, state,
+                    sent.id if sent else None,
+                    found[1].file_id if found else None,
+                    error
                 )
-                
-                if active_tasks[user_id]['cancelled']:
-                    if file_path and os.path.exists(file_path):
-                        try:
-                            os.remove(file_path)
-                        except:
-                            pass
-                    break
-                
-                if file_path and os.path.exists(file_path):
-                    caption = f"📁 **{file_data['title']}**\n\n"
-                    caption += f"📊 File {idx} of {len(files)}\n"
-                    caption += f"✨ Extracted by: {credit}"
+            except Exception as e:
+                print(f"Job update error: {e}")
+        
+        # Downloaded files wait here for the upload worker, so item N+1 downloads
+        # while item N uploads
+        ready = asyncio.Queue(maxsize=Config.PREFETCH_FILES)
+        disk = {'queued': 0, 'changed': asyncio.Condition()}
+        
+        async def wait_for_disk():
+            async with disk['changed']:
+                while disk['queued'] and not prefetch_fits(disk['queued']):
+                    await disk['changed'].wait()
+        
+        async def release_disk(size):
+            async with disk['changed']:
+                disk['queued'] -= size
+                disk['changed'].notify_all()
+        
+        interrupted = {'error': None}
+        
+        async def download_worker():
+            try:
+                while not active_tasks[user_id]['cancelled']:
+                    try:
+                        # An item held by a process that died comes first - wait for its lease to run out
+                        if await jobs.leased_elsewhere(job['_id']):
+                            await asyncio.sleep(Config.JOB_POLL)
+                            continue
+                        
+                        item = await jobs.claim(job['_id'])
+                    except Exception as e:
+                        # Store unreachable - stop here, once our job lease runs out a worker picks it up again
+                        print(f"Job claim error: {e}")
+                        interrupted['error'] = e
+                        break
                     
-                    file_ext = file_path.split('.')[-1].lower()
+                    if item is None:
+                        break
                     
-                    upload_msg = await status.edit_text(
-                        f"📤 **Uploading**\n\n`{file_data['title']}`"
-                    )
+                    idx, file_data = item['idx'], item
                     
-                    if file_ext in ['mp4', 'mkv', 'avi', 'mov', 'flv', 'wmv', 'webm']:
-                        thumb = None
-                        if thumbnail_mode == 'random' and random.randint(1, 3) == 1:
-                            thumb = await generate_thumbnail()
+                    # Already uploaded once - the upload worker re-sends the file_id
+                    cached = await lookup_cached(client, file_data['url'])
+                    if cached:
+                        await ready.put((item, None, 0, cached))
+                        continue
+                    
+                    await wait_for_disk()
+                    if active_tasks[user_id]['cancelled']:
+                        await jobs.release(job['_id'], item)
+                        break
+                    
+                    try:
+                        # Oversize files are known before the download starts - the probe is passed on
+                        probe = await probe_link(file_data['url'])
+                        parts = planned_parts(probe, limit)
+                        split_note = f"✂️ Sent in {parts} parts\n" if parts > 1 else ""
+                        
+                        await status.edit_text(
+                            f"📥 **Downloading**\n\n"
+                            f"📊 {idx}/{len(files)}\n"
+                            f"📝 `{file_data['title'][:50]}...`\n"
+                            f"{split_note}\n"
+                            f"✅ Success: {counts['success']}\n"
+                            f"❌ Failed: {counts['failed']}\n\n"
+                            f"💡 /cancel to stop"
+                        )
+                        
+                        shared = await singleflight.fetch(
+                            file_data['url'], file_data['title'], status, user_id, lane, probe=probe
+                        )
+                        
+                        if active_tasks[user_id]['cancelled']:
+                            if shared:
+                                await shared.release()
+                            await jobs.release(job['_id'], item)
+                            break
                         
-                        await client.send_video(
+                        if shared:
+                            size = os.path.getsize(shared.path)
+                            disk['queued'] += size
+                            await ready.put((item, shared, size, None))
+                        else:
+                            counts['failed'] += 1
+                            failed_files.append(file_data['title'])
+                            await mark(item, 'failed', error="download failed")
+                            
+                    except Exception as e:
+                        counts['failed'] += 1
+                        failed_files.append(file_data['title'])
+                        await mark(item, 'failed', error=str(e))
+                        print(f"Error: {e}")
+                        await asyncio.sleep(2)
+                
+            finally:
+                # Also after an error - the upload worker would wait for it forever
+                await ready.put(None)
+        
+        async def upload_worker():
+            upload_msg = None
+            
+            async def upload_file(file_path, title, caption, content_hash=None):
+                nonlocal upload_msg
+                file_ext = file_path.split('.')[-1].lower()
+                
+                upload_text = f"📤 **Uploading**\n\n`{title}`"
+                if upload_msg:
+                    upload_msg = await upload_msg.edit_text(upload_text)
+                else:
+                    upload_msg = await client.send_message(
+                        job['chat_id'], upload_text, reply_to_message_id=job['message_id']
+                    )
+                reporter = reporter_for(upload_msg, "Uploading", title, stage="upload")
+                
+                if file_ext in ['mp4', 'mkv', 'avi', 'mov', 'flv', 'wmv', 'webm']:
+                    # Real duration/size let Telegram clients seek without re-processing
+                    info = await probe_media(file_path, content_hash)
+                    if thumbnail_mode == 'random' and random.randint(1, 3) == 1:
+                        thumb = await generate_thumbnail()
+                    else:
+                        thumb = await frame_thumbnail(info)
+                    
+                    try:
+                        return await client.send_video(
                             chat_id=target_chat,
                             video=file_path,
                             caption=caption,
                             thumb=thumb,
                             supports_streaming=True,
+                            **video_attributes(info),
                             reply_to_message_id=reply_to if not is_topic else None,
                             message_thread_id=topic_id if is_topic else None,
-                            progress=progress_for_pyrogram,
-                            progress_args=("Uploading", upload_msg, time.time(), file_data['title'])
+                            progress=reporter.update
                         )
-                        
+                    finally:
                         if thumb:
                             try:
                                 os.remove(thumb)
                             except:
                                 pass
+                
+                elif file_ext in ['mp3', 'wav', 'ogg', 'flac', 'm4a', 'aac']:
+                    return await client.send_audio(
+                        chat_id=target_chat,
+                        audio=file_path,
+                        caption=caption,
+                        reply_to_message_id=reply_to if not is_topic else None,
+                        message_thread_id=topic_id if is_topic else None,
+                        progress=reporter.update
+                    )
+                
+                return await client.send_document(
+                    chat_id=target_chat,
+                    document=file_path,
+                    caption=caption,
+                    reply_to_message_id=reply_to if not is_topic else None,
+                    message_thread_id=topic_id if is_topic else None,
+                    progress=reporter.update
+                )
+            
+            async def upload_parts(shared, title, caption):
+                """Split an oversize file and upload the parts in order - the last sent message"""
+                parts = await split_file(shared.path, limit, shared.job, upload_msg or status, user_id)
+                if active_tasks[user_id]['cancelled']:
+                    raise JobCancelled()
+                if not parts:
+                    raise Exception("split failed")
+                
+                sent = None
+                for number, part in enumerate(parts, 1):
+                    # Some of the parts aren't the file - not delivered
+                    if active_tasks[user_id]['cancelled']:
+                        raise JobCancelled()
+                    sent = await upload_file(
+                        part, f"{title} ({number}/{len(parts)})", part_caption(caption, number, len(parts))
+                    )
+                return sent
+            
+            while True:
+                entry = await ready.get()
+                if entry is None:
+                    break
+                
+                item, shared, size, cached = entry
+                idx, file_data = item['idx'], item
+                
+                try:
+                    if active_tasks[user_id]['cancelled']:
+                        continue
                     
-                    elif file_ext in ['mp3', 'wav', 'ogg', 'flac', 'm4a', 'aac']:
-                        await client.send_audio(
-                            chat_id=target_chat,
-                            audio=file_path,
-                            caption=caption,
-                            reply_to_message_id=reply_to if not is_topic else None,
-                            message_thread_id=topic_id if is_topic else None,
-                            progress=progress_for_pyrogram,
-                            progress_args=("Uploading", upload_msg, time.time(), file_data['title'])
+                    caption = f"📁 **{file_data['title']}**\n\n"
+                    caption += f"📊 File {idx} of {len(files)}\n"
+                    caption += f"✨ Extracted by: {credit}"
+                    
+                    sent = None
+                    split = False
+                    if cached:
+                        sent = await send_cached(
+                            client, cached, target_chat, caption,
+                            reply_to if not is_topic else None,
+                            topic_id if is_topic else None
                         )
                     
-                    else:
-                        await client.send_document(
-                            chat_id=target_chat,
-                            document=file_path,
-                            caption=caption,
-                            reply_to_message_id=reply_to if not is_topic else None,
-                            message_thread_id=topic_id if is_topic else None,
-                            progress=progress_for_pyrogram,
-                            progress_args=("Uploading", upload_msg, time.time(), file_data['title'])
+                    if not sent and not shared:
+                        # The cached file_id was rejected - fetch the file after all
+                        shared = await singleflight.fetch(
+                            file_data['url'], file_data['title'], upload_msg or status, user_id, lane
                         )
+                        if not shared:
+                            raise Exception("download failed")
                     
-                    try:
-                        os.remove(file_path)
-                    except:
-                        pass
+                    if not sent:
+                        # Other requesters of the same link wait here and re-send our file_id
+                        async with shared.upload_lock:
+                            if shared.content_hash is None:
+                                shared.set_content(*await lookup_by_content(client, shared.path))
+                            if shared.cached:
+                                sent = await send_cached(
+                                    client, shared.cached, target_chat, caption,
+                                    reply_to if not is_topic else None,
+                                    topic_id if is_topic else None
+                                )
+                            if not sent and os.path.getsize(shared.path) > limit:
+                                # Parts aren't the file - nothing to share or cache
+                                sent = await upload_parts(shared, file_data['title'], caption)
+                                split = True
+                            elif not sent:
+                                sent = await upload_file(
+                                    shared.path, file_data['title'], caption, shared.content_hash
+                                )
+                                shared.remember(sent)
                     
-                    success += 1
-                    await client.db.increment_downloads(user_id)
+                    counts['success'] += 1
+                    await mark(item, 'uploaded', sent)
+                    # A queued direct link was counted when it was paid for
+                    if not job.get('charged'):
+                        await client.db.increment_downloads(user_id)
+                    await record_transfer(client, sent)
+                    if not split:
+                        await remember_upload(
+                            client, file_data['url'], sent,
+                            shared.content_hash if shared else None
+                        )
                     
                     if idx < len(files) and not active_tasks[user_id]['cancelled']:
                         await asyncio.sleep(Config.FLOOD_SLEEP)
-                else:
-                    failed += 1
+                
+                except JobCancelled:
+                    # Not delivered - no success, no download counted, a paid link is refunded
+                    try:
+                        await jobs.release(job['_id'], item)
+                    except Exception as e:
+                        print(f"Job update error: {e}")
+                        
+                except Exception as e:
+                    counts['failed'] += 1
                     failed_files.append(file_data['title'])
-                    
-            except Exception as e:
-                failed += 1
-                failed_files.append(file_data['title'])
-                print(f"Error: {e}")
-                await asyncio.sleep(2)
+                    await mark(item, 'failed', error=str(e))
+                    print(f"Error: {e}")
+                    await asyncio.sleep(2)
+                
+                finally:
+                    if shared:
+                        await shared.release()
+                    await release_disk(size)
+            
+            if upload_msg:
+                try:
+                    await upload_msg.delete()
+                except:
+                    pass
         
-        if active_tasks[user_id]['cancelled']:
-            cleanup_downloads()
-            await status.unpin()
-            del active_tasks[user_id]
+        await asyncio.gather(download_worker(), upload_worker())
+        
+        success = counts['success']
+        failed = counts['failed']
+        
+        if active_tasks[user_id].get('lost'):
+            print(f"Job {job['_id']} taken over by another worker")
             return
         
+        if interrupted['error'] and not active_tasks[user_id]['cancelled']:
+            # Left running - the heartbeat stops with us, and the job is claimed again after the lease
+            try:
+                await status.edit_text(
+                    f"⚠️ **Interrupted**\n\n"
+                    f"✅ Success: {success}\n"
+                    f"❌ Failed: {failed}\n\n"
+                    f"♻️ The rest continues automatically in a few minutes."
+                )
+            except:
+                pass
+            return
+        
+        # A queued direct link was paid for up front
+        if job.get('charged') and not success:
+            await client.db.refund_download(user_id)
+        
+        # /cancel may also have reached the job through the store
+        latest = await jobs.get(job['_id'])
+        cancelled = active_tasks[user_id]['cancelled'] or not latest or latest['status'] == 'cancelled'
+        
+        if cancelled:
+            await jobs.set_status(job['_id'], 'cancelled')
+            try:
+                await status.edit_text(
+                    f"🛑 **Cancelled!**\n\n"
+                    f"✅ Success: {success}\n"
+                    f"❌ Failed: {failed}"
+                )
+            except:
+                pass
+            
+            try:
+                await status.unpin()
+            except:
+                pass
+            return
+        
+        await jobs.set_status(job['_id'], 'done')
+        
         report = f"✅ **Complete!**\n\n"
         report += f"✅ Success: `{success}`\n"
         report += f"❌ Failed: `{failed}`\n"
@@ -288,37 +630,82 @@ async def process_txt_file(client: Client, message: Message):
             await client.send_message(
                 Config.LOG_CHANNEL,
                 f"#BATCH\n\n"
-                f"👤 {message.from_user.mention}\n"
+                f"👤 {job['mention']}\n"
                 f"✅ {success} | ❌ {failed}"
             )
         except:
             pass
+    
+    finally:
+        heartbeat.cancel()
+
+async def job_loop(client: Client):
+    """
+    Take jobs off the shared queue - queued ones, and ones whose worker died or
+    restarted - running up to WORKER_JOBS at once. Any number of processes can
+    run this against the same database.
+    """
+    running = set()
+    
+    while True:
+        try:
+            while len(running) < Config.WORKER_JOBS:
+                # One job per user at a time, active_tasks is keyed by user
+                job = await client.db.jobs.claim_job(busy_users=list(active_tasks))
+                if not job:
+                    break
+                
+                active_tasks[job['user_id']] = {'cancelled': False, 'status': 'starting'}
+                task = asyncio.ensure_future(work_job(client, job))
+                running.add(task)
+                task.add_done_callback(running.discard)
+        except Exception as e:
+            print(f"Job claim error: {e}")
+        
+        await asyncio.sleep(Config.JOB_POLL)
+
+async def work_job(client: Client, job):
+    user_id = job['user_id']
+    
+    try:
+        done = item_counts(job)
+        started = done['pending'] < len(job['items'])
         
-        cleanup_downloads()
+        status = None
+        if not started:
+            # Queued by the front end - its status message carries on
+            try:
+                status = await client.get_messages(job['status_chat_id'], job['status_message_id'])
+                if status.empty:
+                    status = None
+            except:
+                status = None
+        
+        if not status:
+            status = await client.send_message(
+                job['status_chat_id'],
+                f"♻️ **Resuming batch...**\n\n"
+                f"📦 {done['uploaded'] + done['failed']}/{len(job['items'])} already done\n\n"
+                f"💡 /cancel to stop",
+                reply_to_message_id=job['message_id']
+            )
+            await client.db.jobs.set_status(job['_id'], 'running', status_message_id=status.id)
         
+        await run_batch(client, job, status)
     except Exception as e:
-        await message.reply_text(f"❌ Error: `{str(e)}`")
-    
+        print(f"Job {job['_id']} error: {e}")
     finally:
         if user_id in active_tasks:
             del active_tasks[user_id]
 
-def cleanup_downloads():
-    try:
-        if os.path.exists("downloads"):
-            for file in os.listdir("downloads"):
-                file_path = os.path.join("downloads", file)
-                try:
-                    if os.path.isfile(file_path):
-                        os.remove(file_path)
-                except:
-                    pass
-    except:
-        pass
+def prefetch_fits(queued_bytes):
+    """Whether another prefetched file may wait next to the ones queued for upload.
+    Free disk itself is checked by the scratch manager when the download reserves space."""
+    return queued_bytes < Config.PREFETCH_MAX_BYTES
 
 # ====== DIRECT LINK DOWNLOAD ======
 
-@Client.on_message(filters.text & filters.private & ~filters.command(['start', 'help', 'login', 'setting', 'settings', 'lock', 'unlock', 'premium', 'rem', 'stats', 'ping', 'broadcast', 'cancel', 'done']), group=2)
+@Client.on_message(filters.text & filters.private & ~filters.command(['start', 'help', 'login', 'setting', 'settings', 'lock', 'unlock', 'premium', 'rem', 'stats', 'ping', 'broadcast', 'cancel', 'done', 'queue', 'dbreport', 'deadusers']), group=2)
 async def handle_direct_link(client: Client, message: Message):
     """Handle direct URLs"""
     user_id = message.from_user.id
@@ -351,9 +738,13 @@ async def download_single_file(client: Client, message: Message):
     user_id = message.from_user.id
     is_premium = await client.db.is_premium(user_id)
     
-    if not is_premium:
-        downloads_today = await client.db.get_downloads_today(user_id)
-        if downloads_today >= Config.FREE_LIMIT:
+    # Free users pay for the download up front in one atomic check-and-count,
+    # and get it back if it doesn't finish
+    charged = not is_premium
+    
+    if charged:
+        allowed, downloads_today = await client.db.consume_download(user_id, Config.FREE_LIMIT)
+        if not allowed:
             await message.reply_text(
                 f"⚠️ Limit: {Config.FREE_LIMIT}/day\n"
                 f"Used: {downloads_today}\n\n"
@@ -373,76 +764,113 @@ async def download_single_file(client: Client, message: Message):
     except:
         filename = "download"
     
+    if Config.WORKER_MODE == "frontend":
+        status = await message.reply_text(
+            f"🕐 **Queued**\n\n"
+            f"`{filename[:50]}...`\n\n"
+            f"⏳ Starts as soon as a worker is free..."
+        )
+        try:
+            # A one-item job - the worker refunds the download if it doesn't finish
+            fields = await job_fields(client, message, status, is_premium, to_channel=False)
+            fields['charged'] = charged
+            await client.db.jobs.create(fields, [{'title': filename, 'url': url}])
+        except Exception as e:
+            if charged:
+                await client.db.refund_download(user_id)
+            await status.edit_text(f"❌ Error: `{str(e)[:100]}`")
+        return
+    
     status = await message.reply_text(
         f"📥 **Downloading...**\n\n"
         f"`{filename[:50]}...`\n\n"
         f"⏳ Please wait..."
     )
     
+    delivered = False
+    # /cancel reaches this download through its own token
+    token = CancelToken()
+    single_tasks.setdefault(user_id, set()).add(token)
+    
     try:
-        file_path = await download_any_file(url, filename, status, user_id)
-        
-        if not file_path or not os.path.exists(file_path):
-            await status.edit_text("❌ **Failed!**")
-            return
-        
         settings = await client.db.get_user_settings(user_id)
         credit = settings.get('credit', 'Serena')
         
         caption = f"📁 **{filename}**\n\n✨ By: {credit}"
         
-        await status.edit_text(f"📤 **Uploading...**\n\n`{filename}`")
-        
-        file_ext = file_path.split('.')[-1].lower()
-        
-        if file_ext in ['mp4', 'mkv', 'avi', 'mov', 'flv', 'wmv', 'webm']:
-            thumb = await generate_thumbnail()
+        # Links uploaded before are re-sent by file_id, no download at all
+        sent = None
+        split = False
+        cached = await lookup_cached(client, url)
+        if cached:
+            sent = await send_cached(client, cached, message.chat.id, caption, message.id)
+        
+        lane = lane_for(user_id, is_premium)
+        if not sent:
+            async with scheduler.slot(user_id, lane, filename, status):
+                sent = await stream_single_file(client, message, url, filename, caption, status, token)
             
-            await client.send_video(
-                chat_id=message.chat.id,
-                video=file_path,
-                caption=caption,
-                thumb=thumb,
-                supports_streaming=True,
-                reply_to_message_id=message.id,
-                progress=progress_for_pyrogram,
-                progress_args=("Uploading", status, time.time(), filename)
-            )
+            if is_cancelled(token):
+                await status.edit_text("🛑 **Cancelled!**")
+                return
             
-            if thumb:
-                try:
-                    os.remove(thumb)
-                except:
-                    pass
-        
-        elif file_ext in ['mp3', 'wav', 'ogg', 'flac', 'm4a', 'aac']:
-            await client.send_audio(
-                chat_id=message.chat.id,
-                audio=file_path,
-                caption=caption,
-                reply_to_message_id=message.id,
-                progress=progress_for_pyrogram,
-                progress_args=("Uploading", status, time.time(), filename)
-            )
-        
-        else:
-            await client.send_document(
-                chat_id=message.chat.id,
-                document=file_path,
-                caption=caption,
-                reply_to_message_id=message.id,
-                progress=progress_for_pyrogram,
-                progress_args=("Uploading", status, time.time(), filename)
-            )
-        
-        try:
-            os.remove(file_path)
-        except:
-            pass
+            if sent:
+                await remember_upload(client, url, sent)
+        
+        if not sent:
+            limit = upload_limit(client)
+            probe = await probe_link(url)
+            parts = planned_parts(probe, limit)
+            if parts > 1:
+                await status.edit_text(
+                    f"✂️ **Large file**\n\n"
+                    f"`{filename[:50]}`\n\n"
+                    f"Over the upload limit, it will be sent in {parts} parts."
+                )
+            
+            # Joins a download of the same link already running for someone else
+            shared = await singleflight.fetch(url, filename, status, user_id, lane, token, probe)
+            if is_cancelled(token):
+                if shared:
+                    await shared.release()
+                await status.edit_text("🛑 **Cancelled!**")
+                return
+            if not shared:
+                await status.edit_text("❌ **Failed!**")
+                return
+            
+            try:
+                async with shared.upload_lock:
+                    # Same file behind a different link, or uploaded by another requester
+                    if shared.content_hash is None:
+                        shared.set_content(*await lookup_by_content(client, shared.path))
+                    if shared.cached:
+                        sent = await send_cached(client, shared.cached, message.chat.id, caption, message.id)
+                    
+                    if not sent and os.path.getsize(shared.path) > limit:
+                        sent = await send_parts(client, message, shared, filename, caption, status, token, limit)
+                        split = True
+                    elif not sent:
+                        await status.edit_text(f"📤 **Uploading...**\n\n`{filename}`")
+                        
+                        reporter = reporter_for(status, "Uploading", filename, stage="upload")
+                        sent = await send_media(
+                            client, message, shared.path, shared.path, caption, reporter, shared.content_hash
+                        )
+                        shared.remember(sent)
+                
+                # Parts aren't the file - nothing to cache
+                if not split:
+                    await remember_upload(client, url, sent, shared.content_hash)
+            finally:
+                await shared.release()
         
+        delivered = True
         await status.edit_text(f"✅ **Done!**\n\n`{filename}`")
+        await record_transfer(client, sent)
         
-        await client.db.increment_downloads(user_id)
+        if not charged:
+            await client.db.increment_downloads(user_id)
         
         try:
             await client.send_message(
@@ -454,5 +882,109 @@ async def download_single_file(client: Client, message: Message):
         except:
             pass
         
+    except JobCancelled:
+        await status.edit_text("🛑 **Cancelled!**")
+    
     except Exception as e:
         await status.edit_text(f"❌ Error: `{str(e)[:100]}`")
+    
+    finally:
+        singles = single_tasks.get(user_id)
+        if singles is not None:
+            singles.discard(token)
+            if not singles:
+                del single_tasks[user_id]
+        if charged and not delivered:
+            await client.db.refund_download(user_id)
+
+async def send_media(client: Client, message: Message, media, name: str, caption: str, reporter,
+                     content_hash=None):
+    """Send a path or StreamSource as video, audio or document by its extension"""
+    file_ext = name.split('.')[-1].lower()
+    
+    if file_ext in ['mp4', 'mkv', 'avi', 'mov', 'flv', 'wmv', 'webm']:
+        # A stream can't be probed before it's sent, only files on disk
+        info = await probe_media(media, content_hash) if isinstance(media, str) else None
+        thumb = await frame_thumbnail(info) or await generate_thumbnail()
+        
+        try:
+            return await client.send_video(
+                chat_id=message.chat.id,
+                video=media,
+                caption=caption,
+                thumb=thumb,
+                supports_streaming=True,
+                **video_attributes(info),
+                reply_to_message_id=message.id,
+                progress=reporter.update
+            )
+        finally:
+            if thumb:
+                try:
+                    os.remove(thumb)
+                except:
+                    pass
+    
+    elif file_ext in ['mp3', 'wav', 'ogg', 'flac', 'm4a', 'aac']:
+        return await client.send_audio(
+            chat_id=message.chat.id,
+            audio=media,
+            caption=caption,
+            reply_to_message_id=message.id,
+            progress=reporter.update
+        )
+    
+    return await client.send_document(
+        chat_id=message.chat.id,
+        document=media,
+        caption=caption,
+        reply_to_message_id=message.id,
+        progress=reporter.update
+    )
+
+async def send_parts(client: Client, message: Message, shared, filename, caption, status, user_id, limit):
+    """Split an oversize file and send the parts in order - the last sent message"""
+    await status.edit_text(f"✂️ **Splitting...**\n\n`{filename}`")
+    parts = await split_file(shared.path, limit, shared.job, status, user_id)
+    if is_cancelled(user_id):
+        raise JobCancelled()
+    if not parts:
+        raise Exception("split failed")
+    
+    sent = None
+    for number, part in enumerate(parts, 1):
+        if is_cancelled(user_id):
+            raise JobCancelled()
+        
+        await status.edit_text(f"📤 **Uploading part {number}/{len(parts)}...**\n\n`{filename}`")
+        reporter = reporter_for(status, f"Uploading {number}/{len(parts)}", filename, stage="upload")
+        sent = await send_media(
+            client, message, part, part, part_caption(caption, number, len(parts)), reporter
+        )
+    return sent
+
+async def stream_single_file(client: Client, message: Message, url, filename, caption, status, user_id):
+    """Upload a direct link while it downloads - the sent message, None when it has to go through disk"""
+    if not Config.STREAM_UPLOAD:
+        return None
+    
+    try:
+        source = await open_stream(url, filename, upload_limit(client), user_id)
+    except Exception as e:
+        print(f"Stream open error: {e}")
+        return None
+    
+    if not source:
+        return None
+    
+    try:
+        reporter = reporter_for(status, "Streaming", filename, stage="upload")
+        return await send_media(client, message, source, source.name, caption, reporter)
+    except StreamSeekRequired as e:
+        print(f"Stream upload fallback to disk: {e}")
+        return None
+    except Exception as e:
+        print(f"Stream upload error: {e}")
+        return None
+    finally:
+        source.close()
@@ -162,7 +162,7 @@ async def cancel_login_callback(client: Client, query: CallbackQuery):
         ])
     )
 
-@Client.on_message(filters.text & filters.private & ~filters.command(['start', 'help', 'login', 'setting', 'settings', 'lock', 'unlock', 'premium', 'rem', 'stats', 'ping', 'broadcast', 'cancel', 'done']), group=1)
+@Client.on_message(filters.text & filters.private & ~filters.command(['start', 'help', 'login', 'setting', 'settings', 'lock', 'unlock', 'premium', 'rem', 'stats', 'ping', 'broadcast', 'cancel', 'done', 'queue', 'dbreport', 'deadusers']), group=1)
 async def handle_user_input(client: Client, message: Message):
     user_id = message.from_user.id
     
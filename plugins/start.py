@@ -30,6 +30,7 @@ HELP_TEXT = """
 • /login - Login to platform
 • /setting - Configure
 • /cancel - Stop task
+• /queue - Queue position
 • /ping - Check speed
 
 **Usage:**
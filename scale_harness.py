@@ -0,0 +1,217 @@
+"""
+Local scale-out check: runs 1, 2, 4... worker processes against one shared
+job queue and prints the throughput of each run.
+
+Every process runs the real job_loop -> work_job -> run_batch path against
+the real Database/JobStore. Only Telegram and the network are stubbed: the
+client answers sends locally and the download is CPU-bound stand-in work
+(hashing HARNESS_ITEM_MB megabytes, plus an optional HARNESS_ITEM_IO
+seconds of waiting), so the run shows how the worker count scales across
+cores.
+
+    MONGO_URI=mongodb://localhost:27017 python scale_harness.py 1 2 4
+
+Uses a throwaway database that is dropped afterwards.
+"""
+import os
+import tempfile
+
+# Before the repo modules read their config
+os.environ.setdefault("SCRATCH_ROOT", os.path.join(tempfile.gettempdir(), "serena_harness_scratch"))
+
+import asyncio
+import hashlib
+import itertools
+import multiprocessing
+import sys
+import time
+from types import SimpleNamespace
+from config import Config
+from database.database import Database
+
+DB_NAME = "serena_scale_harness"
+JOBS = int(os.environ.get("HARNESS_JOBS", 16))
+ITEMS = int(os.environ.get("HARNESS_ITEMS", 8))
+ITEM_MB = int(os.environ.get("HARNESS_ITEM_MB", 256))
+ITEM_IO = float(os.environ.get("HARNESS_ITEM_IO", 0))
+
+_ids = itertools.count(1000)
+
+
+class FakeMessage:
+    """Status/sent message - every edit just succeeds"""
+
+    def __init__(self, chat_id, document=None):
+        self.id = next(_ids)
+        self.chat = SimpleNamespace(id=chat_id)
+        self.empty = False
+        self.video = None
+        self.audio = None
+        self.document = document
+
+    async def edit_text(self, text, *args, **kwargs):
+        return self
+
+    async def pin(self, *args, **kwargs):
+        pass
+
+    async def unpin(self, *args, **kwargs):
+        pass
+
+    async def delete(self, *args, **kwargs):
+        pass
+
+
+class FakeClient:
+    """What run_batch needs from the bot, with uploads answered locally"""
+
+    def __init__(self, db):
+        self.db = db
+        self.me = SimpleNamespace(is_premium=False)
+        self.uploads = 0
+
+    async def get_messages(self, chat_id, message_id):
+        return FakeMessage(chat_id)
+
+    async def send_message(self, chat_id, text, *args, **kwargs):
+        return FakeMessage(chat_id)
+
+    async def send_document(self, chat_id, document, *args, **kwargs):
+        self.uploads += 1
+        size = os.path.getsize(document)
+        return FakeMessage(chat_id, SimpleNamespace(file_id=f"harness-{self.uploads}", file_size=size))
+
+    send_video = send_audio = send_document
+
+    async def send_cached_media(self, chat_id, file_id, *args, **kwargs):
+        return FakeMessage(chat_id, SimpleNamespace(file_id=file_id, file_size=0))
+
+
+async def fake_download(url, filename, status_msg, user_id=None, job=None, probe=None):
+    """Stand-in for download_any_file - burns CPU like a remux or hash would"""
+    block = hashlib.sha256(url.encode()).digest() * (1024 * 1024 // 32)
+    digest = hashlib.sha256()
+    for _ in range(ITEM_MB):
+        digest.update(block)
+    if ITEM_IO:
+        await asyncio.sleep(ITEM_IO)
+
+    path = job.path_for(f"{filename}.bin")
+    with open(path, 'wb') as f:
+        f.write(url.encode() + digest.digest())
+    return path
+
+
+async def no_probe(url):
+    return None
+
+
+async def work():
+    import plugins.download as download
+    import utils.singleflight as singleflight
+
+    download.probe_link = no_probe
+    singleflight.download_any_file = fake_download
+    Config.JOB_POLL = 0.2
+    # Pacing for Telegram's flood limits - nothing to pace with uploads answered locally
+    Config.FLOOD_SLEEP = 0
+
+    db = Database(Config.MONGO_URI, DB_NAME)
+    client = FakeClient(db)
+    loop = asyncio.ensure_future(download.job_loop(client))
+
+    while True:
+        await asyncio.sleep(0.5)
+        if not download.active_tasks and not await db.jobs.jobs.count_documents({"status": "running"}):
+            break
+    loop.cancel()
+
+
+def worker_process():
+    asyncio.run(work())
+
+
+async def seed():
+    db = Database(Config.MONGO_URI, DB_NAME)
+    await db.jobs.jobs.drop()
+    await db.file_cache.drop()
+    await db.ensure_indexes()
+
+    for user_id in range(1, JOBS + 1):
+        files = [
+            {"title": f"File {user_id}-{i}", "url": f"https://harness.invalid/{user_id}/{i}"}
+            for i in range(1, ITEMS + 1)
+        ]
+        await db.jobs.create({
+            "user_id": user_id,
+            "is_premium": True,
+            "chat_id": user_id,
+            "message_id": 1,
+            "mention": f"user {user_id}",
+            "status_chat_id": user_id,
+            "status_message_id": 2,
+            "target_chat": user_id,
+            "reply_to": 1,
+            "is_topic": False,
+            "topic_id": None,
+            "credit": "Harness",
+            "thumbnail_mode": "random"
+        }, files)
+
+
+async def verify():
+    """Items not uploaded exactly once - 0 when no work was lost or repeated"""
+    db = Database(Config.MONGO_URI, DB_NAME)
+    bad = 0
+    async for job in db.jobs.jobs.find():
+        if job["status"] != "done":
+            bad += 1
+        bad += sum(1 for item in job["items"] if item["state"] != "uploaded" or item["attempts"] != 1)
+    return bad
+
+
+async def drop():
+    await Database(Config.MONGO_URI, DB_NAME).client.drop_database(DB_NAME)
+
+
+def measure(workers):
+    asyncio.run(seed())
+
+    started = time.perf_counter()
+    processes = [multiprocessing.Process(target=worker_process) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    return JOBS * ITEMS / elapsed, elapsed, asyncio.run(verify())
+
+
+def main():
+    if not Config.MONGO_URI:
+        sys.exit("Set MONGO_URI")
+
+    counts = [int(arg) for arg in sys.argv[1:]] or [1, 2, 4]
+    cpus = os.cpu_count() or 1
+    print(
+        f"{JOBS} jobs x {ITEMS} items, {ITEM_MB}MB hashed + {ITEM_IO}s wait per item, "
+        f"{Config.WORKER_JOBS} jobs per worker, {cpus} CPU(s)\n"
+    )
+
+    first = None
+    try:
+        for workers in counts:
+            rate, elapsed, bad = measure(workers)
+            first = first or (workers, rate)
+            print(
+                f"{workers} worker(s): {rate:6.2f} items/s in {elapsed:6.1f}s - "
+                f"{rate / first[1]:4.2f}x the {first[0]}-worker run"
+                + (f" - {bad} jobs/items not uploaded exactly once!" if bad else "")
+            )
+    finally:
+        asyncio.run(drop())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
-import aiohttp
 import asyncio
+from utils.http_client import get_session, API_TIMEOUT
 from typing import Dict, List, Optional
 import json
 
@@ -19,18 +19,19 @@ class RGVikramjeetAPI:
     async def send_otp(self, phone: str) -> bool:
         """Send OTP to phone number"""
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {
-                    "mobile": phone,
-                    "country_code": "+91"
-                }
-                async with session.post(
-                    f"{self.BASE_URL}/api/v1/auth/send-otp",
-                    json=payload,
-                    headers=self.headers
-                ) as resp:
-                    data = await resp.json()
-                    return data.get('success', False)
+            session = await get_session()
+            payload = {
+                "mobile": phone,
+                "country_code": "+91"
+            }
+            async with session.post(
+                f"{self.BASE_URL}/api/v1/auth/send-otp",
+                json=payload,
+                headers=self.headers,
+                timeout=API_TIMEOUT
+            ) as resp:
+                data = await resp.json()
+                return data.get('success', False)
         except Exception as e:
             print(f"Send OTP Error: {e}")
             return False
@@ -38,21 +39,22 @@ class RGVikramjeetAPI:
     async def verify_otp(self, phone: str, otp: str) -> Optional[Dict]:
         """Verify OTP and get auth token"""
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {
-                    "mobile": phone,
-                    "otp": otp
-                }
-                async with session.post(
-                    f"{self.BASE_URL}/api/v1/auth/verify-otp",
-                    json=payload,
-                    headers=self.headers
-                ) as resp:
-                    data = await resp.json()
-                    if data.get('success'):
-                        self.auth_token = data.get('token')
-                        return data
-                    return None
+            session = await get_session()
+            payload = {
+                "mobile": phone,
+                "otp": otp
+            }
+            async with session.post(
+                f"{self.BASE_URL}/api/v1/auth/verify-otp",
+                json=payload,
+                headers=self.headers,
+                timeout=API_TIMEOUT
+            ) as resp:
+                data = await resp.json()
+                if data.get('success'):
+                    self.auth_token = data.get('token')
+                    return data
+                return None
         except Exception as e:
             print(f"Verify OTP Error: {e}")
             return None
@@ -66,13 +68,14 @@ class RGVikramjeetAPI:
             headers = self.headers.copy()
             headers['Authorization'] = f"Bearer {self.auth_token}"
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{self.BASE_URL}/api/v1/user/batches",
-                    headers=headers
-                ) as resp:
-                    data = await resp.json()
-                    return data.get('batches', [])
+            session = await get_session()
+            async with session.get(
+                f"{self.BASE_URL}/api/v1/user/batches",
+                headers=headers,
+                timeout=API_TIMEOUT
+            ) as resp:
+                data = await resp.json()
+                return data.get('batches', [])
         except Exception as e:
             print(f"Get Batches Error: {e}")
             return []
@@ -86,13 +89,14 @@ class RGVikramjeetAPI:
             headers = self.headers.copy()
             headers['Authorization'] = f"Bearer {self.auth_token}"
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{self.BASE_URL}/api/v1/batch/{batch_id}/content",
-                    headers=headers
-                ) as resp:
-                    data = await resp.json()
-                    return data.get('content', [])
+            session = await get_session()
+            async with session.get(
+                f"{self.BASE_URL}/api/v1/batch/{batch_id}/content",
+                headers=headers,
+                timeout=API_TIMEOUT
+            ) as resp:
+                data = await resp.json()
+                return data.get('content', [])
         except Exception as e:
             print(f"Get Batch Content Error: {e}")
             return []
@@ -112,32 +116,34 @@ class UnacademyAPI:
     
     async def send_otp(self, phone: str) -> bool:
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {"phone": phone}
-                async with session.post(
-                    f"{self.BASE_URL}/user/login/send_otp",
-                    json=payload,
-                    headers=self.headers
-                ) as resp:
-                    data = await resp.json()
-                    return data.get('success', False)
+            session = await get_session()
+            payload = {"phone": phone}
+            async with session.post(
+                f"{self.BASE_URL}/user/login/send_otp",
+                json=payload,
+                headers=self.headers,
+                timeout=API_TIMEOUT
+            ) as resp:
+                data = await resp.json()
+                return data.get('success', False)
         except:
             return False
     
     async def verify_otp(self, phone: str, otp: str) -> Optional[Dict]:
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {"phone": phone, "otp": otp}
-                async with session.post(
-                    f"{self.BASE_URL}/user/login/verify",
-                    json=payload,
-                    headers=self.headers
-                ) as resp:
-                    data = await resp.json()
-                    if data.get('token'):
-                        self.auth_token = data['token']
-                        return data
-                    return None
+            session = await get_session()
+            payload = {"phone": phone, "otp": otp}
+            async with session.post(
+                f"{self.BASE_URL}/user/login/verify",
+                json=payload,
+                headers=self.headers,
+                timeout=API_TIMEOUT
+            ) as resp:
+                data = await resp.json()
+                if data.get('token'):
+                    self.auth_token = data['token']
+                    return data
+                return None
         except:
             return None
     
@@ -149,13 +155,14 @@ class UnacademyAPI:
             headers = self.headers.copy()
             headers['Authorization'] = f"Bearer {self.auth_token}"
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{self.BASE_URL}/user/purchases",
-                    headers=headers
-                ) as resp:
-                    data = await resp.json()
-                    return data.get('courses', [])
+            session = await get_session()
+            async with session.get(
+                f"{self.BASE_URL}/user/purchases",
+                headers=headers,
+                timeout=API_TIMEOUT
+            ) as resp:
+                data = await resp.json()
+                return data.get('courses', [])
         except:
             return []
     
@@ -167,13 +174,14 @@ class UnacademyAPI:
             headers = self.headers.copy()
             headers['Authorization'] = f"Bearer {self.auth_token}"
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{self.BASE_URL}/course/{batch_id}/lessons",
-                    headers=headers
-                ) as resp:
-                    data = await resp.json()
-                    return data.get('lessons', [])
+            session = await get_session()
+            async with session.get(
+                f"{self.BASE_URL}/course/{batch_id}/lessons",
+                headers=headers,
+                timeout=API_TIMEOUT
+            ) as resp:
+                data = await resp.json()
+                return data.get('lessons', [])
         except:
             return []
 
@@ -192,32 +200,34 @@ class PhysicsWallahAPI:
     
     async def send_otp(self, phone: str) -> bool:
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {"mobile": phone}
-                async with session.post(
-                    f"{self.BASE_URL}/v2/user/send-otp",
-                    json=payload,
-                    headers=self.headers
-                ) as resp:
-                    data = await resp.json()
-                    return data.get('success', False)
+            session = await get_session()
+            payload = {"mobile": phone}
+            async with session.post(
+                f"{self.BASE_URL}/v2/user/send-otp",
+                json=payload,
+                headers=self.headers,
+                timeout=API_TIMEOUT
+            ) as resp:
+                data = await resp.json()
+                return data.get('success', False)
         except:
             return False
     
     async def verify_otp(self, phone: str, otp: str) -> Optional[Dict]:
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {"mobile": phone, "otp": otp}
-                async with session.post(
-                    f"{self.BASE_URL}/v2/user/verify-otp",
-                    json=payload,
-                    headers=self.headers
-                ) as resp:
-                    data = await resp.json()
-                    if data.get('token'):
-                        self.auth_token = data['token']
-                        return data
-                    return None
+            session = await get_session()
+            payload = {"mobile": phone, "otp": otp}
+            async with session.post(
+                f"{self.BASE_URL}/v2/user/verify-otp",
+                json=payload,
+                headers=self.headers,
+                timeout=API_TIMEOUT
+            ) as resp:
+                data = await resp.json()
+                if data.get('token'):
+                    self.auth_token = data['token']
+                    return data
+                return None
         except:
             return None
     
@@ -229,13 +239,14 @@ class PhysicsWallahAPI:
             headers = self.headers.copy()
             headers['Authorization'] = f"Bearer {self.auth_token}"
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{self.BASE_URL}/v2/batches/my-batches",
-                    headers=headers
-                ) as resp:
-                    data = await resp.json()
-                    return data.get('data', [])
+            session = await get_session()
+            async with session.get(
+                f"{self.BASE_URL}/v2/batches/my-batches",
+                headers=headers,
+                timeout=API_TIMEOUT
+            ) as resp:
+                data = await resp.json()
+                return data.get('data', [])
         except:
             return []
     
@@ -247,13 +258,14 @@ class PhysicsWallahAPI:
             headers = self.headers.copy()
             headers['Authorization'] = f"Bearer {self.auth_token}"
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{self.BASE_URL}/v2/batches/{batch_id}/content",
-                    headers=headers
-                ) as resp:
-                    data = await resp.json()
-                    return data.get('data', [])
+            session = await get_session()
+            async with session.get(
+                f"{self.BASE_URL}/v2/batches/{batch_id}/content",
+                headers=headers,
+                timeout=API_TIMEOUT
+            ) as resp:
+                data = await resp.json()
+                return data.get('data', [])
         except:
             return []
 
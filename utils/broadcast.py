@@ -0,0 +1,281 @@
+import asyncio
+import time
+from collections import deque
+from pyrogram.errors import FloodWait
+from utils.progress import format_time
+from utils.metrics import BROADCASTS_RUNNING, flood_wait
+from config import Config
+
+FLOOD_RETRIES = 5
+DEAD_FLUSH_SIZE = 500
+
+# RPC errors meaning the user can never receive anything from us - anything else is transient
+DEAD_ERRORS = {
+    "USER_IS_BLOCKED": "blocked",
+    "INPUT_USER_DEACTIVATED": "deactivated",
+    "PEER_ID_INVALID": "invalid",
+    "USER_IS_BOT": "bot",
+}
+
+
+def classify_error(error):
+    """Dead-user reason for a send error, None when a later send may work"""
+    return DEAD_ERRORS.get(getattr(error, "ID", None))
+
+
+class TokenBucket:
+    """Global send rate limiter - FloodWait pauses it for every worker at once"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens - Telegram told us to wait"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+bucket = TokenBucket(Config.BROADCAST_RATE)
+
+# broadcast _id -> Broadcast
+running = {}
+BROADCASTS_RUNNING.set_function(lambda: len(running))
+
+
+class Broadcast:
+    """One broadcast: a cursor over users feeding a worker pool, checkpointed to Mongo"""
+
+    def __init__(self, client, doc, status_msg):
+        self.client = client
+        self.doc = doc
+        self.id = doc["_id"]
+        self.status_msg = status_msg
+        self.success = doc.get("success", 0)
+        self.failed = doc.get("failed", 0)
+        self.dead_count = doc.get("dead", 0)
+        # (user_id, reason) waiting to be flagged in one bulk write
+        self.dead = []
+        self.last_user_id = doc.get("last_user_id")
+        self.total = doc.get("total", 0)
+        self.cancelled = False
+        # Dispatched ids in cursor order, checkpoint only moves past finished ones
+        self.dispatched = deque()
+        self.finished = set()
+        self.session_start = time.time()
+        self.session_done = 0
+
+    @property
+    def done(self):
+        return self.success + self.failed
+
+    async def deliver(self, user_id):
+        """(sent, dead reason) for one user"""
+        for _ in range(FLOOD_RETRIES):
+            await bucket.acquire()
+            try:
+                await self.client.copy_message(
+                    chat_id=user_id,
+                    from_chat_id=self.doc["from_chat_id"],
+                    message_id=self.doc["message_id"]
+                )
+                return True, None
+            except FloodWait as e:
+                flood_wait("broadcast", e.value)
+                bucket.pause(e.value)
+            except Exception as e:
+                return False, classify_error(e)
+        return False, None
+
+    def _finish(self, user_id, ok, reason=None):
+        if ok:
+            self.success += 1
+        else:
+            self.failed += 1
+        if reason:
+            self.dead.append((user_id, reason))
+            self.dead_count += 1
+        self.session_done += 1
+
+        self.finished.add(user_id)
+        while self.dispatched and self.dispatched[0] in self.finished:
+            self.last_user_id = self.dispatched.popleft()
+            self.finished.discard(self.last_user_id)
+
+    async def worker(self, queue):
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            ok, reason = await self.deliver(user_id)
+            self._finish(user_id, ok, reason)
+            if len(self.dead) >= DEAD_FLUSH_SIZE:
+                await self.flush_dead()
+
+    async def producer(self, queue):
+        # Resumes right after the last user whose send is known to be finished
+        after = self.last_user_id
+        while not self.cancelled:
+            page = await self.client.db.user_id_page(after, Config.BROADCAST_PAGE)
+            if not page:
+                break
+            for user_id in page:
+                if self.cancelled:
+                    break
+                self.dispatched.append(user_id)
+                await queue.put(user_id)
+            after = page[-1]
+
+        for _ in range(Config.BROADCAST_WORKERS):
+            await queue.put(None)
+
+    def status_text(self, title="📢 **Broadcasting...**"):
+        elapsed = time.time() - self.session_start
+        speed = self.session_done / elapsed if elapsed > 0 else 0
+        remaining = max(self.total - self.done, 0)
+        eta = int(remaining / speed) if speed > 0 else 0
+        percentage = self.done * 100 / self.total if self.total else 100
+
+        text = f"{title}\n\n"
+        text += f"📊 Progress: {self.done}/{self.total} ({percentage:.1f}%)\n"
+        text += f"✅ Success: {self.success}\n"
+        text += f"❌ Failed: {self.failed}\n"
+        text += f"🪦 Blocked/Deleted: {self.dead_count}\n"
+        text += f"⚡ Speed: {speed:.1f} msg/s\n"
+        text += f"⏱️ Elapsed: {format_time(int(elapsed))}"
+        if remaining and speed > 0:
+            text += f"\n⏳ ETA: {format_time(eta)}"
+        return text
+
+    async def flush_dead(self):
+        """Flag the dead users found so far - later broadcasts skip them"""
+        batch, self.dead = self.dead, []
+        if not batch:
+            return
+        try:
+            await self.client.db.mark_dead_users(batch)
+        except Exception as e:
+            print(f"Dead user flush error: {e}")
+            self.dead.extend(batch)
+
+    async def checkpoint(self, status=None):
+        # Flag dead users before the checkpoint moves past them
+        await self.flush_dead()
+        fields = {
+            "last_user_id": self.last_user_id,
+            "success": self.success,
+            "failed": self.failed,
+            "dead": self.dead_count
+        }
+        if status:
+            fields["status"] = status
+        try:
+            await self.client.db.update_broadcast(self.id, fields)
+        except Exception as e:
+            print(f"Broadcast checkpoint error: {e}")
+
+    async def edit_status(self, text):
+        if not self.status_msg:
+            return
+        try:
+            await self.status_msg.edit_text(text)
+        except:
+            pass
+
+    async def monitor(self):
+        while True:
+            await asyncio.sleep(Config.BROADCAST_CHECKPOINT)
+            await self.checkpoint()
+            await self.edit_status(self.status_text())
+
+    async def run(self):
+        running[self.id] = self
+        queue = asyncio.Queue(maxsize=Config.BROADCAST_WORKERS * 2)
+        tasks = [asyncio.ensure_future(self.producer(queue))]
+        tasks += [asyncio.ensure_future(self.worker(queue)) for _ in range(Config.BROADCAST_WORKERS)]
+        monitor = asyncio.ensure_future(self.monitor())
+
+        error = None
+        try:
+            await asyncio.gather(*tasks)
+        except Exception as e:
+            # Left "running" it would be resumed, and fail again, on every start
+            print(f"Broadcast error: {e}")
+            error = e
+        finally:
+            monitor.cancel()
+            for task in tasks:
+                task.cancel()
+            running.pop(self.id, None)
+
+        if error:
+            await self.checkpoint("failed")
+            await self.edit_status(self.status_text("❌ **Broadcast Failed!**") + f"\n\n`{str(error)[:100]}`")
+            return
+
+        status = "cancelled" if self.cancelled else "done"
+        await self.checkpoint(status)
+        title = "🛑 **Broadcast Cancelled!**" if self.cancelled else "✅ **Broadcast Complete!**"
+        await self.edit_status(self.status_text(title))
+
+
+async def start_broadcast(client, message, status_msg):
+    """Broadcast the message `message` replies to, reporting in `status_msg`"""
+    source = message.reply_to_message
+    total = await client.db.count_users()
+    doc = await client.db.create_broadcast(
+        source.chat.id, source.id, status_msg.chat.id, status_msg.id, total
+    )
+    broadcast = Broadcast(client, doc, status_msg)
+    asyncio.ensure_future(broadcast.run())
+    return broadcast
+
+
+async def resume_broadcasts(client):
+    """Pick up broadcasts that were running when the bot stopped"""
+    try:
+        docs = await client.db.get_running_broadcasts()
+    except Exception as e:
+        print(f"Broadcast resume error: {e}")
+        return
+
+    for doc in docs:
+        status_msg = None
+        try:
+            status_msg = await client.send_message(
+                doc["status_chat_id"],
+                "♻️ **Resuming broadcast after restart...**",
+                reply_to_message_id=doc.get("status_message_id")
+            )
+        except Exception:
+            pass
+
+        asyncio.ensure_future(Broadcast(client, doc, status_msg).run())
+
+
+def cancel_broadcasts() -> int:
+    for broadcast in running.values():
+        broadcast.cancelled = True
+    return len(running)
@@ -0,0 +1,230 @@
+import asyncio
+import os
+import signal
+import time
+from collections import deque
+from utils.helpers import is_cancelled
+from utils.metrics import FFMPEG_PROCESSES
+from config import Config
+
+
+class FFmpegProgress:
+    """State built from ffmpeg's `-progress pipe:1` key=value blocks"""
+
+    def __init__(self, duration: float = 0):
+        self.duration = duration
+        self.out_time = 0.0
+        self.total_size = 0
+        self.speed = ""
+        self.ended = False
+        self.last_advance = time.time()
+
+    def feed(self, line: str) -> bool:
+        """Parse one line, returns True when a whole block was read"""
+        key, _, value = line.strip().partition('=')
+        value = value.strip()
+
+        if key in ('out_time_us', 'out_time_ms'):
+            # Both are microseconds - out_time_ms is misnamed upstream
+            try:
+                out_time = int(value) / 1_000_000
+            except ValueError:
+                return False
+            if out_time > self.out_time:
+                self.out_time = out_time
+                self.last_advance = time.time()
+        elif key == 'total_size':
+            try:
+                size = int(value)
+            except ValueError:
+                return False
+            if size > self.total_size:
+                self.total_size = size
+                self.last_advance = time.time()
+        elif key == 'speed':
+            self.speed = value if value != 'N/A' else ""
+        elif key == 'progress':
+            self.ended = value == 'end'
+            return True
+
+        return False
+
+    @property
+    def fraction(self) -> float:
+        if not self.duration or self.out_time <= 0:
+            return 0
+        return min(self.out_time / self.duration, 1.0)
+
+    def estimated_size(self) -> int:
+        """Final output size extrapolated from how much of the duration is done"""
+        if self.ended:
+            return self.total_size
+        if not self.fraction:
+            return 0
+        return int(self.total_size / self.fraction)
+
+    def stalled_for(self) -> float:
+        return time.time() - self.last_advance
+
+
+class FFmpegStalled(Exception):
+    """ffmpeg stopped making progress and was killed by the watchdog"""
+
+
+class FFmpegTimeout(Exception):
+    """The job ran past its wall-clock limit"""
+
+
+class FFmpegCancelled(Exception):
+    """The owner of the job used /cancel"""
+
+
+async def _drain(stream, tail: deque):
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+        tail.append(line.decode(errors='ignore').rstrip())
+
+
+class FFmpegRunner:
+    """
+    Every ffmpeg process goes through here: a global cap on running processes,
+    wall-clock and stall timeouts, process-group kill on /cancel and the last
+    stderr lines kept for error reports. Network-bound fetches (remote=True)
+    have their own cap so they don't hold the CPU-sized slots for hours.
+    """
+
+    def __init__(self, max_processes: int, max_fetches: int):
+        self.max_processes = max_processes
+        self.semaphore = asyncio.Semaphore(max_processes)
+        self.fetch_semaphore = asyncio.Semaphore(max_fetches)
+        # user_id -> set of running processes
+        self.processes = {}
+        self.last_error = ""
+
+    @property
+    def running(self) -> int:
+        return sum(len(p) for p in self.processes.values())
+
+    def _kill(self, process):
+        """Kill ffmpeg together with anything it spawned"""
+        if process.returncode is not None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+
+    def cancel_user(self, user_id) -> int:
+        """Kill every ffmpeg process of a user, returns how many were killed"""
+        processes = self.processes.get(user_id, set())
+        for process in list(processes):
+            self._kill(process)
+        return len(processes)
+
+    async def _run_once(self, args, reporter, label, duration, stall_timeout, deadline, user_id) -> bool:
+        command = ['ffmpeg', '-progress', 'pipe:1', '-nostats', *args]
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True
+        )
+        self.processes.setdefault(user_id, set()).add(process)
+
+        progress = FFmpegProgress(duration)
+        stderr_tail = deque(maxlen=Config.FFMPEG_STDERR_LINES)
+        stderr_task = asyncio.ensure_future(_drain(process.stderr, stderr_tail))
+
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(process.stdout.readline(), timeout=1)
+                except asyncio.TimeoutError:
+                    line = None
+
+                if line == b'':
+                    break
+
+                if line and progress.feed(line.decode(errors='ignore')) and reporter:
+                    if progress.speed:
+                        reporter.ud_type = f"{label} ({progress.speed})"
+                    await reporter.update(progress.total_size, progress.estimated_size())
+
+                if is_cancelled(user_id):
+                    raise FFmpegCancelled()
+                if time.time() > deadline:
+                    raise FFmpegTimeout(f"wall-clock limit hit at {int(progress.out_time)}s")
+                if progress.stalled_for() > stall_timeout:
+                    raise FFmpegStalled(
+                        f"no progress for {int(progress.stalled_for())}s "
+                        f"at {int(progress.out_time)}s"
+                    )
+
+            await process.wait()
+        except BaseException:
+            self._kill(process)
+            await process.wait()
+            raise
+        finally:
+            await asyncio.gather(stderr_task, return_exceptions=True)
+            running = self.processes.get(user_id)
+            if running is not None:
+                running.discard(process)
+                if not running:
+                    del self.processes[user_id]
+
+        if process.returncode != 0:
+            if is_cancelled(user_id):
+                raise FFmpegCancelled()
+            self.last_error = '\n'.join(stderr_tail)
+            print(f"FFmpeg error ({process.returncode}): {' | '.join(stderr_tail)[:500]}")
+            return False
+        return True
+
+    async def run(self, args, reporter=None, label="Processing", duration: float = 0,
+                  user_id=None, timeout: int = None, stall_timeout: int = None,
+                  retries: int = None, stage: str = "ffmpeg", remote: bool = False) -> bool:
+        """
+        Run ffmpeg with live progress. `duration` (seconds) turns out_time into a
+        percentage; a run that stops advancing is killed and started again.
+        `timeout` only counts time spent running, not waiting for a slot.
+        """
+        timeout = timeout or Config.DOWNLOAD_TIMEOUT
+        stall_timeout = stall_timeout or Config.FFMPEG_STALL_TIMEOUT
+        retries = Config.FFMPEG_RETRIES if retries is None else retries
+        semaphore = self.fetch_semaphore if remote else self.semaphore
+        remaining = timeout
+
+        for attempt in range(retries + 1):
+            async with semaphore:
+                if reporter:
+                    reporter.reset(label, stage=stage)
+                started = time.time()
+                try:
+                    return await self._run_once(
+                        args, reporter, label, duration, stall_timeout, started + remaining, user_id
+                    )
+                except FFmpegStalled as e:
+                    print(f"FFmpeg stalled ({attempt + 1}/{retries + 1}): {e}")
+                    remaining -= time.time() - started
+                except FFmpegTimeout as e:
+                    print(f"FFmpeg timeout: {e}")
+                    return False
+                except FFmpegCancelled:
+                    print(f"FFmpeg cancelled for {user_id}")
+                    return False
+
+        return False
+
+
+ffmpeg_runner = FFmpegRunner(Config.FFMPEG_MAX_PROCESSES, Config.FFMPEG_MAX_FETCHES)
+FFMPEG_PROCESSES.set_function(lambda: ffmpeg_runner.running)
+
+
+async def run_ffmpeg(args, reporter=None, label="Processing", duration: float = 0, **kwargs) -> bool:
+    return await ffmpeg_runner.run(args, reporter, label, duration, **kwargs)
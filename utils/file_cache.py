@@ -0,0 +1,74 @@
+import asyncio
+from pyrogram.errors import BadRequest
+from utils.helpers import normalize_url, file_hash
+
+MEDIA_TYPES = ("video", "audio", "document")
+
+
+def uploaded_media(message):
+    """(media_type, media) carried by a sent message, None when there is no file"""
+    for media_type in MEDIA_TYPES:
+        media = getattr(message, media_type, None)
+        if media:
+            return media_type, media
+    return None
+
+
+async def lookup_cached(client, url):
+    """Cache entry of an already uploaded link"""
+    try:
+        return await client.db.get_cached_file(url_key=normalize_url(url))
+    except Exception as e:
+        print(f"File cache lookup error: {e}")
+        return None
+
+
+async def lookup_by_content(client, file_path):
+    """(content_hash, cache entry) of a downloaded file - same file behind another link"""
+    try:
+        content_hash = await asyncio.to_thread(file_hash, file_path)
+        return content_hash, await client.db.get_cached_file(content_hash=content_hash)
+    except Exception as e:
+        print(f"File cache hash error: {e}")
+        return None, None
+
+
+async def send_cached(client, cached, chat_id, caption, reply_to_message_id=None, message_thread_id=None):
+    """Send a cached file_id - None, with the entry dropped, when Telegram rejects it"""
+    # Only passed for forum topics, Pyrogram builds without topic support don't take it
+    topic = {"message_thread_id": message_thread_id} if message_thread_id else {}
+    try:
+        return await client.send_cached_media(
+            chat_id=chat_id,
+            file_id=cached['file_id'],
+            caption=caption,
+            reply_to_message_id=reply_to_message_id,
+            **topic
+        )
+    except BadRequest as e:
+        print(f"Cached file rejected, dropping it: {e}")
+        try:
+            await client.db.drop_cached_file(cached['file_id'])
+        except Exception:
+            pass
+        return None
+
+
+async def remember_upload(client, url, sent, content_hash=None):
+    """Store the file_id of a fresh upload so the next request for the link skips it"""
+    found = uploaded_media(sent) if sent else None
+    if not found:
+        return
+
+    media_type, media = found
+    try:
+        await client.db.cache_file(
+            normalize_url(url),
+            media.file_id,
+            media_type,
+            media.file_size,
+            getattr(media, 'file_name', None),
+            content_hash
+        )
+    except Exception as e:
+        print(f"File cache save error: {e}")
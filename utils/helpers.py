@@ -1,7 +1,8 @@
 import re
-from PIL import Image, ImageDraw, ImageFont
-import random
 import os
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from utils.thumbnail import render_thumbnail
 
 def clean_filename(filename):
     """Clean filename from invalid characters"""
@@ -15,64 +16,52 @@ def clean_filename(filename):
         cleaned = name[:200-len(ext)] + ext
     return cleaned
 
+def normalize_url(url: str) -> str:
+    """Canonical form of a link so the same file maps to one cache key"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    
+    port = parts.port
+    if port and not ((scheme == 'http' and port == 80) or (scheme == 'https' and port == 443)):
+        host = f"{host}:{port}"
+    
+    # Tracking params don't change the file, the rest are kept in a stable order
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith('utm_')
+    )
+    
+    return urlunsplit((scheme, host, parts.path or '/', urlencode(query), ''))
+
+def file_hash(path: str, chunk_size: int = 4 * 1024 * 1024) -> str:
+    """SHA-256 of the whole file - the content identity cached uploads are matched by"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class CancelToken:
+    """Passed where a user id goes for work no single user owns - cancelled only through it"""
+    
+    def __init__(self):
+        self.cancelled = False
+    
+    def cancel(self):
+        self.cancelled = True
+
+def is_cancelled(user_id) -> bool:
+    """Check the /cancel flag of a user's active task (or a CancelToken)"""
+    if isinstance(user_id, CancelToken):
+        return user_id.cancelled
+    from plugins.download import active_tasks
+    return bool(user_id and user_id in active_tasks and active_tasks[user_id].get('cancelled'))
+
 async def generate_thumbnail(mode='random'):
     """Generate thumbnail for video"""
     try:
-        # Create downloads directory
-        os.makedirs("downloads", exist_ok=True)
-        
-        # Random color
-        colors = [
-            (74, 144, 226),   # Blue
-            (236, 100, 75),   # Red
-            (255, 152, 0),    # Orange
-            (67, 160, 71),    # Green
-            (142, 36, 170),   # Purple
-        ]
-        
-        color = random.choice(colors)
-        
-        # Create image
-        img = Image.new('RGB', (1280, 720), color=color)
-        draw = ImageDraw.Draw(img)
-        
-        # Add gradient effect (simple version)
-        for i in range(720):
-            alpha = i / 720
-            new_color = tuple(int(c * (1 - alpha * 0.3)) for c in color)
-            draw.line([(0, i), (1280, i)], fill=new_color)
-        
-        # Add text
-        text = "Serena Lec"
-        try:
-            # Try to use a better font
-            font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 100)
-        except:
-            try:
-                font = ImageFont.truetype("arial.ttf", 100)
-            except:
-                font = ImageFont.load_default()
-        
-        # Calculate text position (center)
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        
-        position = ((1280 - text_width) // 2, (720 - text_height) // 2)
-        
-        # Add shadow
-        shadow_pos = (position[0] + 3, position[1] + 3)
-        draw.text(shadow_pos, text, fill=(0, 0, 0, 128), font=font)
-        
-        # Add main text
-        draw.text(position, text, fill=(255, 255, 255), font=font)
-        
-        # Save thumbnail
-        thumb_path = f"downloads/thumb_{random.randint(1000, 9999)}.jpg"
-        img.save(thumb_path, quality=90)
-        
-        return thumb_path
-        
+        return await render_thumbnail()
     except Exception as e:
         print(f"Thumbnail generation error: {e}")
         return None
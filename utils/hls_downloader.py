@@ -0,0 +1,313 @@
+import aiohttp
+import aiofiles
+import asyncio
+import os
+import shutil
+import m3u8
+from typing import Optional
+from utils.progress import reporter_for
+from utils.helpers import is_cancelled
+from utils.resume import DownloadJournal, response_validators
+from utils.http_client import get_session
+from utils.ffmpeg_runner import run_ffmpeg
+from config import Config
+
+HLS_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': '*/*'
+}
+
+
+class HLSError(Exception):
+    """Playlist can't be handled natively - caller should fall back to ffmpeg"""
+
+
+async def fetch_playlist(session, url: str):
+    """Download and parse a playlist, resolving relative URIs against its URL"""
+    async with session.get(url, headers=HLS_HEADERS) as resp:
+        if resp.status != 200:
+            raise HLSError(f"Playlist HTTP {resp.status}")
+        text = await resp.text()
+        base_url = str(resp.url)
+        headers = resp.headers
+
+    return m3u8.loads(text, uri=base_url), headers
+
+
+def pick_variant(playlist: m3u8.M3U8):
+    """Choose the highest bandwidth variant of a master playlist"""
+    variants = [p for p in playlist.playlists if p.absolute_uri]
+    if not variants:
+        raise HLSError("Master playlist has no variants")
+
+    return max(variants, key=lambda p: p.stream_info.bandwidth or 0)
+
+
+async def probe_hls(url: str) -> dict:
+    """Fetch a stream's playlists once - the media playlist and everything later steps read from it"""
+    session = await get_session()
+    playlist, headers = await fetch_playlist(session, url)
+    probe = {"media_url": url, "bandwidth": 0, "separate_audio": False}
+
+    if playlist.is_variant:
+        variant = pick_variant(playlist)
+        # Demuxed audio lives in its own playlist - only ffmpeg muxes it back in
+        audio = variant.stream_info.audio
+        probe["separate_audio"] = bool(audio) and any(
+            media.type == 'AUDIO' and media.group_id == audio and media.uri for media in playlist.media
+        )
+        probe["bandwidth"] = variant.stream_info.bandwidth or 0
+        probe["media_url"] = variant.absolute_uri
+        playlist, headers = await fetch_playlist(session, probe["media_url"])
+
+    probe["playlist"], probe["headers"] = playlist, headers
+    probe["duration"] = sum(segment.duration or 0 for segment in playlist.segments)
+    probe["size"] = int(probe["bandwidth"] / 8 * probe["duration"])
+    return probe
+
+
+async def resolve_media_playlist(url: str, probe: dict = None):
+    """Follow a master playlist down to the media playlist, returning it with its validators"""
+    probe = probe or await probe_hls(url)
+    playlist = probe["playlist"]
+
+    if probe["separate_audio"]:
+        raise HLSError("Separate audio rendition")
+
+    if not playlist.segments:
+        raise HLSError("Playlist has no segments")
+
+    if not playlist.is_endlist:
+        raise HLSError("Live playlist")
+
+    for segment in playlist.segments:
+        if segment.byterange:
+            raise HLSError("Byte-range segments are not supported")
+        if segment.key and segment.key.method not in (None, 'NONE', 'AES-128'):
+            raise HLSError(f"Unsupported key method {segment.key.method}")
+
+    validators = response_validators(probe["headers"])
+    validators.update({"media_url": probe["media_url"], "segments": len(playlist.segments)})
+    return playlist, validators
+
+
+async def fetch_to_file(session, url: str, path: str) -> int:
+    """Download one small resource (segment, key, init section) with retries"""
+    for attempt in range(1, Config.HLS_SEGMENT_RETRIES + 1):
+        try:
+            async with session.get(url, headers=HLS_HEADERS) as resp:
+                if resp.status != 200:
+                    raise aiohttp.ClientResponseError(
+                        resp.request_info, resp.history, status=resp.status
+                    )
+                data = await resp.read()
+
+            async with aiofiles.open(path, 'wb') as f:
+                await f.write(data)
+            return len(data)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == Config.HLS_SEGMENT_RETRIES:
+                raise
+            print(f"Segment retry {attempt}: {e}")
+            await asyncio.sleep(attempt)
+
+
+def build_local_playlist(playlist: m3u8.M3U8, segment_files, key_files, init_files) -> str:
+    """Rewrite the media playlist so every URI points at a downloaded local file"""
+    lines = [
+        '#EXTM3U',
+        f'#EXT-X-VERSION:{playlist.version or 3}',
+        f'#EXT-X-TARGETDURATION:{int(playlist.target_duration or 10)}',
+        f'#EXT-X-MEDIA-SEQUENCE:{playlist.media_sequence or 0}',
+    ]
+
+    last_key = None
+    last_init = None
+
+    for index, segment in enumerate(playlist.segments):
+        if segment.discontinuity:
+            lines.append('#EXT-X-DISCONTINUITY')
+
+        init_uri = segment.init_section.absolute_uri if segment.init_section else None
+        if init_uri and init_uri != last_init:
+            lines.append(f'#EXT-X-MAP:URI="{init_files[init_uri]}"')
+            last_init = init_uri
+
+        key = segment.key
+        key_line = '#EXT-X-KEY:METHOD=NONE'
+        if key and key.method == 'AES-128':
+            key_line = f'#EXT-X-KEY:METHOD=AES-128,URI="{key_files[key.absolute_uri]}"'
+            if key.iv:
+                key_line += f',IV={key.iv}'
+
+        if key_line != last_key and (last_key is not None or key_line != '#EXT-X-KEY:METHOD=NONE'):
+            lines.append(key_line)
+        last_key = key_line
+
+        lines.append(f'#EXTINF:{segment.duration},')
+        lines.append(segment_files[index])
+
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+async def playlist_duration(url: str, probe: dict = None) -> float:
+    """Total EXTINF duration of a stream in seconds, 0 when it can't be read"""
+    try:
+        probe = probe or await probe_hls(url)
+        return probe["duration"]
+    except Exception as e:
+        print(f"Playlist duration error: {e}")
+        return 0
+
+
+async def estimate_hls_size(url: str, probe: dict = None) -> int:
+    """Expected size of a stream from the variant bandwidth and EXTINF total, 0 if unknown"""
+    try:
+        probe = probe or await probe_hls(url)
+        return probe["size"]
+    except Exception as e:
+        print(f"HLS size estimate error: {e}")
+        return 0
+
+
+async def remux_local_playlist(playlist_path: str, output_path: str, reporter=None,
+                               duration: float = 0, user_id=None) -> bool:
+    """Join the downloaded segments into one MP4 without re-encoding"""
+    args = [
+        '-allowed_extensions', 'ALL',
+        '-protocol_whitelist', 'file,crypto,data',
+        '-i', playlist_path,
+        '-c', 'copy',
+        '-bsf:a', 'aac_adtstoasc',
+        '-y',
+        '-loglevel', 'error',
+        output_path
+    ]
+    return await run_ffmpeg(args, reporter, "Merging", duration, user_id=user_id)
+
+
+def discard_partial(output_path: str):
+    """Drop resumable state once the target was produced some other way"""
+    shutil.rmtree(f"{output_path}.parts", ignore_errors=True)
+    DownloadJournal(output_path, None, 'segments', {}).discard()
+
+
+async def download_hls(url: str, output_path: str, status_msg=None, filename: str = "video",
+                       user_id=None, probe: dict = None) -> Optional[str]:
+    """Fetch every segment of an HLS stream in parallel, then remux with ffmpeg - `probe` from probe_hls"""
+    work_dir = f"{output_path}.parts"
+    os.makedirs(work_dir, exist_ok=True)
+
+    journal = None
+    completed = False
+
+    try:
+        session = await get_session()
+        playlist, validators = await resolve_media_playlist(url, probe)
+        segments = playlist.segments
+        total = len(segments)
+
+        segment_files = [f"seg_{i:05d}.ts" for i in range(total)]
+        journal = DownloadJournal.open(output_path, url, 'segments', validators)
+        finished = {
+            i for i in journal.segments
+            if 0 <= i < total and os.path.exists(os.path.join(work_dir, segment_files[i]))
+        }
+        journal.segments = finished
+        if finished:
+            print(f"Resuming {filename}: {len(finished)}/{total} segments on disk")
+
+        key_files = {}
+        init_files = {}
+        for segment in segments:
+            key = segment.key
+            if key and key.method == 'AES-128' and key.absolute_uri not in key_files:
+                name = f"key_{len(key_files)}.bin"
+                await fetch_to_file(session, key.absolute_uri, os.path.join(work_dir, name))
+                key_files[key.absolute_uri] = name
+
+            init = segment.init_section
+            if init and init.absolute_uri not in init_files:
+                name = f"init_{len(init_files)}.mp4"
+                await fetch_to_file(session, init.absolute_uri, os.path.join(work_dir, name))
+                init_files[init.absolute_uri] = name
+
+        state = {'done': len(finished), 'bytes': sum(
+            os.path.getsize(os.path.join(work_dir, segment_files[i])) for i in finished
+        )}
+        semaphore = asyncio.Semaphore(Config.HLS_CONCURRENCY)
+
+        async def fetch_segment(index: int):
+            async with semaphore:
+                if is_cancelled(user_id):
+                    raise asyncio.CancelledError()
+                size = await fetch_to_file(
+                    session,
+                    segments[index].absolute_uri,
+                    os.path.join(work_dir, segment_files[index])
+                )
+                journal.mark_segment(index)
+                state['done'] += 1
+                state['bytes'] += size
+
+        async def report_progress():
+            reporter = reporter_for(status_msg, "Downloading HLS", filename, state['bytes'])
+            while True:
+                await asyncio.sleep(1)
+                if not state['done']:
+                    continue
+                estimated = int(state['bytes'] / state['done'] * total)
+                reporter.ud_type = f"Downloading HLS ({state['done']}/{total})"
+                await reporter.update(state['bytes'], estimated)
+
+        tasks = [
+            asyncio.ensure_future(fetch_segment(i))
+            for i in range(total) if i not in finished
+        ]
+        monitor = asyncio.ensure_future(report_progress()) if status_msg else None
+
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if is_cancelled(user_id):
+                return None
+            raise
+        finally:
+            if monitor:
+                monitor.cancel()
+
+        playlist_path = os.path.join(work_dir, "local.m3u8")
+        async with aiofiles.open(playlist_path, 'w') as f:
+            await f.write(build_local_playlist(playlist, segment_files, key_files, init_files))
+
+        if status_msg:
+            try:
+                await status_msg.edit_text(
+                    f"🔄 **Merging {total} segments**\n\n"
+                    f"`{filename[:40]}...`"
+                )
+            except:
+                pass
+
+        reporter = reporter_for(status_msg, "Merging", filename, stage="ffmpeg")
+        duration = sum(segment.duration or 0 for segment in segments)
+        if not await remux_local_playlist(playlist_path, output_path, reporter, duration, user_id):
+            return None
+
+        if os.path.exists(output_path) and os.path.getsize(output_path) > 1000:
+            completed = True
+            return output_path
+        return None
+
+    finally:
+        if journal and journal.has_progress and not completed and not is_cancelled(user_id):
+            # Keep finished segments so the next attempt can skip them
+            journal.save(force=True)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            if journal:
+                journal.discard()
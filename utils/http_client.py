@@ -0,0 +1,53 @@
+import aiohttp
+from config import Config
+
+
+class HTTPClientManager:
+    """One process-wide aiohttp session so every request reuses keep-alive connections"""
+
+    def __init__(self):
+        self._session = None
+
+    async def start(self):
+        if self._session and not self._session.closed:
+            return self._session
+
+        connector = aiohttp.TCPConnector(
+            limit=Config.HTTP_POOL_LIMIT,
+            limit_per_host=Config.HTTP_LIMIT_PER_HOST,
+            ttl_dns_cache=Config.HTTP_DNS_TTL,
+            keepalive_timeout=Config.HTTP_KEEPALIVE,
+            force_close=False,
+            enable_cleanup_closed=True
+        )
+
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=60,
+            sock_read=120
+        )
+
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Shared session - never close it, it's owned by the bot"""
+        if not self._session or self._session.closed:
+            await self.start()
+        return self._session
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+http_client = HTTPClientManager()
+
+
+async def get_session() -> aiohttp.ClientSession:
+    return await http_client.get_session()
+
+
+# Short per-request timeout for JSON API calls
+API_TIMEOUT = aiohttp.ClientTimeout(total=30)
@@ -1,11 +1,12 @@
 import aiohttp
 import aiofiles
-import asyncio
 import os
-import subprocess
 from typing import Optional
+from utils.progress import reporter_for
+from utils.ffmpeg_runner import run_ffmpeg, ffmpeg_runner
 
-async def download_m3u8_video(url: str, output_path: str, status_msg=None, filename="video") -> Optional[str]:
+async def download_m3u8_video(url: str, output_path: str, status_msg=None, filename="video",
+                              user_id=None) -> Optional[str]:
     """Download M3U8 with ffmpeg - Simple & Reliable"""
     try:
         os.makedirs("downloads", exist_ok=True)
@@ -21,14 +22,12 @@ async def download_m3u8_video(url: str, output_path: str, status_msg=None, filen
         print(f"📁 Output: {output_path}")
         
         # Use ffmpeg directly - most reliable
-        command = [
-            'ffmpeg',
+        args = [
             '-i', url,
             '-c', 'copy',
             '-bsf:a', 'aac_adtstoasc',
             '-y',
             '-loglevel', 'error',
-            '-stats',
             output_path
         ]
         
@@ -40,15 +39,10 @@ async def download_m3u8_video(url: str, output_path: str, status_msg=None, filen
                 f"This may take a few minutes..."
             )
         
-        process = await asyncio.create_subprocess_exec(
-            *command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        reporter = reporter_for(status_msg, "Downloading M3U8", filename)
+        ok = await run_ffmpeg(args, reporter, "Downloading M3U8", user_id=user_id, stage="download", remote=True)
         
-        stdout, stderr = await process.communicate()
-        
-        if process.returncode == 0:
+        if ok:
             if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
                 print(f"✅ Download successful: {os.path.getsize(output_path)} bytes")
                 return output_path
@@ -56,8 +50,7 @@ async def download_m3u8_video(url: str, output_path: str, status_msg=None, filen
                 print(f"❌ File empty or doesn't exist")
                 return None
         else:
-            print(f"❌ FFmpeg failed with code {process.returncode}")
-            print(f"Error: {stderr.decode()[:500]}")
+            print(f"❌ FFmpeg failed: {ffmpeg_runner.last_error[:500]}")
             return None
             
     except Exception as e:
@@ -67,18 +60,12 @@ async def download_m3u8_video(url: str, output_path: str, status_msg=None, filen
         return None
 
 
-async def download_m3u8_simple(url: str, output_path: str) -> Optional[str]:
+async def download_m3u8_simple(url: str, output_path: str, user_id=None) -> Optional[str]:
     """Fallback simple method"""
     try:
-        command = ['ffmpeg', '-i', url, '-c', 'copy', '-y', output_path]
-        
-        process = await asyncio.create_subprocess_exec(
-            *command,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
+        args = ['-i', url, '-c', 'copy', '-y', output_path]
         
-        await process.communicate()
+        await run_ffmpeg(args, label="Downloading M3U8", user_id=user_id, remote=True)
         
         if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
             return output_path
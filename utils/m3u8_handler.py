@@ -1,17 +1,15 @@
-import subprocess
-import asyncio
 import os
 from typing import Optional
+from utils.ffmpeg_runner import run_ffmpeg
 
-async def download_m3u8_video(url: str, output_path: str) -> bool:
+async def download_m3u8_video(url: str, output_path: str, user_id=None) -> bool:
     """Download M3U8 stream using ffmpeg"""
     try:
         # Ensure output directory exists
         os.makedirs(os.path.dirname(output_path) if os.path.dirname(output_path) else "downloads", exist_ok=True)
         
-        # FFmpeg command
-        command = [
-            'ffmpeg',
+        # FFmpeg arguments - the runner adds the binary and progress flags
+        args = [
             '-i', url,
             '-c', 'copy',
             '-bsf:a', 'aac_adtstoasc',
@@ -19,16 +17,9 @@ async def download_m3u8_video(url: str, output_path: str) -> bool:
             output_path
         ]
         
-        # Run ffmpeg
-        process = await asyncio.create_subprocess_exec(
-            *command,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
+        ok = await run_ffmpeg(args, label="Downloading M3U8", user_id=user_id, remote=True)
         
-        await process.communicate()
-        
-        return process.returncode == 0 and os.path.exists(output_path)
+        return ok and os.path.exists(output_path)
         
     except Exception as e:
         print(f"M3U8 download error: {e}")
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from typing import Optional
+from utils.ffmpeg_runner import run_ffmpeg
+from utils.thumbnail import write_thumbnail, THUMB_DIR
+from config import Config
+
+# Where in the video the thumbnail frame is taken
+THUMB_OFFSET_RATIO = 0.1
+THUMB_MAX_OFFSET = 60
+# Telegram drops thumbnails bigger than 320px
+THUMB_SIZE = 320
+
+# content hash -> media info, so the same file shared by several requesters is probed once
+_cache = OrderedDict()
+# Probes sit in the upload path - their own small pool, never queued behind conversions
+_probe_slots = asyncio.Semaphore(Config.PROBE_MAX_PROCESSES)
+
+
+def parse_probe(data: dict) -> dict:
+    """Duration, display size and codecs out of ffprobe's JSON"""
+    info = {"duration": 0, "width": 0, "height": 0, "video_codec": None, "audio_codec": None}
+
+    try:
+        info["duration"] = int(float(data.get("format", {}).get("duration") or 0))
+    except ValueError:
+        pass
+
+    for stream in data.get("streams", []):
+        codec_type = stream.get("codec_type")
+        if codec_type == "video" and not info["video_codec"]:
+            # Cover art shows up as a one-frame video stream
+            if stream.get("disposition", {}).get("attached_pic"):
+                continue
+            info["video_codec"] = stream.get("codec_name")
+            width, height = stream.get("width") or 0, stream.get("height") or 0
+
+            rotation = stream.get("tags", {}).get("rotate")
+            for side_data in stream.get("side_data_list", []):
+                rotation = side_data.get("rotation", rotation)
+            try:
+                if abs(int(float(rotation or 0))) in (90, 270):
+                    width, height = height, width
+            except ValueError:
+                pass
+
+            info["width"], info["height"] = width, height
+            if not info["duration"]:
+                try:
+                    info["duration"] = int(float(stream.get("duration") or 0))
+                except ValueError:
+                    pass
+        elif codec_type == "audio" and not info["audio_codec"]:
+            info["audio_codec"] = stream.get("codec_name")
+
+    return info
+
+
+async def run_ffprobe(path: str) -> Optional[dict]:
+    command = [
+        'ffprobe', '-v', 'error', '-print_format', 'json',
+        '-show_format', '-show_streams', path
+    ]
+    async with _probe_slots:
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), Config.PROBE_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            print(f"FFprobe timeout: {path}")
+            return None
+
+    if process.returncode != 0:
+        print(f"FFprobe error: {stderr.decode(errors='ignore')[:300]}")
+        return None
+    return json.loads(stdout or b'{}')
+
+
+async def extract_frame(path: str, duration: int) -> Optional[bytes]:
+    """JPEG of a keyframe a little into the video, sized for a Telegram thumbnail"""
+    os.makedirs(THUMB_DIR, exist_ok=True)
+    fd, out_path = tempfile.mkstemp(prefix="frame_", suffix=".jpg", dir=THUMB_DIR)
+    os.close(fd)
+
+    try:
+        offset = min(duration * THUMB_OFFSET_RATIO, THUMB_MAX_OFFSET)
+        # Short or unseekable files may have nothing at the offset, so fall back to the start
+        for seek in dict.fromkeys((offset, 0)):
+            args = [
+                '-ss', f"{seek:.2f}",
+                '-skip_frame', 'nokey',
+                '-i', path,
+                '-frames:v', '1',
+                '-vf', f"scale={THUMB_SIZE}:{THUMB_SIZE}:force_original_aspect_ratio=decrease",
+                '-q:v', '4',
+                '-y',
+                '-loglevel', 'error',
+                out_path
+            ]
+            ok = await run_ffmpeg(args, label="Thumbnail", timeout=Config.PROBE_TIMEOUT, retries=0)
+            if ok and os.path.getsize(out_path) > 0:
+                with open(out_path, 'rb') as f:
+                    return f.read()
+        return None
+    finally:
+        try:
+            os.remove(out_path)
+        except OSError:
+            pass
+
+
+async def probe_media(path: str, content_hash: str = None) -> Optional[dict]:
+    """Media info plus a frame thumbnail (`thumb`, JPEG bytes) of a downloaded file"""
+    try:
+        if not content_hash:
+            # No content identity known - only a re-probe of this very file hits the cache
+            stat = os.stat(path)
+            content_hash = f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+        if content_hash in _cache:
+            _cache.move_to_end(content_hash)
+            return _cache[content_hash]
+
+        data = await run_ffprobe(path)
+        if data is None:
+            return None
+
+        info = parse_probe(data)
+        info["thumb"] = await extract_frame(path, info["duration"]) if info["video_codec"] else None
+
+        _cache[content_hash] = info
+        while len(_cache) > Config.PROBE_CACHE_SIZE:
+            _cache.popitem(last=False)
+        return info
+    except Exception as e:
+        print(f"Media probe error: {e}")
+        return None
+
+
+def video_attributes(info: Optional[dict]) -> dict:
+    """send_video keyword arguments for the probed values"""
+    if not info:
+        return {}
+    return {key: info[key] for key in ("duration", "width", "height") if info.get(key)}
+
+
+async def frame_thumbnail(info: Optional[dict]) -> Optional[str]:
+    """Temp file with the probed frame - the caller deletes it after the upload"""
+    if not info or not info.get("thumb"):
+        return None
+    return await asyncio.to_thread(write_thumbnail, info["thumb"])
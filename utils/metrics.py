@@ -0,0 +1,154 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds - covers a DB round trip up to a multi-hour download
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800, 7200)
+
+registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class Metric:
+    """A named family of samples, one per label set. Written from the bot loop,
+    read from the Flask thread, so every access takes the lock."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        # tuple(sorted label items) -> value
+        self.values = {}
+        registry.append(self)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, dict(key), value) for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.function = None
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+    def set_function(self, function):
+        """Read the value from `function` at scrape time instead"""
+        self.function = function
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        try:
+            return [(self.name, {}, self.function())]
+        except Exception:
+            # The owner changed its state under us - skip this scrape
+            return []
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def samples(self):
+        out = []
+        with self.lock:
+            for key, (counts, count, total) in self.values.items():
+                labels = dict(key)
+                for bound, bucket_count in zip(self.buckets, counts):
+                    out.append((f"{self.name}_bucket", dict(labels, le=bound), bucket_count))
+                out.append((f"{self.name}_bucket", dict(labels, le="+Inf"), count))
+                out.append((f"{self.name}_count", labels, count))
+                out.append((f"{self.name}_sum", labels, total))
+        return out
+
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# Downloads
+DOWNLOADS = Counter("serena_downloads_total", "Finished download attempts by kind and result")
+DOWNLOAD_SECONDS = Histogram("serena_download_seconds", "Time spent in one download attempt")
+
+# Uploads
+UPLOADS = Counter("serena_uploads_total", "Pyrogram file uploads by mode and result")
+UPLOAD_SECONDS = Histogram("serena_upload_seconds", "Time spent uploading one file")
+
+# Bytes moved, counted as progress comes in - rate() gives live bytes/sec
+TRANSFER_BYTES = Counter("serena_transfer_bytes_total", "Bytes reported by progress callbacks per stage")
+
+# Database
+DB_SECONDS = Histogram("serena_db_command_seconds", "MongoDB command latency")
+DB_FAILURES = Counter("serena_db_command_failures_total", "Failed MongoDB commands")
+
+# Telegram
+PROGRESS_EDITS = Counter("serena_progress_edits_total", "Status message progress edits by result")
+FLOOD_WAITS = Counter("serena_floodwait_total", "FloodWait errors by source")
+FLOOD_WAIT_SECONDS = Counter("serena_floodwait_seconds_total", "Seconds Telegram asked us to wait")
+
+# Queues and workers - set_function'd by their owners
+QUEUE_WAITING = Gauge("serena_queue_waiting", "Jobs waiting for a download slot")
+QUEUE_RUNNING = Gauge("serena_queue_running", "Jobs holding a download slot")
+FFMPEG_PROCESSES = Gauge("serena_ffmpeg_processes", "Running ffmpeg processes")
+BROADCASTS_RUNNING = Gauge("serena_broadcasts_running", "Broadcasts in progress")
+
+
+def flood_wait(source: str, seconds):
+    FLOOD_WAITS.inc(source=source)
+    FLOOD_WAIT_SECONDS.inc(seconds, source=source)
@@ -1,9 +1,9 @@
-import aiohttp
 import asyncio
 from typing import Dict, List, Optional
 import json
 import re
 from platforms.config import get_platform_config
+from utils.http_client import get_session, API_TIMEOUT
 
 class UniversalPlatformAPI:
     """Universal API client that works with any platform using config"""
@@ -22,13 +22,12 @@ class UniversalPlatformAPI:
         self.data_key = self.config.get('response_data_key', 'data')
     
     async def ensure_session(self):
-        if not self.session or self.session.closed:
-            timeout = aiohttp.ClientTimeout(total=30)
-            self.session = aiohttp.ClientSession(timeout=timeout)
+        # Borrow the bot-wide pool instead of opening a session per client
+        self.session = await get_session()
     
     async def close_session(self):
-        if self.session and not self.session.closed:
-            await self.session.close()
+        # The shared pool is closed by the bot on shutdown
+        self.session = None
     
     def format_payload(self, template: dict, **kwargs) -> dict:
         formatted = {}
@@ -61,7 +60,7 @@ class UniversalPlatformAPI:
             try:
                 print(f"Trying: {url}")
                 
-                async with self.session.post(url, json=payload, headers=self.headers) as resp:
+                async with self.session.post(url, json=payload, headers=self.headers, timeout=API_TIMEOUT) as resp:
                     print(f"Status: {resp.status}")
                     
                     if resp.status == 200:
@@ -111,7 +110,7 @@ class UniversalPlatformAPI:
         payload = {"mobile": phone, "phone": phone}
         
         try:
-            async with self.session.post(url, json=payload, headers=self.headers) as resp:
+            async with self.session.post(url, json=payload, headers=self.headers, timeout=API_TIMEOUT) as resp:
                 if resp.status == 200:
                     data = await resp.json()
                     return data.get('success', False) or data.get('status') == 'success'
@@ -135,7 +134,7 @@ class UniversalPlatformAPI:
         payload = {"mobile": phone, "phone": phone, "otp": otp}
         
         try:
-            async with self.session.post(url, json=payload, headers=self.headers) as resp:
+            async with self.session.post(url, json=payload, headers=self.headers, timeout=API_TIMEOUT) as resp:
                 if resp.status == 200:
                     data = await resp.json()
                     token = data.get(self.token_key) or data.get('token')
@@ -166,7 +165,7 @@ class UniversalPlatformAPI:
         try:
             print(f"Fetching batches from {url}")
             
-            async with self.session.get(url, headers=headers) as resp:
+            async with self.session.get(url, headers=headers, timeout=API_TIMEOUT) as resp:
                 print(f"Status: {resp.status}")
                 
                 if resp.status == 200:
@@ -220,7 +219,7 @@ class UniversalPlatformAPI:
         try:
             print(f"Fetching content from {url}")
             
-            async with self.session.get(url, headers=headers) as resp:
+            async with self.session.get(url, headers=headers, timeout=API_TIMEOUT) as resp:
                 print(f"Status: {resp.status}")
                 
                 if resp.status == 200:
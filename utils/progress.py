@@ -1,63 +1,170 @@
 import time
 import math
+from collections import OrderedDict
+from pyrogram.errors import FloodWait, MessageNotModified
+from utils.metrics import TRANSFER_BYTES, PROGRESS_EDITS, flood_wait
+from config import Config
 
-async def progress_for_pyrogram(current, total, ud_type, message, start, filename=""):
+class ProgressReporter:
     """
-    Enhanced progress with error handling
+    Progress edits for one status message.
+    
+    Edits at most once per `interval` seconds, skips edits whose text didn't
+    change, smooths speed with an EWMA and backs off on FloodWait. Pass
+    `reporter.update` as a Pyrogram `progress` callback or call it directly.
     """
-    try:
-        now = time.time()
+    
+    SPEED_ALPHA = 0.3
+    MAX_INTERVAL = 60
+    # Metric label - ud_type is display text and carries counters and speeds
+    STAGES = ("download", "upload", "ffmpeg")
+    
+    def __init__(self, message, ud_type="Downloading", filename="", interval=None, stage="download"):
+        self.message = message
+        self.ud_type = ud_type
+        self.filename = filename
+        self.stage = stage
+        self.interval = interval or Config.PROGRESS_UPDATE_DELAY
+        self.start = time.time()
+        self.last_edit = 0
+        self.last_text = None
+        self.blocked_until = 0
+        self.speed = 0
+        self.sample = (self.start, 0)
+        self.counted = 0
+    
+    def reset(self, ud_type=None, filename=None, current=0, stage=None):
+        """Reuse the reporter (and its FloodWait state) for the next stage.
+        `current` is what was already done before this stage, e.g. a resumed download."""
+        if ud_type is not None:
+            self.ud_type = ud_type
+        if filename is not None:
+            self.filename = filename
+        if stage is not None:
+            self.stage = stage
+        self.start = time.time()
+        self.speed = 0
+        self.sample = (self.start, current)
+        self.counted = current
+        self.last_text = None
+        return self
+    
+    def _measure(self, now, current):
+        last_time, last_current = self.sample
+        elapsed = now - last_time
+        if elapsed < 0.5 or current < last_current:
+            return
         
-        # Ensure start is valid
-        if not isinstance(start, (int, float)):
-            start = time.time()
+        instant = (current - last_current) / elapsed
+        if self.speed:
+            self.speed = self.SPEED_ALPHA * instant + (1 - self.SPEED_ALPHA) * self.speed
+        else:
+            self.speed = instant
+        self.sample = (now, current)
+    
+    async def update(self, current, total=0, *args):
+        if current > self.counted:
+            TRANSFER_BYTES.inc(current - self.counted, stage=self.stage)
+            self.counted = current
+        
+        if not self.message:
+            return
+        
+        now = time.time()
+        self._measure(now, current)
         
-        diff = now - start
+        if now < self.blocked_until:
+            return
         
-        # Update every 5 seconds to reduce API calls
-        if diff < 1 or (round(diff % 5) != 0 and current != total):
+        finished = total and current >= total
+        if not finished and now - self.last_edit < self.interval:
             return
         
-        if total == 0:
+        text = render_progress(
+            current, total, self.ud_type, self.filename,
+            self.speed, now - self.start
+        )
+        if text == self.last_text:
             return
         
-        percentage = current * 100 / total
-        speed = current / diff if diff > 0 else 0
+        try:
+            await self.message.edit_text(text)
+            self.last_text = text
+            PROGRESS_EDITS.inc(result="ok")
+        except FloodWait as e:
+            self.blocked_until = now + e.value
+            self.interval = min(self.interval * 2, self.MAX_INTERVAL)
+            PROGRESS_EDITS.inc(result="flood")
+            flood_wait("progress", e.value)
+        except MessageNotModified:
+            self.last_text = text
+            PROGRESS_EDITS.inc(result="not_modified")
+        except Exception:
+            PROGRESS_EDITS.inc(result="error")
+        
+        self.last_edit = now
+
+def render_progress(current, total, ud_type, filename, speed, elapsed):
+    """Status text for a transfer - total may be 0 when the size is unknown"""
+    if len(filename) > 40:
+        filename = filename[:37] + "..."
+    
+    text = f"**{ud_type}**\n\n"
+    text += f"`{filename}`\n"
+    text += f"**to server**\n\n"
+    
+    if total:
+        percentage = min(current * 100 / total, 100)
         eta_seconds = round((total - current) / speed) if speed > 0 else 0
         
         # Progress bar
         filled = math.floor(percentage / 5)
-        empty = 20 - filled
-        bar = "●" * filled + "○" * empty
-        
-        # Format
-        eta = format_time(eta_seconds)
-        elapsed = format_time(int(diff))
-        current_size = humanbytes(current)
-        total_size = humanbytes(total)
-        speed_fmt = humanbytes(speed)
+        bar = "●" * filled + "○" * (20 - filled)
         
-        # Truncate filename
-        if len(filename) > 40:
-            filename = filename[:37] + "..."
-        
-        # Create message
-        text = f"**{ud_type}**\n\n"
-        text += f"`{filename}`\n"
-        text += f"**to server**\n\n"
         text += f"[{bar}]\n"
         text += f"◌ **Progress😉:** 〘 {percentage:.2f}% 〙\n"
-        text += f"**Done:** 〘{current_size} of {total_size}〙\n"
-        text += f"◌ **Speed🚀:** 〘 {speed_fmt}/s 〙\n"
-        text += f"◌ **Time Left⏳:** 〘 {eta} 〙\n"
-        text += f"⏱️ **Elapsed:** 〘 {elapsed} 〙"
+        text += f"**Done:** 〘{humanbytes(current)} of {humanbytes(total)}〙\n"
+        text += f"◌ **Speed🚀:** 〘 {humanbytes(speed)}/s 〙\n"
+        text += f"◌ **Time Left⏳:** 〘 {format_time(eta_seconds)} 〙\n"
+    else:
+        text += f"**Done:** 〘{humanbytes(current)}〙\n"
+        text += f"◌ **Speed🚀:** 〘 {humanbytes(speed)}/s 〙\n"
+    
+    text += f"⏱️ **Elapsed:** 〘 {format_time(int(elapsed))} 〙"
+    return text
+
+# One reporter per status message, so FloodWait backoff carries across stages
+_reporters = OrderedDict()
+_MAX_REPORTERS = 500
+
+def reporter_for(message, ud_type="Downloading", filename="", current=0, stage="download"):
+    """Reporter of a status message, reset for a new stage - `stage` is one of ProgressReporter.STAGES"""
+    if not message:
+        return ProgressReporter(None, ud_type, filename, stage=stage)
+    
+    key = (message.chat.id, message.id)
+    reporter = _reporters.get(key)
+    if reporter is None:
+        reporter = _reporters[key] = ProgressReporter(message, ud_type, filename, stage=stage)
+        while len(_reporters) > _MAX_REPORTERS:
+            _reporters.popitem(last=False)
+    else:
+        _reporters.move_to_end(key)
+    
+    return reporter.reset(ud_type, filename, current, stage)
+
+async def progress_for_pyrogram(current, total, ud_type, message, start, filename=""):
+    """
+    Legacy progress callback - delegates to the message's ProgressReporter
+    """
+    try:
+        key = (message.chat.id, message.id)
+        reporter = _reporters.get(key)
+        if reporter is None or reporter.ud_type != ud_type or reporter.filename != filename:
+            reporter = reporter_for(message, ud_type, filename)
         
-        try:
-            await message.edit_text(text)
-        except:
-            pass
-            
-    except Exception as e:
+        await reporter.update(current, total)
+    except Exception:
         pass
 
 def humanbytes(size):
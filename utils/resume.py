@@ -0,0 +1,136 @@
+import json
+import os
+import time
+
+# Sidecar journals let an interrupted download pick up where it stopped
+JOURNAL_SUFFIX = ".journal"
+SAVE_INTERVAL = 2
+
+
+def journal_path(target_path: str) -> str:
+    return f"{target_path}{JOURNAL_SUFFIX}"
+
+
+def response_validators(headers, content_length=None) -> dict:
+    """Pick the headers that tell us whether a remote file changed"""
+    return {
+        "etag": headers.get("etag"),
+        "last_modified": headers.get("last-modified"),
+        "content_length": content_length,
+    }
+
+
+class DownloadJournal:
+    """Completed byte ranges (direct files) or segment indices (HLS) of one target"""
+
+    def __init__(self, target_path: str, url: str, kind: str, validators: dict):
+        self.path = journal_path(target_path)
+        self.url = url
+        self.kind = kind
+        self.validators = validators
+        self.ranges = []
+        self.segments = set()
+        self.last_save = 0
+
+    @classmethod
+    def open(cls, target_path: str, url: str, kind: str, validators: dict) -> "DownloadJournal":
+        """Load a matching journal, or start a fresh one when missing or stale"""
+        journal = cls(target_path, url, kind, validators)
+
+        try:
+            with open(journal.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return journal
+
+        if not journal.matches(data):
+            print(f"Stale journal discarded: {journal.path}")
+            journal.discard()
+            return journal
+
+        journal.ranges = [tuple(r) for r in data.get("ranges", [])]
+        journal.segments = set(data.get("segments", []))
+        return journal
+
+    def matches(self, data: dict) -> bool:
+        """A journal is only trusted when the remote file is provably unchanged"""
+        if data.get("url") != self.url or data.get("kind") != self.kind:
+            return False
+
+        if data.get("validators") != self.validators:
+            return False
+
+        # Byte ranges can only be reused when the server gave a strong validator
+        if self.kind == "ranges":
+            return bool(self.validators.get("etag") or self.validators.get("last_modified"))
+        return True
+
+    @property
+    def has_progress(self) -> bool:
+        return bool(self.ranges or self.segments)
+
+    # ---- Direct files ----
+
+    def mark_range(self, start: int, end: int):
+        """Record an inclusive byte range as written, merging neighbours"""
+        merged = []
+        for s, e in sorted(self.ranges + [(start, end)]):
+            if merged and s <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+            else:
+                merged.append((s, e))
+        self.ranges = merged
+        self.save()
+
+    def missing_ranges(self, total_size: int):
+        """Inclusive byte ranges of [0, total_size) not yet written"""
+        missing = []
+        pos = 0
+        for s, e in self.ranges:
+            if s > pos:
+                missing.append((pos, s - 1))
+            pos = max(pos, e + 1)
+        if pos < total_size:
+            missing.append((pos, total_size - 1))
+        return missing
+
+    def done_bytes(self) -> int:
+        return sum(e - s + 1 for s, e in self.ranges)
+
+    # ---- HLS ----
+
+    def mark_segment(self, index: int):
+        self.segments.add(index)
+        self.save()
+
+    # ---- Persistence ----
+
+    def save(self, force: bool = False):
+        """Write the journal, at most once per SAVE_INTERVAL unless forced"""
+        now = time.time()
+        if not force and now - self.last_save < SAVE_INTERVAL:
+            return
+
+        data = {
+            "url": self.url,
+            "kind": self.kind,
+            "validators": self.validators,
+            "ranges": self.ranges,
+            "segments": sorted(self.segments),
+        }
+
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+            self.last_save = now
+        except OSError as e:
+            print(f"Journal save error: {e}")
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
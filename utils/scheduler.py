@@ -0,0 +1,192 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from utils.progress import format_time
+from utils.metrics import QUEUE_WAITING, QUEUE_RUNNING
+from config import Config
+
+# Priority lanes - lower runs first
+LANE_OWNER = 0
+LANE_PREMIUM = 1
+LANE_FREE = 2
+
+LANE_NAMES = {LANE_OWNER: "Owner", LANE_PREMIUM: "Premium", LANE_FREE: "Free"}
+
+
+class JobCancelled(Exception):
+    """Raised when a queued job is dropped by /cancel before it started"""
+
+
+class Ticket:
+    def __init__(self, user_id, lane, label, cancellable=True):
+        self.user_id = user_id
+        self.lane = lane
+        self.label = label
+        # Shared work is only queued under a user for fairness, their /cancel doesn't drop it
+        self.cancellable = cancellable
+        self.enqueued_at = time.time()
+        self.started_at = None
+        self.future = asyncio.get_running_loop().create_future()
+
+
+def lane_for(user_id, is_premium):
+    if user_id in Config.OWNERS:
+        return LANE_OWNER
+    return LANE_PREMIUM if is_premium else LANE_FREE
+
+
+class DownloadScheduler:
+    """Global download slots with per-user caps, priority lanes and per-user round-robin"""
+
+    def __init__(self, max_concurrent, per_user):
+        self.max_concurrent = max_concurrent
+        self.per_user = per_user
+        # lane -> user_id -> deque of waiting tickets, users kept in round-robin order
+        self.lanes = {lane: OrderedDict() for lane in LANE_NAMES}
+        self.running = []
+        self.avg_duration = 120.0
+
+    def running_for(self, user_id):
+        return sum(1 for t in self.running if t.user_id == user_id)
+
+    def _dispatch(self):
+        """Hand free slots to waiting tickets, highest lane first, users taking turns"""
+        for lane in sorted(self.lanes):
+            users = self.lanes[lane]
+
+            while len(self.running) < self.max_concurrent:
+                picked = None
+                for user_id in list(users):
+                    if self.running_for(user_id) < self.per_user:
+                        picked = user_id
+                        break
+
+                if picked is None:
+                    break
+
+                ticket = users[picked].popleft()
+                if users[picked]:
+                    users.move_to_end(picked)
+                else:
+                    del users[picked]
+
+                ticket.started_at = time.time()
+                self.running.append(ticket)
+                ticket.future.set_result(True)
+
+    def _remove_waiting(self, ticket):
+        users = self.lanes[ticket.lane]
+        waiting = users.get(ticket.user_id)
+        if waiting and ticket in waiting:
+            waiting.remove(ticket)
+            if not waiting:
+                del users[ticket.user_id]
+
+    async def acquire(self, user_id, lane, label="", status_msg=None, cancellable=True):
+        ticket = Ticket(user_id, lane, label, cancellable)
+        self.lanes[lane].setdefault(user_id, deque()).append(ticket)
+        self._dispatch()
+
+        try:
+            while not ticket.future.done():
+                if status_msg:
+                    position, eta = self.position(ticket)
+                    try:
+                        await status_msg.edit_text(
+                            f"⏳ **Queued**\n\n"
+                            f"`{label[:40]}`\n\n"
+                            f"📊 Position: {position}\n"
+                            f"🕐 Starts in: ~{format_time(int(eta))}\n\n"
+                            f"💡 /queue to check, /cancel to stop"
+                        )
+                    except:
+                        pass
+                await asyncio.wait([ticket.future], timeout=Config.ETA_UPDATE_INTERVAL * 6)
+        except asyncio.CancelledError:
+            self._remove_waiting(ticket)
+            if ticket in self.running:
+                self.release(ticket)
+            raise
+
+        if not ticket.future.result():
+            raise JobCancelled()
+        return ticket
+
+    def release(self, ticket):
+        if ticket in self.running:
+            self.running.remove(ticket)
+            duration = time.time() - ticket.started_at
+            self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_id, lane, label="", status_msg=None, cancellable=True):
+        ticket = await self.acquire(user_id, lane, label, status_msg, cancellable)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def cancel_user(self, user_id):
+        """Drop every cancellable waiting ticket of a user, returns how many were dropped"""
+        dropped = 0
+        for users in self.lanes.values():
+            waiting = users.get(user_id)
+            if not waiting:
+                continue
+            
+            kept = deque()
+            for ticket in waiting:
+                if ticket.cancellable:
+                    ticket.future.set_result(False)
+                    dropped += 1
+                else:
+                    kept.append(ticket)
+            
+            if kept:
+                users[user_id] = kept
+            else:
+                del users[user_id]
+        return dropped
+
+    def waiting_order(self):
+        """Waiting tickets in the order they are expected to start"""
+        order = []
+        for lane in sorted(self.lanes):
+            queues = [list(q) for q in self.lanes[lane].values()]
+            depth = max((len(q) for q in queues), default=0)
+            for i in range(depth):
+                order.extend(q[i] for q in queues if i < len(q))
+        return order
+
+    def position(self, ticket):
+        """1-based queue position and estimated seconds until the ticket starts"""
+        order = self.waiting_order()
+        if ticket not in order:
+            return 0, 0
+
+        position = order.index(ticket) + 1
+        now = time.time()
+        elapsed = [now - t.started_at for t in self.running]
+        first_free = max(0, self.avg_duration - max(elapsed)) if elapsed else 0
+        waves = (position - 1) // max(self.max_concurrent, 1)
+        return position, first_free + waves * self.avg_duration
+
+    def user_view(self, user_id):
+        """(running tickets, [(ticket, position, eta)]) for one user"""
+        running = [t for t in self.running if t.user_id == user_id]
+        waiting = [
+            (t, *self.position(t))
+            for t in self.waiting_order() if t.user_id == user_id
+        ]
+        return running, waiting
+
+    @property
+    def waiting_count(self):
+        return sum(len(q) for users in self.lanes.values() for q in users.values())
+
+
+scheduler = DownloadScheduler(Config.MAX_CONCURRENT_DOWNLOADS, Config.MAX_DOWNLOADS_PER_USER)
+QUEUE_WAITING.set_function(lambda: scheduler.waiting_count)
+QUEUE_RUNNING.set_function(lambda: len(scheduler.running))
@@ -0,0 +1,249 @@
+import asyncio
+import fcntl
+import glob
+import hashlib
+import itertools
+import os
+import shutil
+import time
+import psutil
+from contextlib import asynccontextmanager
+from utils.helpers import normalize_url
+from config import Config
+
+SCRATCH_ROOT = Config.SCRATCH_ROOT
+# Held with flock while a process uses the dir - the OS drops it when the process dies
+LOCK_NAME = ".lock"
+
+
+class ScratchFull(Exception):
+    """The file can never fit on the disk, even with every other job gone"""
+
+
+def disk_usage_of(path: str) -> int:
+    """Bytes a download occupies - the file itself plus its .parts/.split dirs and journal"""
+    total = 0
+    for candidate in (path, f"{path}.journal"):
+        try:
+            total += os.path.getsize(candidate)
+        except OSError:
+            pass
+
+    for folder in (f"{path}.parts", f"{path}.split"):
+        for root, _, files in os.walk(folder):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+    return total
+
+
+def scratch_key(url: str) -> str:
+    """Dir name for a link - a retry or a restart lands where the partial download is"""
+    return hashlib.sha1(normalize_url(url).encode()).hexdigest()[:16]
+
+
+def has_journal(folder: str) -> bool:
+    return bool(glob.glob(os.path.join(glob.escape(folder), "*.journal")))
+
+
+def try_lock(folder: str):
+    """Lock file descriptor for `folder`, None while someone else holds it"""
+    os.makedirs(folder, exist_ok=True)
+    lock_path = os.path.join(folder, LOCK_NAME)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # The dir was purged between our open and the flock - the lock guards nothing
+        if os.fstat(fd).st_ino != os.stat(lock_path).st_ino:
+            raise OSError("scratch dir removed")
+        return fd
+    except OSError:
+        os.close(fd)
+        return None
+
+
+class ScratchJob:
+    """One job's private directory and the bytes it has reserved"""
+
+    def __init__(self, manager, job_id: str, lock: int):
+        self.manager = manager
+        self.job_id = job_id
+        self.path = os.path.join(SCRATCH_ROOT, job_id)
+        self.lock = lock
+        # file path -> reserved bytes
+        self.reservations = {}
+
+    def path_for(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def outstanding(self) -> int:
+        """Reserved bytes not written to disk yet"""
+        return sum(
+            max(0, reserved - disk_usage_of(path))
+            for path, reserved in self.reservations.items()
+        )
+
+    async def reserve(self, path: str, nbytes: int, status_msg=None):
+        await self.manager.reserve(self, path, nbytes, status_msg)
+
+    async def discard(self, path: str):
+        """Delete one finished or failed file and give its space back"""
+        for candidate in (path, f"{path}.journal"):
+            try:
+                os.remove(candidate)
+            except OSError:
+                pass
+        shutil.rmtree(f"{path}.parts", ignore_errors=True)
+        shutil.rmtree(f"{path}.split", ignore_errors=True)
+
+        if self.reservations.pop(path, None) is not None:
+            await self.manager.notify()
+
+    async def cleanup(self, keep_partial=False):
+        """Remove the dir - with `keep_partial`, journaled partials stay for the next attempt"""
+        if not (keep_partial and has_journal(self.path)):
+            shutil.rmtree(self.path, ignore_errors=True)
+        if self.lock is not None:
+            os.close(self.lock)
+            self.lock = None
+        self.reservations.clear()
+        self.manager.jobs.pop(self.job_id, None)
+        await self.manager.notify()
+
+
+class ScratchManager:
+    """
+    Hands every job its own directory under SCRATCH_ROOT and admits a
+    download only when its expected size fits in free disk minus what other
+    jobs reserved but haven't written yet. Dirs are named by a stable key
+    and locked while in use, so several processes can share the root and
+    partial downloads survive a restart.
+    """
+
+    def __init__(self, min_free: int):
+        self.min_free = min_free
+        self.jobs = {}
+        self.changed = asyncio.Condition()
+        self._ids = itertools.count(1)
+
+    def _remove_idle(self, keep=None):
+        """Delete unlocked dirs, except those `keep(name, folder)` wants - bytes freed"""
+        os.makedirs(SCRATCH_ROOT, exist_ok=True)
+        freed = 0
+        for name in os.listdir(SCRATCH_ROOT):
+            folder = os.path.join(SCRATCH_ROOT, name)
+            if not os.path.isdir(folder):
+                continue
+            lock = try_lock(folder)
+            if lock is None:
+                # A live process (maybe us) is using it
+                continue
+            try:
+                if keep and keep(name, folder):
+                    continue
+                freed += sum(
+                    os.path.getsize(os.path.join(root, f))
+                    for root, _, files in os.walk(folder) for f in files
+                )
+                shutil.rmtree(folder, ignore_errors=True)
+            finally:
+                os.close(lock)
+        return freed
+
+    def purge_stale(self, wanted=()):
+        """
+        Remove dirs no running process holds. Partials with a journal stay
+        while a stored job still wants their link (`wanted` scratch keys) or
+        for SCRATCH_PARTIAL_TTL after their last write.
+        """
+        def resumable(name, folder):
+            journals = glob.glob(os.path.join(glob.escape(folder), "*.journal"))
+            if not journals:
+                return False
+            if name.split('.')[0] in wanted:
+                return True
+            newest = max(os.path.getmtime(j) for j in journals)
+            return time.time() - newest < Config.SCRATCH_PARTIAL_TTL
+
+        self._remove_idle(resumable)
+
+    def free_disk(self) -> int:
+        os.makedirs(SCRATCH_ROOT, exist_ok=True)
+        return psutil.disk_usage(SCRATCH_ROOT).free
+
+    def outstanding(self, exclude_path=None) -> int:
+        return sum(
+            max(0, reserved - disk_usage_of(path))
+            for job in self.jobs.values()
+            for path, reserved in job.reservations.items()
+            if path != exclude_path
+        )
+
+    def available(self, exclude_path=None) -> int:
+        return self.free_disk() - self.min_free - self.outstanding(exclude_path)
+
+    async def reserve(self, job: ScratchJob, path: str, nbytes: int, status_msg=None):
+        """Wait until `nbytes` for `path` fit the disk budget, then hold them"""
+        # A retry of the same file already owns what it wrote
+        needed = max(0, nbytes - disk_usage_of(path))
+
+        if needed > self.available(path):
+            # Partials kept for a later resume are only a cache, make room first
+            await asyncio.to_thread(self._remove_idle)
+
+        # Not sent under the lock, a slow edit would hold up every other reservation
+        if status_msg and needed > self.available(path):
+            try:
+                await status_msg.edit_text(
+                    "💾 **Waiting for disk space**\n\n"
+                    "Other downloads are using the disk right now,\n"
+                    "this one starts as soon as space frees up."
+                )
+            except:
+                pass
+
+        async with self.changed:
+            while needed > self.available(path):
+                # Nobody else holds space that could come back - waiting can't help
+                others = any(p != path for j in self.jobs.values() for p in j.reservations)
+                if not others:
+                    raise ScratchFull(f"needs {needed} more bytes than the disk can spare")
+                # Space can also free up outside our view, so re-check now and then
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout=10)
+                except asyncio.TimeoutError:
+                    pass
+
+            job.reservations[path] = nbytes
+
+    async def notify(self):
+        async with self.changed:
+            self.changed.notify_all()
+
+    def open_job(self, key: str) -> ScratchJob:
+        """
+        Scratch dir named `key` - the caller must `await job.cleanup()` when
+        done. If another process holds that name, a one-off dir is used.
+        """
+        job_id = key
+        lock = try_lock(os.path.join(SCRATCH_ROOT, job_id))
+        if lock is None:
+            job_id = f"{key}.{os.getpid()}.{next(self._ids)}"
+            lock = try_lock(os.path.join(SCRATCH_ROOT, job_id))
+
+        job = self.jobs[job_id] = ScratchJob(self, job_id, lock)
+        return job
+
+    @asynccontextmanager
+    async def job(self, key: str):
+        """Scratch dir for one job, removed with everything in it on exit"""
+        job = self.open_job(key)
+        try:
+            yield job
+        finally:
+            await job.cleanup()
+
+
+scratch = ScratchManager(Config.SCRATCH_MIN_FREE_DISK)
@@ -0,0 +1,182 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Optional
+from pyrogram.errors import FloodWait
+from utils.helpers import normalize_url, is_cancelled, CancelToken
+from utils.file_cache import uploaded_media
+from utils.ffmpeg_runner import ffmpeg_runner
+from utils.scheduler import scheduler
+from utils.scratch import scratch, scratch_key
+from utils.universal_downloader import download_any_file
+
+
+class FanoutStatus:
+    """Stands in for a status message and mirrors every edit to all attached requesters"""
+
+    def __init__(self, key):
+        self.messages = []
+        # reporter_for keys reporters by chat and message id
+        self.chat = SimpleNamespace(id="flight")
+        self.id = key
+
+    async def edit_text(self, text, *args, **kwargs):
+        results = await asyncio.gather(
+            *(m.edit_text(text, *args, **kwargs) for m in list(self.messages)),
+            return_exceptions=True
+        )
+        # The reporter backs off on FloodWait - other errors only concern one requester
+        for result in results:
+            if isinstance(result, FloodWait):
+                raise result
+        return self
+
+
+class Flight:
+    """One download shared by everyone who asked for the same link"""
+
+    def __init__(self, key):
+        self.key = key
+        self.job = scratch.open_job(scratch_key(key))
+        self.status = FanoutStatus(key)
+        self.refs = 0
+        self.task = None
+        # Stands in for the user id in the downloaders and ffmpeg, set once nobody wants the file
+        self.token = CancelToken()
+        # The first consumer to upload records its file_id, the rest re-send it
+        self.upload_lock = asyncio.Lock()
+        self.cached = None
+        self.content_hash = None
+        # Failed downloads keep their journaled partial for the next request or restart
+        self.failed = False
+
+
+class SharedFile:
+    """A consumer's handle on a finished flight - release it when done with the file"""
+
+    def __init__(self, flights, flight, path):
+        self.flights = flights
+        self.flight = flight
+        self.path = path
+        self.released = False
+
+    @property
+    def job(self):
+        return self.flight.job
+
+    @property
+    def upload_lock(self):
+        return self.flight.upload_lock
+
+    @property
+    def cached(self):
+        return self.flight.cached
+
+    @property
+    def content_hash(self):
+        return self.flight.content_hash
+
+    def set_content(self, content_hash, cached):
+        self.flight.content_hash = content_hash
+        self.flight.cached = self.flight.cached or cached
+
+    def remember(self, sent):
+        """Keep the uploaded file_id so the next consumer re-sends instead of uploading"""
+        found = uploaded_media(sent) if sent else None
+        if found:
+            self.flight.cached = {'file_id': found[1].file_id}
+
+    async def release(self):
+        if not self.released:
+            self.released = True
+            await self.flights.detach(self.flight)
+
+
+class SingleFlight:
+    """
+    Concurrent requests for the same normalized URL share one download. The
+    file lives in the link's scratch dir and is removed when the last
+    consumer releases it - unless the download failed part way, then the
+    partial stays so the next attempt resumes it.
+    """
+
+    def __init__(self):
+        self.flights = {}
+
+    async def _run(self, flight, url, filename, user_id, lane, probe):
+        # Queued under the first requester for fairness, but their /cancel only detaches
+        # them - the flight stops when the last consumer is gone
+        async with scheduler.slot(user_id, lane, filename, flight.status, cancellable=False):
+            return await download_any_file(url, filename, flight.status, flight.token, flight.job, probe)
+
+    async def fetch(self, url, filename, status_msg, user_id, lane, token=None, probe=None) -> Optional[SharedFile]:
+        """
+        `token` is the consumer's own cancel handle, their active task's flag when
+        not given. `probe` (probe_link) saves the download asking the server again.
+        """
+        key = normalize_url(url)
+        flight = self.flights.get(key)
+
+        if flight is None:
+            flight = self.flights[key] = Flight(key)
+            flight.task = asyncio.ensure_future(self._run(flight, url, filename, user_id, lane, probe))
+        elif status_msg:
+            try:
+                await status_msg.edit_text(
+                    f"🔗 **Joined a running download**\n\n"
+                    f"`{filename[:40]}`\n\n"
+                    f"Someone already requested this file, sharing their download."
+                )
+            except:
+                pass
+
+        flight.refs += 1
+        if status_msg:
+            flight.status.messages.append(status_msg)
+
+        try:
+            while not flight.task.done():
+                await asyncio.wait({flight.task}, timeout=1)
+                if is_cancelled(token or user_id):
+                    await self.detach(flight, status_msg)
+                    return None
+        except asyncio.CancelledError:
+            await self.detach(flight, status_msg)
+            raise
+
+        if status_msg in flight.status.messages:
+            flight.status.messages.remove(status_msg)
+
+        path = None
+        if not flight.task.cancelled() and not flight.task.exception():
+            path = flight.task.result()
+
+        if not path:
+            flight.failed = True
+            # Later requesters start over instead of joining a failed flight
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            await self.detach(flight)
+            return None
+
+        return SharedFile(self, flight, path)
+
+    async def detach(self, flight, status_msg=None):
+        if status_msg in flight.status.messages:
+            flight.status.messages.remove(status_msg)
+
+        flight.refs -= 1
+        if flight.refs > 0:
+            return
+
+        if not flight.task.done():
+            flight.token.cancel()
+            ffmpeg_runner.cancel_user(flight.token)
+            flight.task.cancel()
+            await asyncio.gather(flight.task, return_exceptions=True)
+
+        if self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
+        await flight.job.cleanup(keep_partial=flight.failed)
+
+
+singleflight = SingleFlight()
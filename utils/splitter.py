@@ -0,0 +1,140 @@
+import asyncio
+import os
+import shutil
+from typing import List, Optional
+from utils.ffmpeg_runner import run_ffmpeg
+from utils.helpers import is_cancelled
+from utils.media_probe import probe_media
+from utils.progress import reporter_for
+from config import Config
+
+VIDEO_EXTENSIONS = ['mp4', 'mkv', 'avi', 'mov', 'flv', 'wmv', 'webm']
+COPY_CHUNK = 4 * 1024 * 1024
+# Keyframes rarely land on the target, aim under the limit and shrink on overshoot
+SEGMENT_HEADROOM = 0.9
+SEGMENT_ATTEMPTS = 3
+
+
+def upload_limit(client) -> int:
+    """Largest file we send in one piece"""
+    telegram_limit = (4000 if client.me.is_premium else 2000) * 1024 * 1024
+    return min(Config.TG_SPLIT_SIZE, telegram_limit)
+
+
+def parts_needed(size: int, limit: int) -> int:
+    return max(1, -(-size // limit))
+
+
+def planned_parts(probe, limit: int) -> int:
+    """Parts a link will be sent in, from its probe_link size - 0 if unknown"""
+    size = probe['size'] if probe else 0
+    return parts_needed(size, limit) if size else 0
+
+
+def split_dir(path: str) -> str:
+    return f"{path}.split"
+
+
+def _listed(folder: str) -> List[str]:
+    return sorted(
+        os.path.join(folder, name) for name in os.listdir(folder) if name != "done"
+    )
+
+
+def _split_bytes(path: str, folder: str, limit: int) -> List[str]:
+    name = os.path.basename(path)
+    total = parts_needed(os.path.getsize(path), limit)
+    parts = []
+
+    with open(path, 'rb') as source:
+        for number in range(1, total + 1):
+            part_path = os.path.join(folder, f"{name}.{number:03d}")
+            written = 0
+            with open(part_path, 'wb') as out:
+                while written < limit:
+                    chunk = source.read(min(COPY_CHUNK, limit - written))
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    written += len(chunk)
+            parts.append(part_path)
+    return parts
+
+
+async def _split_video(path: str, folder: str, limit: int, status_msg=None, user_id=None) -> Optional[List[str]]:
+    info = await probe_media(path)
+    duration = info.get("duration") if info else 0
+    if not duration:
+        return None
+
+    stem, ext = os.path.splitext(os.path.basename(path))
+    size = os.path.getsize(path)
+    segment_time = duration * limit * SEGMENT_HEADROOM / size
+    reporter = reporter_for(status_msg, "Splitting", os.path.basename(path), stage="ffmpeg") if status_msg else None
+
+    for attempt in range(SEGMENT_ATTEMPTS):
+        args = [
+            '-i', path,
+            '-map', '0:v:0',
+            '-map', '0:a?',
+            '-c', 'copy',
+            '-f', 'segment',
+            '-segment_time', f"{segment_time:.2f}",
+            '-segment_start_number', '1',
+            '-reset_timestamps', '1',
+            '-y',
+            '-loglevel', 'error',
+            os.path.join(folder, f"{stem} Part %03d{ext}")
+        ]
+        if not await run_ffmpeg(args, reporter, "Splitting", duration, user_id=user_id):
+            return None
+
+        parts = _listed(folder)
+        biggest = max((os.path.getsize(p) for p in parts), default=0)
+        if parts and biggest <= limit:
+            return parts
+
+        # A long keyframe gap made a part too big, cut shorter
+        for part in parts:
+            os.remove(part)
+        segment_time *= limit * SEGMENT_HEADROOM / max(biggest, 1)
+
+    return None
+
+
+async def split_file(path: str, limit: int, job=None, status_msg=None, user_id=None) -> Optional[List[str]]:
+    """
+    Cut `path` into parts of at most `limit` bytes - playable keyframe-aligned
+    segments for videos, plain byte chunks otherwise. Parts are kept next to
+    the file, so everyone sharing the download reuses them.
+    """
+    folder = split_dir(path)
+    if os.path.exists(os.path.join(folder, "done")):
+        return _listed(folder)
+
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+
+    if job:
+        # The parts need as much room again as the file itself
+        await job.reserve(path, os.path.getsize(path) * 2, status_msg)
+
+    parts = None
+    if path.split('.')[-1].lower() in VIDEO_EXTENSIONS:
+        parts = await _split_video(path, folder, limit, status_msg, user_id)
+        if is_cancelled(user_id):
+            return None
+        if parts is None:
+            print(f"Video split failed, splitting by bytes: {os.path.basename(path)}")
+            shutil.rmtree(folder, ignore_errors=True)
+            os.makedirs(folder)
+
+    if parts is None:
+        parts = await asyncio.to_thread(_split_bytes, path, folder, limit)
+
+    open(os.path.join(folder, "done"), 'w').close()
+    return parts
+
+
+def part_caption(caption: str, number: int, total: int) -> str:
+    return f"{caption}\n\n📦 Part {number}/{total}"
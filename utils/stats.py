@@ -0,0 +1,39 @@
+import asyncio
+import psutil
+from utils.file_cache import uploaded_media
+from config import Config
+
+
+async def record_transfer(client, sent):
+    """Count the size of a delivered file towards today's bytes"""
+    found = uploaded_media(sent) if sent else None
+    if not found or not found[1].file_size:
+        return
+    try:
+        await client.db.count_transfer(found[1].file_size)
+    except Exception as e:
+        print(f"Stats transfer error: {e}")
+
+
+def _sample_system():
+    # cpu_percent with an interval blocks for it, so this runs in a thread
+    return {
+        "cpu": psutil.cpu_percent(interval=0.5),
+        "ram": psutil.virtual_memory().percent,
+        "disk": psutil.disk_usage('/').percent
+    }
+
+
+async def system_stats():
+    """CPU, RAM and disk usage without blocking the event loop"""
+    return await asyncio.to_thread(_sample_system)
+
+
+async def stats_loop(client):
+    """Recount the counters now and then - every write keeps them current in between"""
+    while True:
+        try:
+            await client.db.reconcile_stats()
+        except Exception as e:
+            print(f"Stats reconcile error: {e}")
+        await asyncio.sleep(Config.STATS_RECONCILE_INTERVAL)
@@ -0,0 +1,161 @@
+import asyncio
+import functools
+import inspect
+import mimetypes
+from typing import Optional
+from pyrogram import raw, StopTransmission
+from pyrogram.session import Session
+from utils.helpers import clean_filename, is_cancelled
+from utils.http_client import get_session
+from config import Config
+
+# Telegram's upload part size - every part but the last must be exactly this big
+PART_SIZE = 512 * 1024
+PART_RETRIES = 3
+
+STREAM_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': '*/*'
+}
+
+
+class StreamSeekRequired(Exception):
+    """Upload needs bytes that were already streamed - retry from disk"""
+
+
+class StreamSource:
+    """
+    A download being read straight into an upload. Only forward reads are
+    possible; memory stays at a few upload parts plus aiohttp's read buffer.
+    """
+
+    def __init__(self, response, name: str, size: int, user_id=None):
+        self.response = response
+        self.name = name
+        self.size = size
+        self.user_id = user_id
+        self.position = 0
+
+    async def read(self, size: int) -> bytes:
+        """Next `size` bytes, shorter only at the end of the stream"""
+        chunks = []
+        wanted = size
+        while wanted:
+            chunk = await self.response.content.read(wanted)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            wanted -= len(chunk)
+
+        data = b''.join(chunks)
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self.response.release()
+
+
+def stream_name(filename: str, content_type: str) -> str:
+    name = clean_filename(filename)
+    if '.' not in name or len(name.split('.')[-1]) > 5:
+        ext = mimetypes.guess_extension((content_type or '').split(';')[0].strip())
+        name += ext or '.mp4'
+    return name
+
+
+async def open_stream(url: str, filename: str, size_limit: int, user_id=None) -> Optional[StreamSource]:
+    """Start a direct download for streaming, None when it has to go through disk"""
+    lowered = url.lower()
+    if '.m3u8' in lowered or '/hls' in lowered or '.ts' in lowered:
+        return None
+
+    session = await get_session()
+    response = await session.get(url, headers=STREAM_HEADERS)
+
+    size = int(response.headers.get('content-length', 0))
+    encoded = response.headers.get('content-encoding', 'identity') != 'identity'
+
+    # Big-file uploads need the part count up front, so the size must be exact
+    if response.status != 200 or encoded or not Config.STREAM_MIN_SIZE < size <= size_limit:
+        response.release()
+        return None
+
+    name = stream_name(filename, response.headers.get('content-type'))
+    return StreamSource(response, name, size, user_id)
+
+
+async def upload_stream(client, source: StreamSource, file_id=None, file_part=0,
+                        progress=None, progress_args=()):
+    """Pyrogram's save_file for a StreamSource, parts are sent as they arrive"""
+    if file_id is not None or file_part or source.position:
+        # Telegram asked for a part again, or the stream was already used
+        raise StreamSeekRequired(f"part {file_part} of {source.name}")
+
+    file_total_parts = -(-source.size // PART_SIZE)
+    file_id = client.rnd_id()
+    failed = []
+
+    async def worker(session):
+        while True:
+            rpc = await queue.get()
+            if rpc is None:
+                return
+
+            for attempt in range(1, PART_RETRIES + 1):
+                try:
+                    await session.invoke(rpc)
+                    break
+                except Exception as e:
+                    if attempt == PART_RETRIES:
+                        failed.append(e)
+                    else:
+                        await asyncio.sleep(attempt)
+
+    async with client.save_file_semaphore:
+        session = Session(
+            client, await client.storage.dc_id(), await client.storage.auth_key(),
+            await client.storage.test_mode(), is_media=True
+        )
+        queue = asyncio.Queue(1)
+        workers = [client.loop.create_task(worker(session)) for _ in range(4)]
+
+        try:
+            await session.start()
+
+            for part in range(file_total_parts):
+                if is_cancelled(source.user_id):
+                    raise StopTransmission()
+                if failed:
+                    raise StreamSeekRequired(f"part upload failed: {failed[0]}")
+
+                chunk = await source.read(PART_SIZE)
+                if not chunk:
+                    raise StreamSeekRequired(f"stream ended at {source.position}/{source.size}")
+
+                await queue.put(raw.functions.upload.SaveBigFilePart(
+                    file_id=file_id,
+                    file_part=part,
+                    file_total_parts=file_total_parts,
+                    bytes=chunk
+                ))
+
+                if progress:
+                    func = functools.partial(progress, source.position, source.size, *progress_args)
+                    if inspect.iscoroutinefunction(progress):
+                        await func()
+                    else:
+                        await client.loop.run_in_executor(client.executor, func)
+        finally:
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            await session.stop()
+
+    if failed:
+        raise StreamSeekRequired(f"part upload failed: {failed[0]}")
+
+    return raw.types.InputFileBig(
+        id=file_id,
+        parts=file_total_parts,
+        name=source.name
+    )
@@ -0,0 +1,76 @@
+import asyncio
+import io
+import os
+import random
+import tempfile
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+
+SIZE = (1280, 720)
+TEXT = "Serena Lec"
+THUMB_DIR = "downloads"
+
+COLORS = [
+    (74, 144, 226),   # Blue
+    (236, 100, 75),   # Red
+    (255, 152, 0),    # Orange
+    (67, 160, 71),    # Green
+    (142, 36, 170),   # Purple
+]
+
+FONT_PATHS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "arial.ttf",
+]
+
+
+@lru_cache(maxsize=8)
+def load_font(size: int):
+    for path in FONT_PATHS:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            pass
+    return ImageFont.load_default()
+
+
+@lru_cache(maxsize=len(COLORS))
+def gradient(color) -> Image.Image:
+    """`color` at the top fading to 70% of it at the bottom"""
+    # linear_gradient is a 256px black-to-white ramp - stretched, it blends one colour into the other
+    mask = Image.linear_gradient('L').resize(SIZE)
+    dark = tuple(int(c * 0.7) for c in color)
+    return Image.composite(Image.new('RGB', SIZE, dark), Image.new('RGB', SIZE, color), mask)
+
+
+@lru_cache(maxsize=16)
+def rendered(color, text: str = TEXT) -> bytes:
+    """Finished JPEG bytes - every thumbnail of the same colour and text is identical"""
+    img = gradient(color).copy()
+    draw = ImageDraw.Draw(img)
+    font = load_font(100)
+
+    # Centered, with a drop shadow
+    bbox = draw.textbbox((0, 0), text, font=font)
+    position = ((SIZE[0] - (bbox[2] - bbox[0])) // 2, (SIZE[1] - (bbox[3] - bbox[1])) // 2)
+    draw.text((position[0] + 3, position[1] + 3), text, fill=(0, 0, 0), font=font)
+    draw.text(position, text, fill=(255, 255, 255), font=font)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def write_thumbnail(data: bytes) -> str:
+    """Unique file per call - the caller deletes it after the upload"""
+    os.makedirs(THUMB_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="thumb_", suffix=".jpg", dir=THUMB_DIR)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    return path
+
+
+async def render_thumbnail(color=None, text: str = TEXT) -> str:
+    """Path of a fresh thumbnail file, drawing and encoding off the event loop"""
+    data = await asyncio.to_thread(rendered, color or random.choice(COLORS), text)
+    return await asyncio.to_thread(write_thumbnail, data)
@@ -4,18 +4,56 @@ import asyncio
 import os
 import subprocess
 import re
+import time
 from typing import Optional
-from utils.progress import progress_for_pyrogram
-from utils.helpers import clean_filename
+from utils.progress import reporter_for
+from utils.helpers import clean_filename, is_cancelled
+from utils.hls_downloader import download_hls, discard_partial, playlist_duration, probe_hls, HLSError
+from utils.ffmpeg_runner import run_ffmpeg
+from utils.resume import DownloadJournal, response_validators
+from utils.http_client import get_session
+from utils.scratch import ScratchFull
+from utils.metrics import DOWNLOADS, DOWNLOAD_SECONDS
 from config import Config
-import time
 
-async def download_any_file(url: str, filename: str, status_msg, user_id=None) -> Optional[str]:
-    """Universal downloader with error handling"""
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': '*/*'
+}
+
+def is_stream(url: str) -> bool:
+    lowered = url.lower()
+    return '.m3u8' in lowered or '/hls' in lowered
+
+async def probe_link(url: str, is_m3u8: bool = None) -> Optional[dict]:
+    """Ask the server about a link once - size, range support or the resolved playlist, passed on to later steps"""
+    if is_m3u8 is None:
+        is_m3u8 = is_stream(url)
+    try:
+        if is_m3u8:
+            probe = await probe_hls(url)
+        else:
+            size, ranges, validators = await probe_ranges(await get_session(), url, HEADERS)
+            probe = {'size': size, 'ranges': ranges, 'validators': validators}
+    except Exception as e:
+        print(f"Link probe error: {e}")
+        return None
+    
+    probe.update(url=url, m3u8=is_m3u8, at=time.time())
+    return probe
+
+def probe_usable(probe: Optional[dict], url: str, is_m3u8: bool) -> bool:
+    """Same link and still fresh - signed segment URLs expire while a job waits in the queue"""
+    return bool(probe) and probe['url'] == url and probe['m3u8'] == is_m3u8 \
+        and time.time() - probe['at'] < Config.LINK_PROBE_TTL
+
+async def download_any_file(url: str, filename: str, status_msg, user_id=None, job=None,
+                            probe=None) -> Optional[str]:
+    """Universal downloader with error handling - `job` is the caller's ScratchJob, `probe` from probe_link"""
     try:
         clean_name = clean_filename(filename)
         
-        is_m3u8 = '.m3u8' in url.lower() or '/hls' in url.lower()
+        is_m3u8 = is_stream(url)
         is_ts_chunk = '.ts' in url.lower() and ('master' in url.lower() or 'hls' in url.lower())
         
         if is_ts_chunk and not is_m3u8:
@@ -40,21 +78,80 @@ async def download_any_file(url: str, filename: str, status_msg, user_id=None) -
             else:
                 clean_name += '.mp4'
         
-        file_path = f"downloads/{clean_name}"
-        os.makedirs("downloads", exist_ok=True)
+        if not probe_usable(probe, url, is_m3u8):
+            probe = await probe_link(url, is_m3u8)
         
-        if is_m3u8:
-            return await download_m3u8_fast(url, file_path, status_msg, filename)
+        if job:
+            file_path = job.path_for(clean_name)
+            try:
+                await job.reserve(file_path, estimate_size(probe, is_m3u8), status_msg)
+            except ScratchFull as e:
+                print(f"Not enough disk for {clean_name}: {e}")
+                return None
         else:
-            return await download_direct_fast(url, file_path, status_msg, filename, user_id)
+            file_path = f"downloads/{clean_name}"
+            os.makedirs("downloads", exist_ok=True)
+        
+        # Failed attempts leave a journal behind, so retries resume instead of restarting
+        for attempt in range(Config.DOWNLOAD_RETRIES + 1):
+            if attempt:
+                print(f"Retrying {clean_name} ({attempt}/{Config.DOWNLOAD_RETRIES})")
+                await asyncio.sleep(Config.DOWNLOAD_DELAY)
+                # A resume is checked against what the server says now
+                probe = await probe_link(url, is_m3u8)
+            
+            kind = "m3u8" if is_m3u8 else "direct"
+            with DOWNLOAD_SECONDS.time(kind=kind):
+                if is_m3u8:
+                    result = await download_m3u8_fast(url, file_path, status_msg, filename, user_id, probe)
+                else:
+                    result = await download_direct_fast(url, file_path, status_msg, filename, user_id, probe)
+            DOWNLOADS.inc(kind=kind, result="ok" if result else "failed")
+            
+            if result or is_cancelled(user_id):
+                return result
+        
+        return None
             
     except Exception as e:
         print(f"Download error: {e}")
         return None
 
 
-async def download_m3u8_fast(url: str, output_path: str, status_msg, filename: str) -> Optional[str]:
-    """Fast M3U8 download"""
+def estimate_size(probe: Optional[dict], is_m3u8: bool) -> int:
+    """Bytes to reserve on disk before downloading"""
+    expected = probe['size'] if probe else 0
+    if is_m3u8:
+        # Segments and the merged file sit on disk together for a moment
+        expected *= 2
+    
+    return expected or Config.SCRATCH_DEFAULT_RESERVE
+
+
+async def download_m3u8_fast(url: str, output_path: str, status_msg, filename: str, user_id=None,
+                             probe=None) -> Optional[str]:
+    """
+    Fast M3U8 download - parallel segment fetch. Only playlists the native
+    fetcher can't handle go to ffmpeg; any other failure returns None so the
+    caller's retry resumes from the segment journal instead of starting over.
+    """
+    try:
+        return await download_hls(url, output_path, status_msg, filename, user_id, probe)
+    except HLSError as e:
+        print(f"Native HLS unavailable: {e}")
+    except Exception as e:
+        print(f"Native HLS error: {e}")
+        return None
+    
+    result = await download_m3u8_ffmpeg(url, output_path, status_msg, filename, user_id, probe)
+    if result:
+        discard_partial(output_path)
+    return result
+
+
+async def download_m3u8_ffmpeg(url: str, output_path: str, status_msg, filename: str,
+                               user_id=None, probe=None) -> Optional[str]:
+    """M3U8 download with ffmpeg fetching the stream itself"""
     try:
         if status_msg:
             try:
@@ -66,8 +163,7 @@ async def download_m3u8_fast(url: str, output_path: str, status_msg, filename: s
             except:
                 pass
         
-        command = [
-            'ffmpeg',
+        args = [
             '-headers', 'User-Agent: Mozilla/5.0',
             '-reconnect', '1',
             '-reconnect_streamed', '1',
@@ -80,45 +176,13 @@ async def download_m3u8_fast(url: str, output_path: str, status_msg, filename: s
             output_path
         ]
         
-        start_time = time.time()
-        last_update = start_time
-        
-        process = await asyncio.create_subprocess_exec(
-            *command,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
+        # EXTINF total turns ffmpeg's out_time into a real percentage
+        duration = await playlist_duration(url, probe)
+        reporter = reporter_for(status_msg, "Downloading M3U8", filename)
         
-        # Monitor progress
-        while True:
-            await asyncio.sleep(3)
-            
-            # Check if process finished
-            if process.returncode is not None:
-                break
-            
-            try:
-                await asyncio.wait_for(process.wait(), timeout=0.1)
-                break
-            except asyncio.TimeoutError:
-                pass
-            
-            # Update status
-            if os.path.exists(output_path) and status_msg:
-                elapsed = time.time() - start_time
-                if time.time() - last_update > 5:
-                    size_mb = os.path.getsize(output_path) / (1024*1024)
-                    
-                    try:
-                        await status_msg.edit_text(
-                            f"📥 **Downloading M3U8**\n\n"
-                            f"`{filename[:40]}...`\n\n"
-                            f"📦 {size_mb:.2f} MB\n"
-                            f"⏱️ {int(elapsed)}s"
-                        )
-                        last_update = time.time()
-                    except:
-                        pass
+        if not await run_ffmpeg(args, reporter, "Downloading M3U8", duration, user_id=user_id, stage="download",
+                                remote=True):
+            return None
         
         if os.path.exists(output_path) and os.path.getsize(output_path) > 1000:
             return output_path
@@ -130,71 +194,220 @@ async def download_m3u8_fast(url: str, output_path: str, status_msg, filename: s
         return None
 
 
-async def download_direct_fast(url: str, output_path: str, status_msg, filename: str, user_id=None) -> Optional[str]:
-    """Fast direct download"""
+async def download_direct_fast(url: str, output_path: str, status_msg, filename: str, user_id=None,
+                               probe=None) -> Optional[str]:
+    """Fast direct download - parallel ranges when supported, single stream otherwise"""
     try:
-        from plugins.download import active_tasks
-        
-        connector = aiohttp.TCPConnector(
-            limit=50,
-            limit_per_host=20,
-            ttl_dns_cache=300,
-            force_close=False,
-            enable_cleanup_closed=True
-        )
+        session = await get_session()
+        headers = HEADERS
         
-        timeout = aiohttp.ClientTimeout(
-            total=None,
-            connect=60,
-            sock_read=120
-        )
+        if probe:
+            total_size, supports_ranges, validators = probe['size'], probe['ranges'], probe['validators']
+        else:
+            total_size, supports_ranges, validators = await probe_ranges(session, url, headers)
         
-        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': '*/*'
-            }
-            
-            async with session.get(url, headers=headers) as resp:
-                if resp.status != 200:
-                    print(f"HTTP {resp.status}")
-                    return None
-                
-                total_size = int(resp.headers.get('content-length', 0))
-                downloaded = 0
-                start_time = time.time()
-                
-                # Ensure file can be written
-                try:
-                    async with aiofiles.open(output_path, 'wb') as f:
-                        async for chunk in resp.content.iter_chunked(Config.CHUNK_SIZE):
-                            if user_id and user_id in active_tasks and active_tasks[user_id].get('cancelled'):
-                                return None
-                            
-                            await f.write(chunk)
-                            downloaded += len(chunk)
-                            
-                            # Update progress
-                            if status_msg:
-                                try:
-                                    await progress_for_pyrogram(
-                                        downloaded,
-                                        total_size,
-                                        "Downloading",
-                                        status_msg,
-                                        start_time,
-                                        filename
-                                    )
-                                except:
-                                    pass
-                except Exception as write_error:
-                    print(f"Write error: {write_error}")
-                    return None
-                
-                if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                    return output_path
-                return None
+        if (supports_ranges and Config.DOWNLOAD_CONNECTIONS > 1
+                and total_size >= Config.MIN_SPLIT_SIZE):
+            try:
+                return await download_ranged(
+                    session, url, headers, output_path, total_size,
+                    validators, status_msg, filename, user_id
+                )
+            except RangeNotSupported as e:
+                print(f"Ranged download fallback: {e}")
+        
+        return await download_single_stream(
+            session, url, headers, output_path, status_msg, filename, user_id
+        )
                 
     except Exception as e:
         print(f"Direct download error: {e}")
         return None
+
+
+class RangeNotSupported(Exception):
+    """Server stopped honouring Range requests mid-download"""
+
+
+async def probe_ranges(session, url: str, headers: dict):
+    """Return (total_size, supports_ranges, validators) using a one-byte range request"""
+    probe_headers = dict(headers, Range='bytes=0-0')
+    
+    try:
+        async with session.get(url, headers=probe_headers) as resp:
+            if resp.status == 206:
+                content_range = resp.headers.get('content-range', '')
+                match = re.match(r'bytes\s+0-0/(\d+)', content_range)
+                if match:
+                    total_size = int(match.group(1))
+                    return total_size, True, response_validators(resp.headers, total_size)
+                return 0, False, {}
+            
+            # Server ignored the Range header (or Accept-Ranges: none)
+            if resp.status == 200:
+                return int(resp.headers.get('content-length', 0)), False, {}
+            return 0, False, {}
+    except Exception as e:
+        print(f"Range probe error: {e}")
+        return 0, False, {}
+
+
+def split_ranges(missing, parts: int):
+    """Cut the missing inclusive byte ranges into roughly `parts` pieces"""
+    remaining = sum(end - start + 1 for start, end in missing)
+    piece = max(remaining // max(parts, 1), Config.CHUNK_SIZE, 1)
+    
+    ranges = []
+    for start, end in missing:
+        while start <= end:
+            stop = min(start + piece - 1, end)
+            # Don't leave a tiny tail as its own connection
+            if end - stop < piece // 2:
+                stop = end
+            ranges.append((start, stop))
+            start = stop + 1
+    return ranges
+
+
+def preallocate(fd: int, size: int):
+    """Reserve the full file size up front so workers can write anywhere"""
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(fd, size)
+
+
+async def download_ranged(session, url: str, headers: dict, output_path: str, total_size: int,
+                          validators: dict, status_msg, filename: str, user_id=None) -> Optional[str]:
+    """Fetch byte ranges concurrently into a preallocated file with positional writes"""
+    loop = asyncio.get_running_loop()
+    
+    journal = DownloadJournal.open(output_path, url, 'ranges', validators)
+    resuming = journal.has_progress and os.path.exists(output_path) \
+        and os.path.getsize(output_path) == total_size
+    
+    if resuming:
+        print(f"Resuming {filename}: {journal.done_bytes()} of {total_size} bytes on disk")
+        fd = os.open(output_path, os.O_RDWR)
+    else:
+        journal.ranges = []
+        fd = os.open(output_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        preallocate(fd, total_size)
+    
+    state = {'downloaded': journal.done_bytes()}
+    
+    async def fetch_range(start: int, end: int):
+        pos = start
+        attempts = 0
+        
+        while pos <= end:
+            range_headers = dict(headers, Range=f'bytes={pos}-{end}')
+            try:
+                async with session.get(url, headers=range_headers) as resp:
+                    if resp.status != 206:
+                        raise RangeNotSupported(f"HTTP {resp.status} for range {pos}-{end}")
+                    
+                    async for chunk in resp.content.iter_chunked(Config.CHUNK_SIZE):
+                        if is_cancelled(user_id):
+                            raise asyncio.CancelledError()
+                        
+                        chunk = chunk[:end - pos + 1]
+                        await loop.run_in_executor(None, os.pwrite, fd, chunk, pos)
+                        journal.mark_range(pos, pos + len(chunk) - 1)
+                        pos += len(chunk)
+                        state['downloaded'] += len(chunk)
+                        
+                        if pos > end:
+                            break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                attempts += 1
+                if attempts > Config.RANGE_RETRIES:
+                    raise
+                print(f"Range {pos}-{end} retry {attempts}: {e}")
+                await asyncio.sleep(attempts)
+                continue
+            
+            if pos <= end:
+                attempts += 1
+                if attempts > Config.RANGE_RETRIES:
+                    raise aiohttp.ClientPayloadError(f"Range {start}-{end} ended at {pos}")
+    
+    async def report_progress():
+        reporter = reporter_for(status_msg, "Downloading", filename, state['downloaded'])
+        while True:
+            await asyncio.sleep(1)
+            await reporter.update(state['downloaded'], total_size)
+    
+    ranges = split_ranges(journal.missing_ranges(total_size), Config.DOWNLOAD_CONNECTIONS)
+    workers = [asyncio.ensure_future(fetch_range(start, end)) for start, end in ranges]
+    monitor = asyncio.ensure_future(report_progress()) if status_msg else None
+    
+    try:
+        await asyncio.gather(*workers)
+    except BaseException as e:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        
+        if is_cancelled(user_id) or isinstance(e, RangeNotSupported):
+            os.close(fd)
+            fd = None
+            journal.discard()
+            try:
+                os.remove(output_path)
+            except OSError:
+                pass
+            if isinstance(e, RangeNotSupported):
+                raise
+            return None
+        
+        # Keep the partial file and journal so the next attempt can resume
+        journal.save(force=True)
+        raise
+    finally:
+        if monitor:
+            monitor.cancel()
+        if fd is not None:
+            os.close(fd)
+    
+    if not journal.missing_ranges(total_size) and os.path.getsize(output_path) == total_size:
+        journal.discard()
+        return output_path
+    
+    journal.save(force=True)
+    return None
+
+
+async def download_single_stream(session, url: str, headers: dict, output_path: str,
+                                 status_msg, filename: str, user_id=None) -> Optional[str]:
+    """Plain single-connection download"""
+    async with session.get(url, headers=headers) as resp:
+        if resp.status != 200:
+            print(f"HTTP {resp.status}")
+            return None
+        
+        total_size = int(resp.headers.get('content-length', 0))
+        downloaded = 0
+        reporter = reporter_for(status_msg, "Downloading", filename)
+        
+        # Ensure file can be written
+        try:
+            async with aiofiles.open(output_path, 'wb') as f:
+                async for chunk in resp.content.iter_chunked(Config.CHUNK_SIZE):
+                    if is_cancelled(user_id):
+                        return None
+                    
+                    await f.write(chunk)
+                    downloaded += len(chunk)
+                    
+                    await reporter.update(downloaded, total_size)
+        except Exception as write_error:
+            print(f"Write error: {write_error}")
+            return None
+        
+        if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+            return output_path
+        return None
@@ -0,0 +1,45 @@
+import fcntl
+import itertools
+import os
+from bot import Bot
+from config import Config
+
+
+def session_name():
+    """
+    First worker slot on this machine no running worker holds. The slot's
+    session file is reused on the next start, so the bot isn't authorized
+    again every time - and two workers never share one session file.
+    """
+    if Config.WORKER_NAME:
+        return Config.WORKER_NAME, None
+
+    for number in itertools.count(1):
+        name = f"SerenaWorker{number}"
+        fd = os.open(f"{name}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return name, fd
+        except OSError:
+            os.close(fd)
+
+
+class Worker(Bot):
+    """
+    Download/upload worker - no commands, it only runs jobs from the shared
+    Mongo queue. Start as many as needed next to a bot running with
+    WORKER_MODE=frontend.
+    """
+    role = "worker"
+
+    def __init__(self):
+        name, self.slot_lock = session_name()
+        super().__init__(
+            name=name,
+            plugins=None,
+            no_updates=True
+        )
+
+
+if __name__ == "__main__":
+    Worker().run()